@@ -0,0 +1,619 @@
+import asyncio
+import contextlib
+import socket
+import urllib.parse
+import xmlrpc.client
+from collections import defaultdict
+from memoryfs_client import *
+
+# seconds between attempts to take DiskBlocks.rebuild_lock from the event loop (see AsyncDiskBlocks.RowLock)
+REBUILD_LOCK_POLL = 0.001
+
+#### Asyncio client stack
+## Non-blocking versions of the block layer (AsyncDiskBlocks) and of the Lookup, Create, Read, Write and Link
+## operations of the file name layer (AsyncFileName), for a process serving many logical users from one event
+## loop. Block fetches that do not depend on each other are awaited together, and all coroutines share at most
+## `connections` in-flight requests per server.
+##
+## AsyncDiskBlocks wraps a synchronous DiskBlocks for the same volume and shares its stripe layout, checksum
+## algorithm, failure detector state and missed-write sets. Formatting, Resync and Rebuild stay on the
+## DiskBlocks; a Rebuild must not run while AsyncDiskBlocks writes.
+
+
+#### Transport
+
+
+## XML-RPC over asyncio streams to one server
+## At most `connections` requests are in flight at once; streams the server keeps open (HTTP/1.1 keep-alive)
+## are reused, others (memoryfs_server.py answers HTTP/1.0 and closes) are reopened per request.
+## Connection errors and timeouts raise socket.error (OSError), like the synchronous TimeoutTransport.
+
+class AsyncTransport():
+    def __init__(self, url, connections, timeout):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or '/RPC2'
+        # resolved once here: open_connection would otherwise run getaddrinfo in a thread for every request
+        self.address = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)[0][4][0]
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(connections)
+        self.idle = []
+
+    async def Call(self, method, *args):
+        body = xmlrpc.client.dumps(args, method).encode('utf-8')
+        async with self.slots:
+            try:
+                response = await asyncio.wait_for(self.Request(body), self.timeout)
+            except asyncio.TimeoutError:
+                # an OSError only from Python 3.11 on; the failure detector catches socket.error
+                raise socket.timeout('server ' + self.host + ':' + str(self.port) + ' timed out')
+        # raises xmlrpc.client.Fault for a server-side exception
+        return xmlrpc.client.loads(response, use_builtin_types=True)[0][0]
+
+    async def Request(self, body):
+        if len(self.idle) > 0:
+            reader, writer = self.idle.pop()
+        else:
+            reader, writer = await asyncio.open_connection(self.address, self.port)
+        try:
+            writer.write(('POST ' + self.path + ' HTTP/1.1\r\nHost: ' + self.host + ':' + str(self.port) +
+                          '\r\nContent-Type: text/xml\r\nContent-Length: ' + str(len(body)) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+
+            status = (await reader.readline()).decode('latin-1').split()
+            if len(status) < 2:
+                raise ConnectionResetError('server closed the connection')
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+            if 'content-length' in headers:
+                response = await reader.readexactly(int(headers['content-length']))
+            else:
+                response = await reader.read()
+        except BaseException:
+            writer.close()
+            raise
+        if status[1] != '200':
+            writer.close()
+            raise xmlrpc.client.ProtocolError(self.host + ':' + str(self.port) + self.path, int(status[1]), ' '.join(status[2:]), headers)
+
+        if status[0] == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close':
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+
+#### Block layer
+
+
+class AsyncDiskBlocks():
+    def __init__(self, RawBlocks, connections=4):
+        # synchronous DiskBlocks of the same volume: layout tables, checksums, health and missed writes
+        self.RawBlocks = RawBlocks
+        self.N = RawBlocks.N
+        self.transports = {}
+        for i in range(self.N):
+            self.transports[i] = AsyncTransport(RawBlocks.ports[i], connections, RawBlocks.timeout)
+        # Put is a read-modify-write of the parity blocks of a stripe row; one Put or repair per row at a time
+        self.row_locks = defaultdict(asyncio.Lock)
+
+    ## RowLock: holds the row lock of physical block block_num and DiskBlocks.rebuild_lock, which a synchronous
+    ## Put (e.g. of the Reclaimer thread), RepairBlock, Resync and Rebuild batch hold as well
+    ## rebuild_lock is polled so the event loop never blocks on it; it is reentrant, so coroutines of the loop
+    ## share it and the row locks order them. The loop thread itself must not call DiskBlocks.Put meanwhile.
+
+    @contextlib.asynccontextmanager
+    async def RowLock(self, block_num):
+        async with self.row_locks[block_num]:
+            while not self.RawBlocks.rebuild_lock.acquire(blocking=False):
+                await asyncio.sleep(REBUILD_LOCK_POLL)
+            try:
+                yield
+            finally:
+                self.RawBlocks.rebuild_lock.release()
+
+    ## ServerCall: one request to server i through the DiskBlocks failure detector, see DiskBlocks.ServerCall
+
+    async def ServerCall(self, i, method, *args):
+        disk = self.RawBlocks
+        if disk.health[i] == SERVER_DOWN or disk.health[i] == SERVER_PROBING:
+            raise ConnectionRefusedError('server ' + str(i) + ' is down')
+        started = time.perf_counter()
+        try:
+            result = await self.transports[i].Call(method, *args)
+        except socket.error:
+            disk.metrics.RecordRPC(i, method, time.perf_counter() - started, PayloadSize(args), 0, True)
+            disk.RecordFailure(i)
+            raise
+        disk.metrics.RecordRPC(i, method, time.perf_counter() - started, PayloadSize(args), PayloadSize(result))
+        if disk.health[i] == SERVER_SUSPECT:
+            disk.SetHealth(i, SERVER_UP)
+        return result
+
+    async def Get(self, block_number):
+        LOG.Debug('AsyncGet: %s', block_number)
+        if block_number in range(0, TOTAL_NUM_BLOCKS + 1):
+            disk = self.RawBlocks
+            server = disk.map_server[block_number]
+            disk.metrics.Count('block_get', server)
+            return await self.ReadPhysical(server, disk.map_block[block_number])
+
+        LOG.Error('AsyncGet: Block number larger than TOTAL_NUM_BLOCKS: %s', block_number)
+        quit()
+
+    ## GetMany: fetches several blocks concurrently; returns a list in the order of block_numbers
+
+    async def GetMany(self, block_numbers):
+        return list(await asyncio.gather(*[self.Get(b) for b in block_numbers]))
+
+    ## ReadPhysical: see DiskBlocks.ReadPhysical; the checksum and the block are fetched together
+    ## With repair=False a stale or corrupt block is only reconstructed, not written back: Put reads under the
+    ## row lock and overwrites the block anyway
+
+    async def ReadPhysical(self, server, block_num, repair=True):
+        try:
+            if self.RawBlocks.Stale(server, block_num):
+                if not repair:
+                    return await self.Retrieve_Block_Content(server, block_num)
+                return await self.RepairBlock(server, block_num)
+            checksum, cur_content = await asyncio.gather(self.ServerCall(server, 'Get_Checksum', block_num),
+                                                         self.ServerCall(server, 'Get', block_num))
+            if checksum == self.RawBlocks.Checksum(cur_content):
+                return bytearray(cur_content)
+            logging.info('AsyncReadPhysical: checksum mismatch on server ' + str(server) + ' block ' + str(block_num))
+            self.RawBlocks.metrics.Count('checksum_mismatches', server)
+            if not repair:
+                return await self.Retrieve_Block_Content(server, block_num)
+            return await self.RepairBlock(server, block_num)
+        except socket.error:
+            return await self.Retrieve_Block_Content(server, block_num)
+
+    ## RepairBlock: reconstructs a block and writes it back to its home server, see DiskBlocks.RepairBlock
+    ## Runs under the row lock, so no Put of the same row lands between the reconstruction and the write-back;
+    ## only the read path repairs (Put must not call it, it holds the row lock already)
+
+    async def RepairBlock(self, server, block_num):
+        disk = self.RawBlocks
+        async with self.RowLock(block_num):
+            trans = await self.Retrieve_Block_Content(server, block_num)
+            rebuild = disk.rebuild
+            if disk.health[server] != SERVER_UP:
+                return trans
+            if rebuild is not None and rebuild['target'] == server and block_num >= rebuild['next_block']:
+                return trans
+            try:
+                await self.ServerCall(server, 'Put', block_num, trans)
+                await self.ServerCall(server, 'Put_Checksum', block_num, disk.Checksum(trans))
+                checksum, content = await asyncio.gather(self.ServerCall(server, 'Get_Checksum', block_num),
+                                                         self.ServerCall(server, 'Get', block_num))
+            except socket.error:
+                return trans
+            if content != trans or checksum != disk.Checksum(content):
+                disk.metrics.Count('failed_repairs', server)
+                return trans
+            disk.missed[server].discard(block_num)
+            disk.metrics.Count('read_repairs', server)
+            return trans
+
+    ## Retrieve_Block_Content: reads the other members of the stripe row concurrently and decodes the block
+
+    async def Retrieve_Block_Content(self, server, block_num):
+        disk = self.RawBlocks
+        disk.metrics.Count('reconstructions', server)
+        others = []
+        for i in range(self.N):
+            if i != server:
+                others.append(i)
+
+        async def Member(i):
+            if disk.Stale(i, block_num):
+                return None
+            try:
+                return await self.ServerCall(i, 'Get', block_num)
+            except socket.error:
+                if disk.parity_count == 1:
+                    raise
+                return None
+
+        members = dict(zip(others, await asyncio.gather(*[Member(i) for i in others])))
+        return disk.Decode(block_num, server, members)
+
+    ## Put: see DiskBlocks.Put and PutBlock; the old data and parity blocks are read together, and the new data,
+    ## parity blocks and checksums are written together
+
+    async def Put(self, block_number, block_data):
+        LOG.Debug('AsyncPut: block number %s len %s', block_number, len(block_data))
+        if len(block_data) > BLOCK_SIZE:
+            LOG.Error('AsyncPut: Block larger than BLOCK_SIZE: %s', len(block_data))
+            quit()
+        if block_number not in range(0, TOTAL_NUM_BLOCKS):
+            LOG.Error('AsyncPut: Block out of range: %s', block_number)
+            quit()
+
+        disk = self.RawBlocks
+        putdata = bytearray(block_data.ljust(BLOCK_SIZE, b'\x00'))
+        data_server_num = disk.map_server[block_number]
+        block_num = disk.map_block[block_number]
+        parity_servers = [disk.map_parity[block_number]]
+        if disk.parity_count == 2:
+            parity_servers.append(disk.map_q[block_number])
+
+        disk.metrics.Count('block_put', data_server_num)
+        for parity_server_num in parity_servers:
+            disk.metrics.Count('block_put', parity_server_num)
+
+        async with self.RowLock(block_num):
+            # a stale or corrupt old block is reconstructed; the writes below replace it
+            old = await asyncio.gather(self.ReadPhysical(data_server_num, block_num, repair=False),
+                                       *[self.ReadPhysical(p, block_num, repair=False) for p in parity_servers])
+            delta = XorBlocks(old[0], putdata)
+            new_blocks = {data_server_num: putdata, parity_servers[0]: XorBlocks(old[1], delta)}
+            if disk.parity_count == 2:
+                index = disk.map_index[block_number]
+                new_blocks[parity_servers[1]] = XorBlocks(old[2], GFMulBlock(GF_EXP[index], delta))
+
+            async def Write(server, content):
+                if disk.Stale(server, block_num):
+                    return
+                try:
+                    await asyncio.gather(self.ServerCall(server, 'Put', block_num, content),
+                                         self.ServerCall(server, 'Put_Checksum', block_num, disk.Checksum(content)))
+                except socket.error:
+                    disk.missed[server].add(block_num)
+
+            await asyncio.gather(*[Write(server, content) for server, content in new_blocks.items()])
+        # the inode table cache of a mounted DiskBlocks sees these writes too, as it sees those of DiskBlocks.Put
+        index = block_number - INODE_BLOCK_OFFSET
+        if disk.inode_table is not None and 0 <= index < INODE_NUM_BLOCKS:
+            disk.inode_table.LoadBlock(index, putdata)
+        return 0
+
+
+#### Inode number layer
+
+
+class AsyncInodeNumber():
+    def __init__(self, FileObject, number):
+        self.inode = Inode()
+        if number > MAX_NUM_INODES:
+            LOG.Error('AsyncInodeNumber: inode number exceeds limit: %s', number)
+            quit()
+        self.inode_number = number
+        self.FileObject = FileObject
+        self.RawBlocks = FileObject.RawBlocks
+
+    ## Returns the raw block holding this inode, and the slice of the block it occupies
+
+    def Location(self):
+        raw_block_number = INODE_BLOCK_OFFSET + ((self.inode_number * INODE_SIZE) // BLOCK_SIZE)
+        start = (self.inode_number * INODE_SIZE) % BLOCK_SIZE
+        return raw_block_number, start, start + INODE_SIZE
+
+    async def InodeNumberToInode(self):
+        raw_block_number, start, end = self.Location()
+        tempblock = await self.RawBlocks.Get(raw_block_number)
+        self.inode.InodeFromBlock(tempblock, start)
+
+    ## Stores this inode; the Get/update/Put of the shared inode block holds the block's lock
+
+    async def StoreInode(self):
+        raw_block_number, start, end = self.Location()
+        async with self.FileObject.block_locks[raw_block_number]:
+            tempblock = await self.RawBlocks.Get(raw_block_number)
+            self.inode.InodeToBlock(tempblock, start)
+            await self.RawBlocks.Put(raw_block_number, tempblock)
+
+
+#### File name layer
+
+
+## Async Lookup, Create, Read, Write and Link with the semantics of FileName
+## Coroutines of one process are kept consistent by asyncio locks: inode_locks serialize operations that modify
+## one inode (a Write to a file, an entry added to a directory, a refcnt update), block_locks the read-modify-write
+## of shared metadata blocks (inode table, free bitmap) and inode_alloc_lock the search for a free inode.
+## Lock order: inode lock(s), then inode_alloc_lock, then block locks, then the reclaimer's bitmap_lock.
+
+class AsyncFileName():
+    def __init__(self, RawBlocks):
+        # RawBlocks is an AsyncDiskBlocks
+        self.RawBlocks = RawBlocks
+        self.inode_locks = defaultdict(asyncio.Lock)
+        self.block_locks = defaultdict(asyncio.Lock)
+        self.inode_alloc_lock = asyncio.Lock()
+        self.helpers = FileName(None)
+
+    async def LoadInode(self, number):
+        inode_number = AsyncInodeNumber(self, number)
+        await inode_number.InodeNumberToInode()
+        return inode_number
+
+    ## Returns the data blocks of an inode holding bytes [offset, offset+count), fetched together
+    ## Holes (block number 0) are not fetched; they come back as zero blocks
+
+    async def InodeBlocks(self, inode_number, offset, count):
+        if count <= 0:
+            return []
+        first = offset // BLOCK_SIZE
+        last = (offset + count - 1) // BLOCK_SIZE
+        block_numbers = inode_number.inode.block_numbers[first:last + 1]
+        fetched = iter(await self.RawBlocks.GetMany([b for b in block_numbers if b != 0]))
+        return [next(fetched) if b != 0 else bytearray(BLOCK_SIZE) for b in block_numbers]
+
+    ## Lookup string filename in the context of inode dir; all directory blocks are fetched together
+
+    async def Lookup(self, filename, dir):
+        LOG.Debug('AsyncLookup: %s, %s', filename, dir)
+        inode_number = await self.LoadInode(dir)
+        if inode_number.inode.type != INODE_TYPE_DIR:
+            LOG.Error("AsyncLookup: not a directory inode: %s , %s", dir, inode_number.inode.type)
+            return -1
+
+        padded_filename = bytearray(bytearray(filename, "utf-8").ljust(MAX_FILENAME, b'\x00'))
+        blocks = await self.InodeBlocks(inode_number, 0, inode_number.inode.size)
+        scanned = 0
+        for b in blocks:
+            for i in range(0, FILE_ENTRIES_PER_DATA_BLOCK):
+                if inode_number.inode.size > scanned:
+                    scanned += FILE_NAME_DIRENTRY_SIZE
+                    if self.helpers.HelperGetFilenameString(b, i) == padded_filename:
+                        return self.helpers.HelperGetFilenameInodeNumber(b, i)
+        return -1
+
+    ## Finds a free inode and claims it by storing inode with its type set; the inode table blocks are fetched
+    ## together. Returns the inode number, or -1
+
+    async def AllocateInode(self, inode):
+        async with self.inode_alloc_lock:
+            blocks = await self.RawBlocks.GetMany(list(range(INODE_BLOCK_OFFSET, INODE_BLOCK_OFFSET + INODE_NUM_BLOCKS)))
+            candidate = Inode()
+            for i in range(0, MAX_NUM_INODES):
+                start = (i * INODE_SIZE) % BLOCK_SIZE
+                candidate.InodeFromBlock(blocks[(i * INODE_SIZE) // BLOCK_SIZE], start)
+                if candidate.type == INODE_TYPE_INVALID:
+                    inode_number = AsyncInodeNumber(self, i)
+                    inode_number.inode = inode
+                    await inode_number.StoreInode()
+                    return i
+        return -1
+
+    ## Allocate a data block, update free bitmap, and return its number
+
+    async def AllocateDataBlock(self):
+        # a full volume may only be waiting for the reclaimer of the DiskBlocks, as in FileName.AllocateDataBlock
+        reclaimer = self.RawBlocks.RawBlocks.reclaimer
+        for attempt in range(2):
+            block_number = await self.ScanFreeBitmap(reclaimer)
+            if block_number != -1:
+                return block_number
+            if reclaimer is None or reclaimer.Pending() == 0:
+                break
+            await asyncio.to_thread(reclaimer.Flush)
+
+        LOG.Debug('AsyncAllocateDataBlock: no free data blocks available')
+        quit()
+
+    ## Finds a free data block in the bitmap and marks it used; returns its number, or -1 if there is none
+    ## Each bitmap block is updated under the reclaimer's bitmap_lock as well, which its thread holds while it
+    ## frees blocks; the lock is taken from a worker thread, so waiting for it does not block the event loop
+
+    async def ScanFreeBitmap(self, reclaimer):
+        for bitmap_block in range(FREEBITMAP_BLOCK_OFFSET, FREEBITMAP_BLOCK_OFFSET + FREEBITMAP_NUM_BLOCKS):
+            async with self.block_locks[bitmap_block]:
+                if reclaimer is not None:
+                    await asyncio.to_thread(reclaimer.bitmap_lock.acquire)
+                try:
+                    block = await self.RawBlocks.Get(bitmap_block)
+                    first = max(DATA_BLOCKS_OFFSET, (bitmap_block - FREEBITMAP_BLOCK_OFFSET) * BLOCK_SIZE)
+                    last = min(TOTAL_NUM_BLOCKS, (bitmap_block - FREEBITMAP_BLOCK_OFFSET + 1) * BLOCK_SIZE)
+                    for block_number in range(first, last):
+                        if block[block_number % BLOCK_SIZE] == 0:
+                            block[block_number % BLOCK_SIZE] = 1
+                            await self.RawBlocks.Put(bitmap_block, block)
+                            LOG.Debug('AsyncAllocateDataBlock: allocated %s', block_number)
+                            return block_number
+                finally:
+                    if reclaimer is not None:
+                        reclaimer.bitmap_lock.release()
+        return -1
+
+    ## Appends a (filename,inodenumber) entry to directory insert_to and stores its inode
+    ## The caller holds the directory's inode lock
+
+    async def InsertFilenameInodeNumber(self, insert_to, filename, inodenumber):
+        if len(filename) > MAX_FILENAME:
+            LOG.Error('AsyncInsertFilenameInodeNumber: file name exceeds maximum')
+            quit()
+
+        index = insert_to.inode.size
+        if index >= MAX_FILE_SIZE:
+            LOG.Error('AsyncInsertFilenameInodeNumber: no space for another entry in inode')
+            quit()
+
+        block_number_index = index // BLOCK_SIZE
+        if index % BLOCK_SIZE == 0 and index != 0:
+            insert_to.inode.block_numbers[block_number_index] = await self.AllocateDataBlock()
+
+        block_number = insert_to.inode.block_numbers[block_number_index]
+        block = await self.RawBlocks.Get(block_number)
+        index_modulo = index % BLOCK_SIZE
+        inode_start = index_modulo + MAX_FILENAME
+        block[inode_start:inode_start + INODE_NUMBER_DIRENTRY_SIZE] = inodenumber.to_bytes(INODE_NUMBER_DIRENTRY_SIZE, 'big')
+        block[index_modulo:inode_start] = bytearray(bytearray(filename, "utf-8").ljust(MAX_FILENAME, b'\x00'))
+        await self.RawBlocks.Put(block_number, block)
+
+        insert_to.inode.size += FILE_NAME_DIRENTRY_SIZE
+        await insert_to.StoreInode()
+
+    ## Create a file system object, see FileName.Create
+
+    async def Create(self, dir, name, type):
+        LOG.Debug("AsyncCreate: dir: %s, name: %s, type: %s", dir, name, type)
+        if not (type == INODE_TYPE_FILE or type == INODE_TYPE_DIR):
+            LOG.Debug("AsyncCreate: type not supported")
+            return -1
+
+        async with self.inode_locks[dir]:
+            dir_inode = await self.LoadInode(dir)
+            if dir_inode.inode.type != INODE_TYPE_DIR:
+                LOG.Debug("AsyncCreate: dir is not a directory")
+                return -1
+            if dir_inode.inode.size >= MAX_FILE_SIZE:
+                LOG.Debug("AsyncCreate: no entry available for another object")
+                return -1
+            if await self.Lookup(name, dir) != -1:
+                LOG.Debug("AsyncCreate: name already exists")
+                return -1
+
+            new_inode = Inode()
+            new_inode.type = type
+            new_inode.refcnt = 1
+            inode_position = await self.AllocateInode(new_inode)
+            if inode_position == -1:
+                LOG.Debug("AsyncCreate: no free inode available")
+                return -1
+
+            if type == INODE_TYPE_DIR:
+                # a new directory starts with one data block (stored with its first entry)
+                newdir_inode = AsyncInodeNumber(self, inode_position)
+                newdir_inode.inode = new_inode
+                async with self.inode_locks[inode_position]:
+                    new_inode.block_numbers[0] = await self.AllocateDataBlock()
+                    await self.InsertFilenameInodeNumber(newdir_inode, ".", inode_position)
+                    await self.InsertFilenameInodeNumber(newdir_inode, "..", dir)
+
+            await self.InsertFilenameInodeNumber(dir_inode, name, inode_position)
+            dir_inode.inode.refcnt += 1
+            await dir_inode.StoreInode()
+
+        return inode_position
+
+    ## Writes data to a file, starting at offset, see FileName.Write
+    ## Blocks only partly overwritten are read together first; all blocks are then written together
+
+    async def Write(self, file_inode_number, offset, data):
+        LOG.Debug("AsyncWrite: file_inode_number: %s, offset: %s, len(data): %s", file_inode_number, offset, len(data))
+
+        async with self.inode_locks[file_inode_number]:
+            file_inode = await self.LoadInode(file_inode_number)
+            if file_inode.inode.type != INODE_TYPE_FILE:
+                LOG.Debug("AsyncWrite: not a file")
+                return -1
+            if offset < 0:
+                LOG.Debug("AsyncWrite: negative offset %s", offset)
+                return -1
+            if offset + len(data) > MAX_FILE_SIZE:
+                LOG.Debug("AsyncWrite: exceeds maximum file size: %s", MAX_FILE_SIZE)
+                return -1
+            if len(data) == 0:
+                return 0
+
+            first = offset // BLOCK_SIZE
+            last = (offset + len(data) - 1) // BLOCK_SIZE
+            allocated = set()
+            for index in range(first, last + 1):
+                if file_inode.inode.block_numbers[index] == 0:
+                    file_inode.inode.block_numbers[index] = await self.AllocateDataBlock()
+                    allocated.add(index)
+
+            # only the first and last blocks can be partly overwritten; newly allocated ones start out as zeros
+            partial = []
+            if offset % BLOCK_SIZE != 0 and first not in allocated:
+                partial.append(first)
+            if (offset + len(data)) % BLOCK_SIZE != 0 and last not in partial and last not in allocated:
+                partial.append(last)
+            old = dict(zip(partial, await self.RawBlocks.GetMany([file_inode.inode.block_numbers[i] for i in partial])))
+
+            writes = []
+            for index in range(first, last + 1):
+                block = old.get(index, bytearray(BLOCK_SIZE))
+                block_start = index * BLOCK_SIZE
+                write_start = max(offset, block_start)
+                write_end = min(offset + len(data), block_start + BLOCK_SIZE)
+                block[write_start - block_start:write_end - block_start] = data[write_start - offset:write_end - offset]
+                writes.append(self.RawBlocks.Put(file_inode.inode.block_numbers[index], block))
+            await asyncio.gather(*writes)
+
+            # as in FileName.Write, a write past the end of the file leaves a hole
+            file_inode.inode.size = max(file_inode.inode.size, offset + len(data))
+            await file_inode.StoreInode()
+
+        return len(data)
+
+    ## Reads up to count bytes of a file, starting at offset; the blocks are fetched together
+
+    async def Read(self, file_inode_number, offset, count):
+        LOG.Debug("AsyncRead: file_inode_number: %s, offset: %s, count: %s", file_inode_number, offset, count)
+
+        file_inode = await self.LoadInode(file_inode_number)
+        if file_inode.inode.type != INODE_TYPE_FILE:
+            LOG.Debug("AsyncRead: not a file")
+            return -1
+        if offset > file_inode.inode.size:
+            LOG.Debug("AsyncRead: offset larger than file size %s", file_inode.inode.size)
+            return -1
+
+        bytes_to_read = min(count, file_inode.inode.size - offset)
+        blocks = await self.InodeBlocks(file_inode, offset, bytes_to_read)
+        read_block = bytearray()
+        for block in blocks:
+            read_block += block
+        start = offset % BLOCK_SIZE
+        return read_block[start:start + bytes_to_read]
+
+    async def PathToInodeNumber(self, path, dir):
+        if "/" in path:
+            first, rest = path.split("/", 1)
+            d = await self.Lookup(first, dir)
+            return await self.PathToInodeNumber(rest, d)
+        return await self.Lookup(path, dir)
+
+    async def GeneralPathToInodeNumber(self, path, cwd):
+        if path[0] == "/":
+            if len(path) == 1:  # special case: root
+                return 0
+            return await self.PathToInodeNumber(path[1:], 0)
+        return await self.PathToInodeNumber(path, cwd)
+
+    ## Adds name in directory cwd as a hard link to file target, see FileName.Link
+
+    async def Link(self, target, name, cwd):
+        LOG.Debug("AsyncLink: target: %s, name: %s, cwd: %s", target, name, cwd)
+
+        target_inode_number = await self.GeneralPathToInodeNumber(target, cwd)
+        if target_inode_number == -1:
+            LOG.Debug("AsyncLink: target does not exist")
+            return -1
+
+        async with self.inode_locks[cwd]:
+            cwd_inode, target_obj, existing = await asyncio.gather(
+                self.LoadInode(cwd), self.LoadInode(target_inode_number), self.Lookup(name, cwd))
+            if cwd_inode.inode.type != INODE_TYPE_DIR:
+                LOG.Debug("AsyncLink: cwd is not a directory")
+                return -1
+            if cwd_inode.inode.size >= MAX_FILE_SIZE:
+                LOG.Debug("AsyncLink: no entry available for another link")
+                return -1
+            if existing != -1:
+                LOG.Debug("AsyncLink: name already exists")
+                return -1
+            if target_obj.inode.type != INODE_TYPE_FILE:
+                LOG.Debug("AsyncLink: target must be a file")
+                return -1
+
+            await self.InsertFilenameInodeNumber(cwd_inode, name, target_inode_number)
+            # the directory counts the entry, as for Create
+            cwd_inode.inode.refcnt += 1
+            await cwd_inode.StoreInode()
+
+            async with self.inode_locks[target_inode_number]:
+                target_obj = await self.LoadInode(target_inode_number)
+                target_obj.inode.refcnt += 1
+                await target_obj.StoreInode()
+
+        return 0
@@ -0,0 +1,103 @@
+import argparse, asyncio, json, socket, threading, time
+from memoryfs_client import *
+from memoryfs_async_client import AsyncDiskBlocks, AsyncFileName
+from memoryfs_bench_util import StartServers, StopServers, Summary
+
+## Many logical users doing Lookup + Read of small files, served three ways:
+##   sync: users one after another on one FileName
+##   threads: one thread per user sharing one DiskBlocks (a ServerProxy per thread and server)
+##   async: one coroutine per user on AsyncFileName, --connections requests in flight per server
+## Reported: operations per second, per-operation latency, and operations that failed (with many threads the
+## servers' listen backlog overflows, connections are refused and servers get marked down).
+## Servers are restarted and the volume reformatted before every run, so a failed run does not affect the next.
+
+FILES = 8
+
+def Populate(disk):
+    fo = FileName(disk)
+    fo.InitRootInode()
+    for i in range(FILES):
+        inode = fo.Create(0, 'f' + str(i), INODE_TYPE_FILE)
+        fo.Write(inode, 0, bytearray(('file ' + str(i) + ' ').encode() * 20)[:2 * BLOCK_SIZE])
+
+def SyncUser(fo, user, ops, samples, errors):
+    for k in range(ops):
+        t0 = time.perf_counter()
+        try:
+            inode = fo.Lookup('f' + str((user + k) % FILES), 0)
+            fo.Read(inode, 0, 2 * BLOCK_SIZE)
+        except socket.error:
+            errors.append(user)
+            continue
+        samples.append(time.perf_counter() - t0)
+
+def RunSync(disk, users, ops):
+    fo = FileName(disk)
+    samples = []
+    errors = []
+    started = time.perf_counter()
+    for user in range(users):
+        SyncUser(fo, user, ops, samples, errors)
+    return time.perf_counter() - started, samples, errors
+
+def RunThreads(disk, users, ops):
+    fo = FileName(disk)
+    samples = []
+    errors = []
+    workers = [threading.Thread(target=SyncUser, args=(fo, user, ops, samples, errors)) for user in range(users)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started, samples, errors
+
+def RunAsync(disk, users, ops, connections):
+    samples = []
+    errors = []
+
+    async def User(af, user):
+        for k in range(ops):
+            t0 = time.perf_counter()
+            try:
+                inode = await af.Lookup('f' + str((user + k) % FILES), 0)
+                await af.Read(inode, 0, 2 * BLOCK_SIZE)
+            except socket.error:
+                errors.append(user)
+                continue
+            samples.append(time.perf_counter() - t0)
+
+    async def Main():
+        af = AsyncFileName(AsyncDiskBlocks(disk, connections=connections))
+        started = time.perf_counter()
+        await asyncio.gather(*[User(af, user) for user in range(users)])
+        return time.perf_counter() - started
+
+    return asyncio.run(Main()), samples, errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='sync vs threads vs asyncio client')
+    parser.add_argument('--servers', type=int, default=5)
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 10, 100, 300])
+    parser.add_argument('--ops', type=int, default=5, help='Lookup + Read pairs per user')
+    parser.add_argument('--connections', type=int, default=4, help='async requests in flight per server')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    for users in options.users:
+        for mode in ('sync', 'threads', 'async'):
+            procs, ports = StartServers(options.servers)
+            try:
+                disk = DiskBlocks(options.servers, ports, timeout=10.0)
+                disk.InitializeBlocks(True, b'\x12\x34\x56\x78')
+                Populate(disk)
+                if mode == 'sync':
+                    elapsed, samples, errors = RunSync(disk, users, options.ops)
+                elif mode == 'threads':
+                    elapsed, samples, errors = RunThreads(disk, users, options.ops)
+                else:
+                    elapsed, samples, errors = RunAsync(disk, users, options.ops, options.connections)
+                print(json.dumps({'mode': mode, 'users': users, 'ops': len(samples), 'failed': len(errors),
+                                  'ops_per_s': round(len(samples) / elapsed, 1), 'latency': Summary(samples)}))
+            finally:
+                StopServers(procs)
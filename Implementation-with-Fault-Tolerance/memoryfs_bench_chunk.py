@@ -0,0 +1,90 @@
+import argparse, json, random, threading, time
+from memoryfs_client import *
+from memoryfs_bench_util import StartServers, StopServers, Summary
+
+## Sweep of the stripe unit (DiskBlocks chunk_size) for sequential and random reads
+## Each client thread reads the data area of the volume with Get:
+##   sequential: runs of --run-length consecutive blocks starting at random offsets
+##   random: independent uniformly random blocks
+## Reported per chunk size and workload: aggregate Get throughput, Get latency, the mean number of
+## consecutive Gets of one thread that stay on the same server (per-server sequentiality), and the share of
+## Gets taken by the busiest server (load balance; 1/N is perfect).
+
+def Workload(name, rng, count, run_length):
+    blocks = []
+    while len(blocks) < count:
+        if name == 'sequential':
+            start = rng.randrange(DATA_BLOCKS_OFFSET, TOTAL_NUM_BLOCKS - run_length)
+            blocks.extend(range(start, start + run_length))
+        else:
+            blocks.append(rng.randrange(DATA_BLOCKS_OFFSET, TOTAL_NUM_BLOCKS))
+    return blocks[:count]
+
+def Measure(disk, workload, threads, count, run_length):
+    samples = []
+    runs = []
+    per_server = [0] * disk.N
+    lock = threading.Lock()
+
+    def Client(seed):
+        rng = random.Random(seed)
+        blocks = Workload(workload, rng, count, run_length)
+        local_samples = []
+        local_runs = []
+        for block_number in blocks:
+            t0 = time.perf_counter()
+            disk.Get(block_number)
+            local_samples.append(time.perf_counter() - t0)
+        servers = [server for server, block in disk.MapMany(blocks)]
+        run = 1
+        for previous, server in zip(servers, servers[1:]):
+            if server == previous:
+                run += 1
+            else:
+                local_runs.append(run)
+                run = 1
+        local_runs.append(run)
+        with lock:
+            samples.extend(local_samples)
+            runs.extend(local_runs)
+            for server in servers:
+                per_server[server] += 1
+
+    workers = [threading.Thread(target=Client, args=(seed,)) for seed in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'get_ops_per_s': round(len(samples) / elapsed, 1),
+        'get_latency': Summary(samples),
+        'same_server_run': round(sum(runs) / len(runs), 2),
+        'busiest_server_share': round(max(per_server) / sum(per_server), 3),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='stripe unit (chunk size) sweep')
+    parser.add_argument('--servers', type=int, default=5)
+    parser.add_argument('--layout', choices=sorted(RAID_LAYOUTS), default=DEFAULT_LAYOUT)
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=500, help='Gets per thread')
+    parser.add_argument('--run-length', type=int, default=16, help='blocks per sequential run')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    for chunk_size in options.chunk_sizes:
+        procs, ports = StartServers(options.servers)
+        try:
+            disk = DiskBlocks(options.servers, ports, layout=options.layout, chunk_size=chunk_size)
+            disk.InitializeBlocks(True, b'\x12\x34\x56\x78')
+            for workload in ('sequential', 'random'):
+                result = {'chunk_size': chunk_size, 'workload': workload, 'layout': options.layout,
+                          'servers': options.servers, 'threads': options.threads}
+                result.update(Measure(disk, workload, options.threads, options.requests, options.run_length))
+                print(json.dumps(result))
+        finally:
+            StopServers(procs)
@@ -0,0 +1,198 @@
+import argparse, contextlib, io, json, time
+from memoryfs_client import *
+from memoryfs_shell_rpc import FSShell
+from memoryfs_bench_util import StartServers, StopServers, Summary
+
+## File system workloads against a local cluster of memoryfs_server.py processes
+## Every (configuration, workload) pair gets a fresh cluster, formatted through DiskBlocks:
+##   healthy: all servers up
+##   degraded: one server killed right after formatting
+##   corrupted: one server started with damage_block on the physical block holding the root inode, so that block
+##              is corrupt and drops writes (every read of it is reconstructed from the other servers)
+## Workloads, each a sequence of timed operations (shell commands, with their output discarded):
+##   create_storm: create files in / ; deep_lookup: resolve /d0/d1/.../dN ; ls_full: ls of a full directory
+##   append_heavy: append a short string to a file ; cat_heavy: cat one of a few full files
+## The volume is tiny (MAX_NUM_INODES inodes, MAX_FILE_SIZE bytes per file), so create_storm and append_heavy
+## start over on a fresh cluster (untimed, and not counted in the RPCs) whenever it fills up.
+## Reported per pair, as one JSON line: operations per second, latency distribution, RPCs and reconstructions per
+## operation. --save writes the results to a file and --compare prints the change against such a file.
+
+WORKLOADS = ['create_storm', 'append_heavy', 'cat_heavy', 'deep_lookup', 'ls_full']
+CONFIGS = ['healthy', 'degraded', 'corrupted']
+
+UUID = b'\x12\x34\x56\x78'
+APPEND = 'append-16-bytes'
+
+class Run():
+    def __init__(self, config, n, layout, pipeline):
+        self.config = config
+        self.n = n
+        self.layout = layout
+        self.pipeline = pipeline
+        self.samples = []
+        self.rpcs = []
+        self.reconstructions = []
+        self.Start()
+
+    ## Start: launches the cluster of the configuration and formats a fresh volume
+
+    def Start(self):
+        extra = {}
+        if self.config == 'corrupted':
+            # physical block and server of the root inode, from the stripe layout alone
+            layout_only = DiskBlocks(self.n, {}, layout=self.layout)
+            extra[layout_only.map_server[INODE_BLOCK_OFFSET]] = [layout_only.map_block[INODE_BLOCK_OFFSET]]
+        self.procs, ports = StartServers(self.n, extra)
+        self.disk = DiskBlocks(self.n, ports, timeout=10.0, layout=self.layout, pipeline=self.pipeline)
+        self.disk.InitializeBlocks(True, UUID)
+        self.fo = FileName(self.disk)
+        self.fo.InitRootInode()
+        self.disk.Flush()
+        self.shell = FSShell(self.fo)
+        if self.config == 'degraded':
+            self.procs[1].kill()
+            self.procs[1].wait()
+
+    ## Reformat: a fresh volume in the middle of a workload; a degraded volume cannot be formatted, so the
+    ## cluster is started again
+
+    def Reformat(self):
+        self.Stop()
+        self.Start()
+
+    ## Op: runs one timed operation, with its shell output discarded, and records latency, RPCs and reconstructions
+
+    def Op(self, command, *args):
+        rpcs = self.disk.metrics.Requests
+        before = sum(rpcs(i) for i in range(self.disk.N))
+        reconstructions = self.disk.metrics.Total('reconstructions')
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            result = command(*args)
+            self.disk.Flush()
+            elapsed = time.perf_counter() - t0
+        self.samples.append(elapsed)
+        self.rpcs.append(sum(rpcs(i) for i in range(self.disk.N)) - before)
+        self.reconstructions.append(self.disk.metrics.Total('reconstructions') - reconstructions)
+        return result
+
+    def Quiet(self, command, *args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return command(*args)
+
+    def Stop(self):
+        StopServers(self.procs)
+
+## Workloads: setup (untimed) followed by ops timed operations
+
+def CreateStorm(run, ops):
+    created = 0
+    for k in range(ops):
+        if created == MAX_NUM_INODES - 1:
+            run.Reformat()
+            created = 0
+        run.Op(run.shell.create, 'f' + str(created))
+        created += 1
+
+def AppendHeavy(run, ops):
+    files = 0
+    size = MAX_FILE_SIZE
+    for k in range(ops):
+        if size + len(APPEND) > MAX_FILE_SIZE:
+            if files == MAX_NUM_INODES - 1:
+                run.Reformat()
+                files = 0
+            run.Quiet(run.shell.create, 'a' + str(files))
+            files += 1
+            size = 0
+        run.Op(run.shell.append, 'a' + str(files - 1), APPEND)
+        size += len(APPEND)
+
+def CatHeavy(run, ops):
+    for i in range(4):
+        run.Quiet(run.shell.create, 'c' + str(i))
+        inode = run.fo.Lookup('c' + str(i), 0)
+        run.fo.Write(inode, 0, bytearray((('file ' + str(i) + ' ') * 64).encode())[:MAX_FILE_SIZE])
+    for k in range(ops):
+        run.Op(run.shell.cat, 'c' + str(k % 4))
+
+def DeepLookup(run, ops):
+    parent = 0
+    path = ''
+    for i in range(MAX_NUM_INODES - 1):
+        parent = run.fo.Create(parent, 'd' + str(i), INODE_TYPE_DIR)
+        path += '/d' + str(i)
+    for k in range(ops):
+        run.Op(run.fo.GeneralPathToInodeNumber, path, 0)
+
+def LsFull(run, ops):
+    directory = run.fo.Create(0, 'dir', INODE_TYPE_DIR)
+    k = 0
+    while run.fo.Create(directory, 'e' + str(k), INODE_TYPE_FILE) != -1:
+        k += 1
+    run.shell.cwd = directory
+    for k in range(ops):
+        run.Op(run.shell.ls)
+
+WORKLOAD_FUNCTIONS = {'create_storm': CreateStorm, 'append_heavy': AppendHeavy, 'cat_heavy': CatHeavy,
+                      'deep_lookup': DeepLookup, 'ls_full': LsFull}
+
+def Measure(config, workload, n, layout, pipeline, ops):
+    run = Run(config, n, layout, pipeline)
+    try:
+        started = time.perf_counter()
+        WORKLOAD_FUNCTIONS[workload](run, ops)
+        wall = time.perf_counter() - started
+        busy = sum(run.samples)
+        return {'config': config, 'workload': workload, 'layout': layout, 'servers': n, 'pipeline': pipeline,
+                'ops': len(run.samples), 'ops_per_s': round(len(run.samples) / busy, 1), 'wall_s': round(wall, 3),
+                'latency': Summary(run.samples), 'rpcs_per_op': round(sum(run.rpcs) / len(run.rpcs), 2),
+                'reconstructions_per_op': round(sum(run.reconstructions) / len(run.reconstructions), 2)}
+    finally:
+        run.Stop()
+
+## Compare: prints, for every result also found in the baseline, the relative change of its main figures
+
+def Compare(results, baseline_file):
+    baseline = {}
+    with open(baseline_file) as f:
+        for line in f:
+            if line.strip():
+                old = json.loads(line)
+                baseline[(old['config'], old['workload'], old['layout'], old['servers'], old['pipeline'])] = old
+    for new in results:
+        old = baseline.get((new['config'], new['workload'], new['layout'], new['servers'], new['pipeline']))
+        if old is None:
+            continue
+        change = {'config': new['config'], 'workload': new['workload']}
+        for key, new_value, old_value in [('ops_per_s', new['ops_per_s'], old['ops_per_s']),
+                                          ('p99_us', new['latency']['p99_us'], old['latency']['p99_us']),
+                                          ('rpcs_per_op', new['rpcs_per_op'], old['rpcs_per_op'])]:
+            change[key + '_change'] = round(new_value / old_value - 1, 3) if old_value else None
+        print(json.dumps(change))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='file system workloads on healthy, degraded and corrupted clusters')
+    parser.add_argument('--servers', type=int, default=5)
+    parser.add_argument('--layout', choices=sorted(RAID_LAYOUTS), default=DEFAULT_LAYOUT)
+    parser.add_argument('--pipeline', action='store_true')
+    parser.add_argument('--ops', type=int, default=60, help='timed operations per workload')
+    parser.add_argument('--workloads', nargs='+', choices=WORKLOADS, default=WORKLOADS)
+    parser.add_argument('--configs', nargs='+', choices=CONFIGS, default=CONFIGS)
+    parser.add_argument('--save', help='write the results, one JSON line each, to this file')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    results = []
+    for config in options.configs:
+        for workload in options.workloads:
+            result = Measure(config, workload, options.servers, options.layout, options.pipeline, options.ops)
+            print(json.dumps(result))
+            results.append(result)
+    if options.save is not None:
+        with open(options.save, 'w') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+    if options.compare is not None:
+        Compare(results, options.compare)
@@ -0,0 +1,47 @@
+import argparse, json, random, time
+from memoryfs_client import *
+from memoryfs_bench_util import StartServers, StopServers, Summary
+
+## Get latency with and without hedged reads (DiskBlocks hedge_percentile)
+## One server is started with --stall-ms/--stall-interval, so it pauses now and then like a GC pause would. For each hedge setting a fresh cluster is formatted, filled, and read at random;
+## reported are the Get latency distribution and DiskBlocks.get_hedge_stats().
+
+def Measure(n, layout, hedge_percentile, requests, stall_ms, stall_interval, slow_server):
+    procs, ports = StartServers(n, {slow_server: ['--stall-ms', stall_ms, '--stall-interval', stall_interval]})
+    try:
+        disk = DiskBlocks(n, ports, layout=layout, hedge_percentile=hedge_percentile)
+        disk.InitializeBlocks(True, b'\x12\x34\x56\x78')
+        rng = random.Random(0)
+        for block_number in range(DATA_BLOCKS_OFFSET, TOTAL_NUM_BLOCKS):
+            disk.Put(block_number, bytearray(rng.randbytes(BLOCK_SIZE)))
+
+        samples = []
+        for i in range(requests):
+            block_number = rng.randrange(DATA_BLOCKS_OFFSET, TOTAL_NUM_BLOCKS)
+            t0 = time.perf_counter()
+            disk.Get(block_number)
+            samples.append(time.perf_counter() - t0)
+
+        result = {'hedge_percentile': hedge_percentile, 'layout': layout, 'servers': n,
+                  'stall_ms': stall_ms, 'stall_interval': stall_interval, 'get_latency': Summary(samples)}
+        if hedge_percentile is not None:
+            result['hedge'] = disk.get_hedge_stats()
+        return result
+    finally:
+        StopServers(procs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='hedged read tail latency')
+    parser.add_argument('--servers', type=int, default=5)
+    parser.add_argument('--layout', choices=sorted(RAID_LAYOUTS), default=DEFAULT_LAYOUT)
+    parser.add_argument('--percentiles', type=float, nargs='+', default=[90, 95, 99])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--stall-ms', type=float, default=50)
+    parser.add_argument('--stall-interval', type=float, default=0.2, help='mean seconds between pauses')
+    parser.add_argument('--slow-server', type=int, default=1)
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    for hedge_percentile in [None] + options.percentiles:
+        print(json.dumps(Measure(options.servers, options.layout, hedge_percentile, options.requests,
+                                 options.stall_ms, options.stall_interval, options.slow_server)))
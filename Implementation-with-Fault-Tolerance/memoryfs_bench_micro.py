@@ -0,0 +1,126 @@
+import argparse, gc, json, sys, time, tracemalloc
+from memoryfs_client import *
+from memoryfs_bench_util import FakeDiskBlocks
+
+## Micro-benchmarks of the client's CPU-only hot paths, on an in-process fake cluster (FakeDiskBlocks), so that
+## network and server time do not hide them. Reported per benchmark:
+##   ns_per_op: best of --repeat timed runs, each long enough to take about --min-time seconds
+##   peak_bytes_per_op: largest memory peak of a single call above the memory in use before it (tracemalloc)
+##   blocks_per_op: memory blocks still allocated after a call, per call (should be 0: nothing leaks)
+## --save writes the results to a baseline file; --baseline compares against one and marks every benchmark that
+## got slower by more than --threshold.
+
+def Benchmarks(layout):
+    disk = FakeDiskBlocks(5, layout=layout)
+    fo = FileName(disk)
+    fo.InitRootInode()
+    # a full root directory; the Lookup benchmark looks for the last entry
+    names = []
+    while True:
+        name = 'file' + str(len(names))
+        if fo.Create(0, name, INODE_TYPE_FILE) == -1:
+            break
+        names.append(name)
+
+    inode = Inode()
+    inode_bytes = InodeNumber(disk, 0)
+    inode_bytes.InodeNumberToInode()
+    raw_inode = inode_bytes.inode.InodeToBytearray()
+    root_block = disk.Get(inode_bytes.inode.block_numbers[0])
+    inode_block = disk.Get(INODE_BLOCK_OFFSET)
+    a = bytearray(range(BLOCK_SIZE))
+    b = bytearray(reversed(range(BLOCK_SIZE)))
+    data = bytearray(b'x' * BLOCK_SIZE)
+    block_number = DATA_BLOCKS_OFFSET + 40
+
+    return {
+        'Inode.InodeFromBytearray': lambda: inode.InodeFromBytearray(raw_inode),
+        'Inode.InodeToBytearray': lambda: inode_bytes.inode.InodeToBytearray(),
+        'Inode.InodeFromBlock': lambda: inode.InodeFromBlock(inode_block, INODE_SIZE),
+        'Inode.InodeToBlock': lambda: inode_bytes.inode.InodeToBlock(inode_block, INODE_SIZE),
+        'InodeNumber.InodeNumberToInode': lambda: inode_bytes.InodeNumberToInode(),
+        'FileName.HelperGetFilenameString': lambda: fo.HelperGetFilenameString(root_block, 3),
+        'FileName.Lookup': lambda: fo.Lookup(names[-1], 0),
+        'DiskBlocks.Get': lambda: disk.Get(block_number),
+        'DiskBlocks.Put': lambda: disk.Put(block_number, data),
+        'XorBlocks': lambda: XorBlocks(a, b),
+        'DiskBlocks.Map': lambda: disk.Map(block_number),
+        'DiskBlocks.Parity_Map': lambda: disk.Parity_Map(block_number),
+    }
+
+## Time: ns per call of fn, the best of repeat runs of a number of calls calibrated to take about min_time
+
+def Time(fn, repeat, min_time):
+    number = 1
+    while True:
+        started = time.perf_counter_ns()
+        for i in range(number):
+            fn()
+        elapsed = time.perf_counter_ns() - started
+        if elapsed >= min_time * 1e9:
+            break
+        number *= 2
+    best = elapsed / number
+    for r in range(repeat - 1):
+        started = time.perf_counter_ns()
+        for i in range(number):
+            fn()
+        best = min(best, (time.perf_counter_ns() - started) / number)
+    return best
+
+## Allocations: (largest peak of one call in bytes, blocks left allocated per call) over calls calls
+
+def Allocations(fn, calls):
+    fn()
+    gc.collect()
+    gc.disable()
+    try:
+        tracemalloc.start()
+        peak = 0
+        blocks = sys.getallocatedblocks()
+        for i in range(calls):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+        left = sys.getallocatedblocks() - blocks
+    finally:
+        gc.enable()
+    return peak, left / calls
+
+def Compare(results, baseline_file, threshold):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        change = result['ns_per_op'] / baseline[name]['ns_per_op'] - 1
+        print(json.dumps({'benchmark': name, 'baseline_ns': baseline[name]['ns_per_op'], 'ns': result['ns_per_op'],
+                          'change': round(change, 3), 'regression': change > threshold}))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='micro-benchmarks of client hot paths on a fake in-process cluster')
+    parser.add_argument('--layout', choices=sorted(RAID_LAYOUTS), default=DEFAULT_LAYOUT)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per timed run')
+    parser.add_argument('--only', nargs='+', help='run only these benchmarks')
+    parser.add_argument('--save', help='write the results to this baseline file')
+    parser.add_argument('--baseline', help='baseline file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown reported as a regression')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    results = {}
+    for name, fn in Benchmarks(options.layout).items():
+        if options.only is not None and name not in options.only:
+            continue
+        ns = Time(fn, options.repeat, options.min_time)
+        peak, blocks = Allocations(fn, 1000)
+        results[name] = {'ns_per_op': round(ns, 1), 'peak_bytes_per_op': peak, 'blocks_per_op': round(blocks, 3)}
+        print(json.dumps(dict({'benchmark': name}, **results[name])))
+    if options.save is not None:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if options.baseline is not None:
+        Compare(results, options.baseline, options.threshold)
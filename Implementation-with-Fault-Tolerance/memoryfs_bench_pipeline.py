@@ -0,0 +1,67 @@
+import argparse, contextlib, io, json, time
+from memoryfs_client import *
+from memoryfs_shell_rpc import FSShell
+from memoryfs_bench_util import StartServers, StopServers, Summary
+
+## Round trips and latency of shell commands with and without pipelining (DiskBlocks pipeline)
+## For each setting a fresh cluster is formatted, then every command of the workload is run --repeat times;
+## each command ends with DiskBlocks.Flush(), as in the shell. Reported per command: HTTP requests to all
+## servers and the latency distribution. --delay-ms adds a fixed cost per request, standing in for a
+## network round trip between machines (all servers run on localhost here).
+
+def Workload(shell, k):
+    return [('create', shell.create, ('f' + str(k),)),
+            ('append', shell.append, ('f' + str(k), 'hello world ' * 4)),
+            ('ls', shell.ls, ()),
+            ('cat', shell.cat, ('f' + str(k),))]
+
+def Measure(n, layout, pipeline, repeat, delay_ms):
+    procs, ports = StartServers(n)
+    try:
+        disk = DiskBlocks(n, ports, layout=layout, pipeline=pipeline)
+        disk.InitializeBlocks(True, b'\x12\x34\x56\x78')
+        fo = FileName(disk)
+        fo.InitRootInode()
+        disk.Flush()
+        shell = FSShell(fo)
+
+        # wrap the DiskBlocks request path so every HTTP request pays delay_ms
+        if delay_ms > 0:
+            calls = disk.ServerCalls
+            def DelayedCalls(i, batch):
+                if len(batch) > 0 or len(disk.pending[i]) > 0:
+                    time.sleep(delay_ms / 1000.0)
+                return calls(i, batch)
+            disk.ServerCalls = DelayedCalls
+
+        round_trips = {}
+        samples = {}
+        for k in range(repeat):
+            for name, command, args in Workload(shell, k):
+                before = sum(disk.get_round_trips().values())
+                t0 = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    command(*args)
+                disk.Flush()
+                samples.setdefault(name, []).append(time.perf_counter() - t0)
+                round_trips.setdefault(name, []).append(sum(disk.get_round_trips().values()) - before)
+
+        result = {'pipeline': pipeline, 'layout': layout, 'servers': n, 'delay_ms': delay_ms, 'commands': {}}
+        for name in samples:
+            result['commands'][name] = {'round_trips': sum(round_trips[name]) / len(round_trips[name]),
+                                        'latency': Summary(samples[name])}
+        return result
+    finally:
+        StopServers(procs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='round trips with and without write pipelining')
+    parser.add_argument('--servers', type=int, default=5)
+    parser.add_argument('--layout', choices=sorted(RAID_LAYOUTS), default=DEFAULT_LAYOUT)
+    parser.add_argument('--repeat', type=int, default=10, help='times the workload is run (at most MAX_NUM_INODES - 1)')
+    parser.add_argument('--delay-ms', type=float, default=0, help='added latency per request')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    for pipeline in (False, True):
+        print(json.dumps(Measure(options.servers, options.layout, pipeline, options.repeat, options.delay_ms)))
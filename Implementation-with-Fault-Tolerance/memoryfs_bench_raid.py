@@ -0,0 +1,121 @@
+import argparse, json, os, random, time
+from memoryfs_client import *
+from memoryfs_bench_util import StartServers, StopServers, Summary
+
+## Throughput of the raid5 and raid6 layouts of DiskBlocks
+## Two parts:
+##   codec: in-process parity computation and reconstruction of one stripe, in MB/s of data blocks
+##   cluster: Put and Get throughput against local memoryfs_server.py processes, healthy and with
+##            one (raid5) or one and two (raid6) servers killed
+
+## Builds a DiskBlocks for the layout without contacting any server (the codec only needs the stripe layout)
+
+def Layout(layout, n):
+    return DiskBlocks(n, {}, layout=layout)
+
+## Encodes P (and Q) for one stripe of random data blocks, then decodes the worst case:
+## one lost data block for raid5, two for raid6
+
+def MeasureCodec(layout, n, iterations):
+    disk = Layout(layout, n)
+    stripe = 0
+    data_servers = disk.Stripe_Data_Servers(stripe)
+    parity_servers = disk.Stripe_Parity_Servers(stripe)
+    data = [bytearray(os.urandom(BLOCK_SIZE)) for i in data_servers]
+
+    # P is the XOR of the data blocks; raid6 adds Q, the sum of g^x * D_x
+    def Encode():
+        members = {}
+        p = bytearray(BLOCK_SIZE)
+        q = bytearray(BLOCK_SIZE)
+        for x in range(len(data)):
+            members[data_servers[x]] = data[x]
+            p = XorBlocks(p, data[x])
+            if disk.parity_count == 2:
+                q = XorBlocks(q, GFMulBlock(GF_EXP[x], data[x]))
+        members[parity_servers[0]] = p
+        if disk.parity_count == 2:
+            members[parity_servers[1]] = q
+        return members
+
+    members = Encode()
+    lost = data_servers[:disk.parity_count]
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        Encode()
+    encode_s = time.perf_counter() - start
+
+    degraded = dict(members)
+    for i in lost:
+        degraded[i] = None
+    del degraded[lost[0]]
+    start = time.perf_counter()
+    for i in range(iterations):
+        block = disk.Decode(stripe, lost[0], degraded)
+    decode_s = time.perf_counter() - start
+    assert block == data[0]
+
+    stripe_bytes = len(data) * BLOCK_SIZE * iterations
+    return {
+        'part': 'codec', 'layout': layout, 'servers': n, 'lost': len(lost),
+        'encode_mb_per_s': round(stripe_bytes / encode_s / 1e6, 2),
+        'decode_mb_per_s': round(stripe_bytes / decode_s / 1e6, 2),
+    }
+
+## Put then Get of count random blocks in the data area; returns ops/s and latency per operation
+
+def RunOps(disk, blocks, rng):
+    result = {}
+    for op in ('put', 'get'):
+        samples = []
+        for block_number in blocks:
+            t0 = time.perf_counter()
+            if op == 'put':
+                disk.Put(block_number, bytearray(rng.randbytes(BLOCK_SIZE)))
+            else:
+                disk.Get(block_number)
+            samples.append(time.perf_counter() - t0)
+        result[op + '_ops_per_s'] = round(len(samples) / sum(samples), 1)
+        result[op + '_latency'] = Summary(samples)
+    return result
+
+def MeasureCluster(layout, n, count, killed):
+    procs, ports = StartServers(n)
+    try:
+        disk = DiskBlocks(n, ports, timeout=1.0, layout=layout)
+        disk.InitializeBlocks(True, b'\x12\x34\x56\x78')
+        rng = random.Random(0)
+        blocks = [rng.randrange(DATA_BLOCKS_OFFSET, TOTAL_NUM_BLOCKS) for i in range(count)]
+        # fill the blocks so degraded Gets reconstruct real data
+        for block_number in set(blocks):
+            disk.Put(block_number, bytearray(rng.randbytes(BLOCK_SIZE)))
+
+        results = []
+        for k in range(len(killed) + 1):
+            for i in killed[:k]:
+                if procs[i].poll() is None:
+                    procs[i].kill()
+                    procs[i].wait()
+            result = {'part': 'cluster', 'layout': layout, 'servers': n, 'killed': killed[:k]}
+            result.update(RunOps(disk, blocks, rng))
+            results.append(result)
+        return results
+    finally:
+        StopServers(procs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='raid5 vs raid6 throughput')
+    parser.add_argument('--servers', type=int, default=6)
+    parser.add_argument('--iterations', type=int, default=20000, help='stripes encoded and decoded in-process')
+    parser.add_argument('--requests', type=int, default=1000, help='Puts and Gets per cluster configuration')
+    parser.add_argument('--skip-cluster', action='store_true')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    for layout in sorted(RAID_LAYOUTS):
+        print(json.dumps(MeasureCodec(layout, options.servers, options.iterations)))
+    if not options.skip_cluster:
+        for layout in sorted(RAID_LAYOUTS):
+            for result in MeasureCluster(layout, options.servers, options.requests, [1, 3][:RAID_LAYOUTS[layout]]):
+                print(json.dumps(result))
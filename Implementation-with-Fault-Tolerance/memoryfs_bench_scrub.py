@@ -0,0 +1,56 @@
+import argparse, json, random, time
+import xmlrpc.client
+from memoryfs_client import TOTAL_NUM_BLOCKS
+from memoryfs_bench_util import StartServer, StopServers, Summary
+
+## Measures the foreground cost of the background scrubber in memoryfs_server.py
+## For each scrub rate, a fresh server is started (with one damaged block) and a client times the
+## Get_Checksum + Get pair that DiskBlocks.Get issues; rate 0 is the scrubber-off baseline.
+## Also reports how long the scrubber took to list the damaged block through ListCorrupt.
+
+def Measure(scrub_rate, requests, damage_block):
+    proc, address = StartServer([damage_block, '--scrub-rate', scrub_rate])
+    try:
+        server = xmlrpc.client.ServerProxy('http://' + address, use_builtin_types=True)
+        started = time.monotonic()
+        rng = random.Random(0)
+
+        result = {'scrub_rate': scrub_rate}
+
+        if scrub_rate > 0:
+            # two full passes are needed before a mismatch is reported
+            detected = None
+            deadline = started + 2.5 * TOTAL_NUM_BLOCKS / scrub_rate + 5
+            while time.monotonic() < deadline:
+                if damage_block in server.ListCorrupt():
+                    detected = round(time.monotonic() - started, 3)
+                    break
+                time.sleep(0.05)
+            result['damage_detected_after_s'] = detected
+
+        # warm up connection setup and code paths
+        for i in range(100):
+            server.Get_Checksum(0)
+
+        samples = []
+        for i in range(requests):
+            block_number = rng.randrange(TOTAL_NUM_BLOCKS)
+            t0 = time.perf_counter()
+            server.Get_Checksum(block_number)
+            server.Get(block_number)
+            samples.append(time.perf_counter() - t0)
+
+        result['get_latency'] = Summary(samples)
+        return result
+    finally:
+        StopServers([proc])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='foreground Get latency with and without the scrubber')
+    parser.add_argument('--rates', type=float, nargs='+', default=[0, 1000, 10000, 100000])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--damage-block', type=int, default=7)
+    options = parser.parse_args()
+
+    for rate in options.rates:
+        print(json.dumps(Measure(rate, options.requests, options.damage_block)))
@@ -0,0 +1,135 @@
+import os, sys, socket, subprocess, time
+from memoryfs_client import DiskBlocks, BLOCK_SIZE, TOTAL_NUM_BLOCKS, CHECKSUM_ALGORITHMS
+
+## Helpers shared by the memoryfs_bench_*.py scripts:
+## launching local memoryfs_server.py processes, summarizing latency samples, and an in-process fake cluster
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'memoryfs_server.py')
+
+## Returns a TCP port on localhost that is free right now
+
+def FreePort():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+## Starts one memoryfs_server.py on a free port, with extra command line arguments
+## Returns (process, 'localhost:port') once the server accepts connections
+
+def StartServer(extra_args=()):
+    port = FreePort()
+    proc = subprocess.Popen([sys.executable, SERVER_SCRIPT, str(port)] + [str(a) for a in extra_args],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return proc, 'localhost:' + str(port)
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError('memoryfs_server.py did not start on port ' + str(port))
+            time.sleep(0.05)
+
+## Starts n servers; extra_args maps a server index to its extra command line arguments
+## Returns (list of processes, dict of server index -> 'http://localhost:port') as DiskBlocks expects
+
+def StartServers(n, extra_args={}):
+    procs = []
+    ports = {}
+    for i in range(n):
+        proc, address = StartServer(extra_args.get(i, ()))
+        procs.append(proc)
+        ports[i] = 'http://' + address
+    return procs, ports
+
+def StopServers(procs):
+    for proc in procs:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+## Nearest-rank percentile of a list of samples, p in [0, 100]
+
+def Percentile(samples, p):
+    if len(samples) == 0:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+## Summary of latency samples in seconds, reported in microseconds
+
+def Summary(samples):
+    if len(samples) == 0:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'mean_us': round(sum(samples) / len(samples) * 1e6, 1),
+        'p50_us': round(Percentile(samples, 50) * 1e6, 1),
+        'p90_us': round(Percentile(samples, 90) * 1e6, 1),
+        'p99_us': round(Percentile(samples, 99) * 1e6, 1),
+        'max_us': round(max(samples) * 1e6, 1),
+    }
+
+## In-process stand-in for memoryfs_server.py: the same RPCs on a list of blocks, without network or XML
+## For micro-benchmarks of the client's CPU cost; no damage block, scrubber or stalls
+
+class FakeServer():
+    def __init__(self, checksum):
+        self.checksum = checksum
+        self.block = [bytes(BLOCK_SIZE)] * TOTAL_NUM_BLOCKS
+        self.checksums = [checksum(bytes(BLOCK_SIZE))] * TOTAL_NUM_BLOCKS
+        self.boot_id = os.urandom(8).hex()
+
+    def Put(self, block_number, putdata):
+        # the real server receives bytes, whatever the client sent
+        self.block[block_number] = bytes(putdata)
+        return 0
+
+    def Get(self, block_number):
+        return self.block[block_number]
+
+    def Put_Checksum(self, block_number, checksum):
+        self.checksums[block_number] = checksum
+        return 0
+
+    def Get_Checksum(self, block_number):
+        return self.checksums[block_number]
+
+    def GetMany(self, block_numbers):
+        return [self.block[block_number] for block_number in block_numbers]
+
+    def PutMany(self, block_numbers, blocks):
+        for block_number, putdata in zip(block_numbers, blocks):
+            self.Put(block_number, putdata)
+        return 0
+
+    def Get_Checksums(self, block_numbers):
+        return [self.checksums[block_number] for block_number in block_numbers]
+
+    def Put_Checksums(self, block_numbers, block_checksums):
+        for block_number, checksum in zip(block_numbers, block_checksums):
+            self.checksums[block_number] = checksum
+        return 0
+
+    def Get_Boot_Id(self):
+        return self.boot_id
+
+    def Format(self, name):
+        self.checksum = CHECKSUM_ALGORITHMS[name]
+        self.block = [bytes(BLOCK_SIZE)] * TOTAL_NUM_BLOCKS
+        self.checksums = [self.checksum(bytes(BLOCK_SIZE))] * TOTAL_NUM_BLOCKS
+        return self.boot_id
+
+## A DiskBlocks of n FakeServers, formatted; keyword arguments are passed to DiskBlocks (not pipeline, since
+## FakeServer has no system.multicall)
+
+def FakeDiskBlocks(n, **kwargs):
+    disk = DiskBlocks(n, {}, **kwargs)
+    servers = [FakeServer(disk.Checksum) for i in range(n)]
+    disk.Proxy = lambda i: servers[i]
+    disk.InitializeBlocks(True, b'\x12\x34\x56\x78')
+    return disk
@@ -0,0 +1,153 @@
+import argparse, json, os, sys, threading
+from memoryfs_client import *
+from memoryfs_bench_util import FakeDiskBlocks
+
+## Consistency checks of the client on an in-process fake cluster (FakeDiskBlocks), for cases that are hard to
+## reach from the shell. Every check returns a list of failure messages (empty when it passes) and is reported
+## as one JSON line; the exit status is 1 if any check failed.
+
+# seconds a check waits for an operation that must not hang
+DEADLOCK_TIMEOUT = 5.0
+
+## Corrupt: overwrites the home copy of logical block block_number on its server, leaving its checksum stale
+
+def Corrupt(disk, block_number):
+    disk.Proxy(disk.map_server[block_number]).block[disk.map_block[block_number]] = bytes(b'Z' * BLOCK_SIZE)
+
+## Finishes: runs fn in a thread and returns True if it returned within DEADLOCK_TIMEOUT
+
+def Finishes(fn, *args):
+    thread = threading.Thread(target=fn, args=args, daemon=True)
+    thread.start()
+    thread.join(DEADLOCK_TIMEOUT)
+    return not thread.is_alive()
+
+## A Put to a block whose home copy fails its checksum, with hedged reads on: PutBlock holds rebuild_lock, which
+## the read-repair of the old contents needs as well
+
+def CheckHedgedPutOfCorruptBlock():
+    failures = []
+    for layout in sorted(RAID_LAYOUTS):
+        disk = FakeDiskBlocks(4 + RAID_LAYOUTS[layout], layout=layout, hedge_percentile=50)
+        block_number = DATA_BLOCKS_OFFSET + 4
+        Corrupt(disk, block_number)
+        data = bytearray(b'new contents'.ljust(BLOCK_SIZE, b'\x00'))
+        if not Finishes(disk.Put, block_number, data):
+            failures.append(layout + ': Put of a corrupt block did not return')
+        elif disk.Get(block_number) != data:
+            failures.append(layout + ': Put of a corrupt block wrote the wrong contents')
+    return failures
+
+## Mount: a formatted fake volume with a root directory, and its FileName
+
+def Mount():
+    disk = FakeDiskBlocks(4)
+    fs = FileName(disk)
+    fs.InitRootInode()
+    return disk, fs
+
+## LoadInode: the inode of inode_number as stored on disk
+
+def LoadInode(disk, inode_number):
+    inode = InodeNumber(disk, inode_number)
+    inode.InodeNumberToInode()
+    return inode.inode
+
+## Link and Unlink keep the refcnt of the file (its names) and of the directory (its entries) balanced
+
+def CheckLinkUnlinkRefcnt():
+    failures = []
+    disk, fs = Mount()
+    root_refcnt = LoadInode(disk, 0).refcnt
+    target = fs.Create(0, 'f', INODE_TYPE_FILE)
+    fs.Link('f', 'g', 0)
+    if LoadInode(disk, target).refcnt != 2 or LoadInode(disk, 0).refcnt != root_refcnt + 2:
+        failures.append('refcnt after Create and Link: file ' + str(LoadInode(disk, target).refcnt) +
+                        ', directory ' + str(LoadInode(disk, 0).refcnt - root_refcnt) + ' above its initial value')
+    fs.Unlink('g', 0)
+    if LoadInode(disk, target).refcnt != 1 or fs.Lookup('f', 0) != target:
+        failures.append('Unlink of one name of two: file refcnt ' + str(LoadInode(disk, target).refcnt))
+    fs.Unlink('f', 0)
+    if LoadInode(disk, target).type != INODE_TYPE_INVALID:
+        failures.append('Unlink of the last name left the file inode in use')
+    if LoadInode(disk, 0).refcnt != root_refcnt:
+        failures.append('directory refcnt ' + str(LoadInode(disk, 0).refcnt) + ' after unlinking every name, was ' +
+                        str(root_refcnt))
+    return failures
+
+## Removing an entry moves the last entry into its slot, and a last directory block left empty is freed
+
+def CheckDirectoryCompaction():
+    failures = []
+    disk, fs = Mount()
+    directory = fs.Create(0, 'd', INODE_TYPE_DIR)
+    names = ['f' + str(i) for i in range(FILE_ENTRIES_PER_DATA_BLOCK)]
+    for name in names:
+        fs.Create(directory, name, INODE_TYPE_FILE)
+    # "." and ".." come first, so the last two names are in the second block
+    if LoadInode(disk, directory).block_numbers[1] == 0:
+        return ['directory of ' + str(len(names) + 2) + ' entries has a single block']
+    for name in names[:2]:
+        fs.Unlink(name, directory)
+        names.remove(name)
+    inode = LoadInode(disk, directory)
+    if inode.size != (len(names) + 2) * FILE_NAME_DIRENTRY_SIZE:
+        failures.append('directory size ' + str(inode.size) + ' for ' + str(len(names) + 2) + ' entries')
+    if inode.block_numbers[1] != 0:
+        failures.append('emptied last directory block was not freed')
+    for name in names:
+        if fs.Lookup(name, directory) == -1:
+            failures.append(name + ' lost by the compaction')
+    return failures
+
+## After a Reclaimer flush the free bitmap marks exactly the data blocks the valid inodes hold
+
+def CheckBitmapAfterFlush():
+    disk, fs = Mount()
+    for i in range(4):
+        fs.Write(fs.Create(0, 'f' + str(i), INODE_TYPE_FILE), 0, bytearray(b'x' * MAX_FILE_SIZE))
+    fs.Link('f0', 'g', 0)
+    for name in ['f0', 'f1', 'f2']:
+        fs.Unlink(name, 0)
+    fs.Truncate(fs.Lookup('f3', 0), 1)
+    disk.reclaimer.Flush()
+
+    held = set()
+    for inode_number in range(MAX_NUM_INODES):
+        inode = LoadInode(disk, inode_number)
+        if inode.type != INODE_TYPE_INVALID:
+            held.update(b for b in inode.block_numbers if b != 0)
+    bitmap = bytearray()
+    for i in range(FREEBITMAP_NUM_BLOCKS):
+        bitmap += disk.Get(FREEBITMAP_BLOCK_OFFSET + i)
+    used = set(b for b in range(DATA_BLOCKS_OFFSET, TOTAL_NUM_BLOCKS) if bitmap[b])
+    failures = []
+    if used - held:
+        failures.append('marked used but held by no inode: ' + str(sorted(used - held)))
+    if held - used:
+        failures.append('held by an inode but marked free: ' + str(sorted(held - used)))
+    return failures
+
+CHECKS = {
+    'hedged_put_of_corrupt_block': CheckHedgedPutOfCorruptBlock,
+    'link_unlink_refcnt': CheckLinkUnlinkRefcnt,
+    'directory_compaction': CheckDirectoryCompaction,
+    'bitmap_after_flush': CheckBitmapAfterFlush,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='client consistency checks on a fake in-process cluster')
+    parser.add_argument('--only', nargs='+', choices=sorted(CHECKS), help='run only these checks')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    failed = False
+    for name, check in CHECKS.items():
+        if options.only is not None and name not in options.only:
+            continue
+        failures = check()
+        failed = failed or len(failures) > 0
+        print(json.dumps({'check': name, 'ok': len(failures) == 0, 'failures': failures}))
+    # a check that found a deadlock leaves threads behind that would keep a normal exit waiting
+    sys.stdout.flush()
+    os._exit(1 if failed else 0)
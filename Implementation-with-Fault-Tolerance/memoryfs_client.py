@@ -1,7 +1,13 @@
-import hashlib
+import hashlib, zlib, struct
 import xmlrpc.client
 import pickle, logging
 import socket
+import threading, time, json, os
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from memoryfs_metrics import Metrics, MeasuredOp, PayloadSize
+from memoryfs_log import LOG, Hex
 
 ##### File system constants
 
@@ -47,6 +53,9 @@ INODE_NUM_BLOCKS = (MAX_NUM_INODES * INODE_SIZE) // BLOCK_SIZE
 # In total, 4+2+2=8 bytes are used for size+type+refcnt, remaining bytes for block numbers
 MAX_INODE_BLOCK_NUMBERS = (INODE_SIZE - 8) // 4
 
+# On-disk inode layout: size, type, refcnt, then the block numbers, all big-endian
+INODE_STRUCT = struct.Struct('>IHH' + str(MAX_INODE_BLOCK_NUMBERS) + 'I')
+
 # maximum size of a file
 # maximum number of entries in an inode's block_numbers[], times block size
 MAX_FILE_SIZE = MAX_INODE_BLOCK_NUMBERS*BLOCK_SIZE
@@ -70,140 +79,957 @@ INODE_TYPE_FILE = 1
 INODE_TYPE_DIR = 2
 INODE_TYPE_SYM = 3
 
+# whence values of FileName.Seek, as in lseek(2)
+SEEK_DATA = 3
+SEEK_HOLE = 4
+
+# Block checksum algorithms
+# Each function returns a raw binary digest; digests are stored and sent as bytes, not hex strings
+# The algorithm a volume uses is recorded in its superblock
+
+def ChecksumMD5(data):
+    return hashlib.md5(data).digest()
+
+def ChecksumCRC32(data):
+    return zlib.crc32(data).to_bytes(4, 'big')
+
+def ChecksumBLAKE2b(data):
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+CHECKSUM_ALGORITHMS = {'md5': ChecksumMD5, 'crc32': ChecksumCRC32, 'blake2b': ChecksumBLAKE2b}
+
+# MD5 stays the default for compatibility with existing volumes
+DEFAULT_CHECKSUM = 'md5'
+
+# RAID layouts supported by DiskBlocks
+#   raid5: one rotating XOR parity block per stripe, survives one missing or corrupt server
+#   raid6: rotating P (XOR) and Q (Reed-Solomon) parity blocks per stripe, survives two
+RAID_LAYOUTS = {'raid5': 1, 'raid6': 2}
+DEFAULT_LAYOUT = 'raid5'
+
+# Default stripe unit, in blocks per server per stripe (see DiskBlocks.Map)
+DEFAULT_CHUNK_SIZE = 1
+
+# Hedged reads (see DiskBlocks.HedgedRead): home-server latencies kept to compute the hedge threshold,
+# and how many are needed before any read is hedged
+HEDGE_WINDOW = 1000
+HEDGE_MIN_SAMPLES = 20
+
+# Pipelining: writes queued per server before they are sent as one system.multicall request regardless
+PIPELINE_DEPTH = 32
+
+# Block reclamation (see Reclaimer): seconds freed blocks wait, so that the frees of one delete go to the free
+# bitmap together
+RECLAIM_DELAY = 0.05
+
+# Server health states kept by DiskBlocks
+#   up: requests are sent normally
+#   suspect: the last request failed; one more failure marks the server down
+#   down: requests fail immediately without touching the network; a background thread probes the server
+#   probing: down, with a probe in flight
+SERVER_UP = 'up'
+SERVER_SUSPECT = 'suspect'
+SERVER_DOWN = 'down'
+SERVER_PROBING = 'probing'
+
 #### BLOCK LAYER
 
+## Block arithmetic for parity
+## XorBlocks works on whole blocks as big integers, and GF(2^8) multiplication of a block by a constant
+## is one bytes.translate() through a precomputed 256-entry table, so neither loops over bytes in Python
+
+def XorBlocks(a, b):
+    return bytearray((int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big'))
+
+# GF(2^8) with the polynomial x^8+x^4+x^3+x^2+1 (0x11d) and generator g = 2, as used by Linux md RAID-6
+GF_EXP = [0] * 510
+GF_LOG = [0] * 256
+gf_x = 1
+for gf_i in range(255):
+    GF_EXP[gf_i] = gf_x
+    GF_LOG[gf_x] = gf_i
+    gf_x <<= 1
+    if gf_x & 0x100:
+        gf_x ^= 0x11d
+for gf_i in range(255, 510):
+    GF_EXP[gf_i] = GF_EXP[gf_i - 255]
+
+def GFMul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+def GFInv(a):
+    return GF_EXP[255 - GF_LOG[a]]
+
+# GF_MUL_TABLES[c] maps every byte x to c*x
+GF_MUL_TABLES = [bytes(GFMul(c, x) for x in range(256)) for c in range(256)]
+
+## Multiplies every byte of block by the constant c in GF(2^8)
+
+def GFMulBlock(c, block):
+    return bytearray(block.translate(GF_MUL_TABLES[c]))
+
+## xmlrpc.client transport with a socket timeout, so a hung server raises socket.timeout instead of blocking forever
+
+class TimeoutTransport(xmlrpc.client.Transport):
+    def __init__(self, timeout):
+        super().__init__(use_builtin_types=True)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
 class DiskBlocks():
-    def __init__(self, N, ports):
+    def __init__(self, N, ports, timeout=2.0, probe_interval=1.0, checksum=DEFAULT_CHECKSUM, layout=DEFAULT_LAYOUT,
+                 chunk_size=DEFAULT_CHUNK_SIZE, hedge_percentile=None, pipeline=False):
         self.N = N
-        self.servers = {}
+        self.ports = ports
+        # RAID layout: number of parity blocks per stripe, and data blocks per stripe
+        self.layout = layout
+        self.parity_count = RAID_LAYOUTS[layout]
+        self.data_per_stripe = N - self.parity_count
+        if self.data_per_stripe < 2:
+            LOG.Error('DiskBlocks: %s needs at least %s servers', layout, self.parity_count + 2)
+            quit()
+        # Stripe unit: consecutive logical blocks stored on the same server before moving to the next one
+        self.chunk_size = chunk_size
+        self.stripe_blocks = self.data_per_stripe * chunk_size
+        # physical blocks used on every server: whole stripes of chunk_size blocks
+        self.num_rows = ((TOTAL_NUM_BLOCKS - 1) // self.stripe_blocks + 1) * chunk_size
+        if chunk_size < 1 or self.num_rows > TOTAL_NUM_BLOCKS:
+            LOG.Error('DiskBlocks: invalid chunk size %s', chunk_size)
+            quit()
+        self.BuildMapTables()
+        self.timeout = timeout
+        # Block checksum algorithm, one of CHECKSUM_ALGORITHMS
+        self.checksum_name = checksum
+        self.Checksum = CHECKSUM_ALGORITHMS[checksum]
+        # ServerProxy objects are not thread-safe, so every thread gets its own set (see Proxy())
+        self.proxies = threading.local()
+
+        # Failure detector: per-server health state, see SERVER_UP etc.
+        self.probe_interval = probe_interval
+        self.health = {}
         for i in range(N):
-            self.servers[i] = xmlrpc.client.ServerProxy(ports[i], use_builtin_types=True)
-        self.servers_put = {}
-        self.servers_get = {}
+            self.health[i] = SERVER_UP
+        self.health_lock = threading.Lock()
+        self.prober = None
+        # Boot id of every server when this client formatted or rebuilt it; a server that comes back with a
+        # different boot id was restarted and lost its blocks, so it stays down until Rebuild() refills it
+        self.boot_ids = {}
+        # Physical blocks per server whose write failed; they are stale until Resync() rewrites them
+        self.missed = {}
         for i in range(N):
-            self.servers_put[i] = 0
+            self.missed[i] = set()
+        # Requests per method and server, file system operations, and counters (see memoryfs_metrics)
+        # Counters per server: block_put/block_get (logical blocks written/read that involve the server),
+        # reconstructions, checksum_mismatches, read_repairs, failed_repairs (rewrites that did not stick)
+        self.metrics = Metrics()
+
+        # Inode table cache (InodeTable), set when a FileName mounts the volume; Put() keeps it up to date
+        self.inode_table = None
+        # Deferred freeing of data blocks (Reclaimer), also set when a FileName mounts the volume
+        self.reclaimer = None
+
+        # State of a running Rebuild(): target server and first physical block not rebuilt yet, or None
+        self.rebuild = None
+        # Held by Rebuild() while it processes a batch and by every Put(),
+        # so a foreground write never lands between the read and the write of a batch
+        self.rebuild_lock = threading.RLock()
+
+        # Hedged reads: if set, a Get whose home server has not answered within this percentile of recent
+        # home-server latencies also starts a reconstruction from the other servers (see HedgedRead)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_lock = threading.Lock()
+        self.hedge_samples = deque(maxlen=HEDGE_WINDOW)
+        self.hedge_recorded = 0
+        self.hedge_threshold = None
+        self.hedge_stats = {'reads': 0, 'hedged': 0, 'won': 0, 'saved': 0.0}
+        if hedge_percentile is not None:
+            # home reads and hedges run in one pool, the member reads of a hedge in another, so a hedge
+            # waiting for its members can never starve them of threads
+            self.hedge_pool = ThreadPoolExecutor(max_workers=4 * N)
+            self.member_pool = ThreadPoolExecutor(max_workers=4 * N)
+
+        # Pipelining: if set, block writes are queued per server and sent in one system.multicall request
+        # together with the next request to that server, or by Flush() (see ServerCalls and QueueWrite)
+        self.pipeline = pipeline
+        self.pending = {}
+        self.pending_locks = {}
         for i in range(N):
-            self.servers_get[i] = 0
+            self.pending[i] = []
+            self.pending_locks[i] = threading.Lock()
 
     def get_put_request(self):
-        return self.servers_put
+        servers_put = {}
+        for i in range(self.N):
+            servers_put[i] = self.metrics.Counter('block_put', i)
+        return servers_put
 
     def get_get_request(self):
-        return self.servers_get
+        servers_get = {}
+        for i in range(self.N):
+            servers_get[i] = self.metrics.Counter('block_get', i)
+        return servers_get
+
+    def get_repairs(self):
+        return self.metrics.Total('read_repairs')
+
+    ## Returns the number of HTTP requests sent to every server
+
+    def get_round_trips(self):
+        round_trips = {}
+        for i in range(self.N):
+            round_trips[i] = self.metrics.Requests(i)
+        return round_trips
+
+    def get_metrics(self):
+        return self.metrics.Snapshot()
+
+    def reset_metrics(self):
+        self.metrics.Reset()
+
+    ## Returns the hedged read counters: reads, reads hedged, hedges that answered first, their rate,
+    ## the latency saved by hedges that won (home latency minus hedge latency) and the current threshold
+
+    def get_hedge_stats(self):
+        with self.hedge_lock:
+            stats = dict(self.hedge_stats)
+            threshold = self.hedge_threshold
+        stats['hedge_rate'] = stats['hedged'] / stats['reads'] if stats['reads'] > 0 else 0.0
+        stats['saved_ms'] = round(stats.pop('saved') * 1e3, 3)
+        stats['threshold_ms'] = None if threshold is None else round(threshold * 1e3, 3)
+        return stats
+
+    ## Returns the calling thread's ServerProxy for server i
+
+    def Proxy(self, i):
+        servers = getattr(self.proxies, 'servers', None)
+        if servers is None:
+            servers = {}
+            for j in range(self.N):
+                servers[j] = xmlrpc.client.ServerProxy(self.ports[j], transport=TimeoutTransport(self.timeout))
+            self.proxies.servers = servers
+        return servers[i]
+
+    ## ServerCall: sends one request to server i through the failure detector
+    ## Raises socket.error at once, without any network traffic, if the server is known to be down;
+    ## callers handle that exactly like a refused connection (reconstruction or parity-only writes)
+
+    def ServerCall(self, i, method, *args):
+        return self.ServerCalls(i, [(method, args)])[0]
+
+    ## ServerCalls: sends a list of (method, args) calls to server i and returns their results
+    ## With pipelining, the writes queued for the server go first and everything is one system.multicall
+    ## request, so a read always sees the writes queued before it. Queued writes that fail (or are dropped
+    ## because the server is down) are recorded in missed, exactly like a failed direct write.
+
+    def ServerCalls(self, i, calls):
+        if not self.pipeline:
+            if self.health[i] == SERVER_DOWN or self.health[i] == SERVER_PROBING:
+                raise ConnectionRefusedError('server ' + str(i) + ' is down')
+            results = []
+            for method, args in calls:
+                results.append(self.Request(i, method, args))
+        else:
+            # the lock is held during the request, so queued writes reach the server in the order they were made
+            with self.pending_locks[i]:
+                queued = self.pending[i]
+                self.pending[i] = []
+                try:
+                    if self.health[i] == SERVER_DOWN or self.health[i] == SERVER_PROBING:
+                        raise ConnectionRefusedError('server ' + str(i) + ' is down')
+                    if len(queued) + len(calls) == 0:
+                        return []
+                    if len(queued) + len(calls) == 1:
+                        method, args = (queued + calls)[0]
+                        results = [self.Request(i, method, args)]
+                    else:
+                        multicall = xmlrpc.client.MultiCall(self.Proxy(i))
+                        for method, args in queued + calls:
+                            getattr(multicall, method)(*args)
+                            self.metrics.Count('multicall.' + method, i)
+                        results = self.Request(i, 'system.multicall', [args for method, args in queued + calls], multicall)[len(queued):]
+                except socket.error:
+                    for method, args in queued:
+                        self.missed[i].add(args[0])
+                    raise
+        if self.health[i] == SERVER_SUSPECT:
+            self.SetHealth(i, SERVER_UP)
+        return results
+
+    ## Request: sends one HTTP request to server i and records it in the metrics; raises socket.error on failure
+    ## A multicall is sent by passing the xmlrpc.client.MultiCall (args then only serve to count the bytes sent),
+    ## and returns the list of its results
+
+    def Request(self, i, method, args, multicall=None):
+        started = time.perf_counter()
+        try:
+            if multicall is None:
+                result = getattr(self.Proxy(i), method)(*args)
+            else:
+                # iterating the results raises xmlrpc.client.Fault for a call that failed on the server
+                result = list(multicall())
+        except socket.error:
+            self.metrics.RecordRPC(i, method, time.perf_counter() - started, PayloadSize(args), 0, True)
+            self.RecordFailure(i)
+            raise
+        self.metrics.RecordRPC(i, method, time.perf_counter() - started, PayloadSize(args), PayloadSize(result))
+        return result
+
+    ## QueueWrite: writes a physical block and its checksum to server i
+    ## With pipelining the two calls are only queued; they are sent by the next request to the server,
+    ## or at once when PIPELINE_DEPTH blocks are waiting. Raises socket.error like ServerCall.
+
+    def QueueWrite(self, i, block_num, data):
+        calls = [('Put', (block_num, data)), ('Put_Checksum', (block_num, self.Checksum(data)))]
+        if not self.pipeline:
+            self.ServerCalls(i, calls)
+            return
+        if self.health[i] == SERVER_DOWN or self.health[i] == SERVER_PROBING:
+            raise ConnectionRefusedError('server ' + str(i) + ' is down')
+        with self.pending_locks[i]:
+            self.pending[i].extend(calls)
+            full = len(self.pending[i]) >= 2 * PIPELINE_DEPTH
+        if full:
+            self.ServerCalls(i, [])
+
+    ## Flush: sends the writes queued for every server; called at the end of each file system operation
+    ## Writes to an unreachable server end up in missed, as usual
+
+    def Flush(self):
+        if not self.pipeline:
+            return
+        for i in range(self.N):
+            try:
+                self.ServerCalls(i, [])
+            except socket.error:
+                pass
+
+    def RecordFailure(self, i):
+        with self.health_lock:
+            if self.health[i] == SERVER_UP:
+                self.health[i] = SERVER_SUSPECT
+                logging.info('Server ' + str(i) + ' is suspect')
+                return
+            if self.health[i] == SERVER_SUSPECT:
+                self.health[i] = SERVER_DOWN
+                logging.info('Server ' + str(i) + ' is down')
+                if self.prober is None:
+                    self.prober = threading.Thread(target=self.Probe, daemon=True)
+                    self.prober.start()
+
+    def SetHealth(self, i, state):
+        with self.health_lock:
+            if self.health[i] != state:
+                logging.info('Server ' + str(i) + ' is ' + state)
+                self.health[i] = state
+
+    ## Probe: background thread that retries down servers every probe_interval seconds, and exits once all are up
+    ## Note a server that comes back empty (e.g. restarted) must be brought up to date with Rebuild()
+
+    def Probe(self):
+        while True:
+            time.sleep(self.probe_interval)
+            down = []
+            with self.health_lock:
+                for i in range(self.N):
+                    if self.health[i] == SERVER_DOWN:
+                        self.health[i] = SERVER_PROBING
+                        down.append(i)
+            for i in down:
+                try:
+                    boot_id = self.Proxy(i).Get_Boot_Id()
+                    if i in self.boot_ids and boot_id != self.boot_ids[i]:
+                        LOG.Error('Probe: server %s was restarted and lost its blocks; it needs a rebuild', i)
+                        self.SetHealth(i, SERVER_DOWN)
+                        continue
+                    self.SetHealth(i, SERVER_UP)
+                    self.Resync(i)
+                except socket.error:
+                    self.SetHealth(i, SERVER_DOWN)
+            with self.health_lock:
+                if all(state == SERVER_UP or state == SERVER_SUSPECT for state in self.health.values()):
+                    self.prober = None
+                    return
+
+    ## Resync: rewrites the blocks a server missed while it was unreachable, reconstructing them from the others
+
+    def Resync(self, i):
+        with self.rebuild_lock:
+            for block_num in sorted(self.missed[i]):
+                trans = self.Retrieve_Block_Content(i, block_num)
+                self.QueueWrite(i, block_num, trans)
+                self.missed[i].discard(block_num)
+            self.ServerCalls(i, [])
+        logging.info('Resync: server ' + str(i) + ' is up to date')
+
+    ## Returns True if physical block block_num of server must not be read from that server,
+    ## because a rebuild of the server is running and has not reached the block yet
+
+    def Stale(self, server, block_num):
+        if block_num in self.missed[server]:
+            return True
+        rebuild = self.rebuild
+        return rebuild is not None and rebuild['target'] == server and block_num >= rebuild['next_block']
 
     ## Put: interface to write a raw block of data to the block indexed by block number
     ## Blocks are padded with zeroes up to BLOCK_SIZE
     def Put(self, block_number, block_data):
-        logging.debug('Put: block number ' + str(block_number) + ' len ' + str(len(block_data)) + '\n' + str(block_data.hex()))
+        LOG.Debug('Put: block number %s len %s\n%s', block_number, len(block_data), Hex(block_data))
         if len(block_data) > BLOCK_SIZE:
-            logging.error('Put: Block larger than BLOCK_SIZE: ' + str(len(block_data)))
+            LOG.Error('Put: Block larger than BLOCK_SIZE: %s', len(block_data))
             quit()
 
         if block_number in range(0, TOTAL_NUM_BLOCKS):
             # ljust does the padding with zeros
             putdata = bytearray(block_data.ljust(BLOCK_SIZE, b'\x00'))
-            physical_block = self.Map(block_number)
-            parity_block = self.Parity_Map(block_number)
-            data_server_num = physical_block['server']
-            data_block_num = physical_block['block']
-            parity_server_num = parity_block['server']
-            parity_block_num = parity_block['block']
-
-            self.servers_put[data_server_num] += 1
-            self.servers_put[parity_server_num] += 1
-
-            try:
-                old_data = self.Get(block_number)
-            except socket.error:
-                old_data = self.Retrieve_Block_Content(physical_block)
-
-            try:
-                parity = self.servers[parity_server_num].Get(parity_block_num)
-            except socket.error:
-                parity = self.Retrieve_Block_Content(parity_block)
-
-
-            new_parity = bytearray(len(parity))
-            for i in range(len(parity)):
-                new_parity[i] = old_data[i] ^ putdata[i] ^ parity[i]
-
-            # Write block
-            try:
-                self.servers[data_server_num].Put(data_block_num, putdata)
-                self.servers[data_server_num].Put_Checksum(data_block_num, hashlib.md5(putdata).hexdigest())
-            except socket.error:
-                pass
+            with self.rebuild_lock:
+                result = self.PutBlock(block_number, putdata)
+            # every write of an inode table block goes through here, which keeps the inode table cache current
+            index = block_number - INODE_BLOCK_OFFSET
+            if self.inode_table is not None and 0 <= index < INODE_NUM_BLOCKS:
+                self.inode_table.LoadBlock(index, putdata)
+            return result
+        else:
+            LOG.Error('Put: Block out of range: %s', block_number)
+            quit()
 
+    ## Writes one padded block and updates its parity block(s); called by Put()
+    ## Parity is updated from the change to the data block: P ^= old ^ new, and for raid6 Q ^= g^index * (old ^ new)
+
+    def PutBlock(self, block_number, putdata):
+        data_server_num = self.map_server[block_number]
+        data_block_num = self.map_block[block_number]
+
+        # all blocks of a stripe row share the physical block number
+        parity_servers = [self.map_parity[block_number]]
+        if self.parity_count == 2:
+            parity_servers.append(self.map_q[block_number])
+
+        self.metrics.Count('block_put', data_server_num)
+        for parity_server_num in parity_servers:
+            self.metrics.Count('block_put', parity_server_num)
+
+        # read inline, never hedged: the caller holds rebuild_lock, which a read-repair on a hedge pool thread
+        # would wait for
+        self.metrics.Count('block_get', data_server_num)
+        try:
+            old_data = self.ReadPhysical(data_server_num, data_block_num)
+        except socket.error:
+            old_data = self.Retrieve_Block_Content(data_server_num, data_block_num)
+
+        delta = XorBlocks(old_data, putdata)
+
+        # the parity blocks are verified against their checksum like any data block
+        new_parities = []
+        for parity_server_num in parity_servers:
+            parity = self.ReadPhysical(parity_server_num, data_block_num)
+            if len(new_parities) == 0:
+                new_parities.append(XorBlocks(parity, delta))
+            else:
+                index = self.map_index[block_number]
+                new_parities.append(XorBlocks(parity, GFMulBlock(GF_EXP[index], delta)))
+
+        # Write block
+        # blocks of a server under rebuild that are not rebuilt yet are skipped; the rebuild will produce them
+        try:
+            if not self.Stale(data_server_num, data_block_num):
+                self.QueueWrite(data_server_num, data_block_num, putdata)
+        except socket.error:
+            self.missed[data_server_num].add(data_block_num)
+
+        parity_block_num = data_block_num
+        for parity_server_num, new_parity in zip(parity_servers, new_parities):
             try:
-                self.servers[parity_server_num].Put(parity_block_num, new_parity)
-                self.servers[parity_server_num].Put_Checksum(parity_block_num, hashlib.md5(new_parity).hexdigest())
+                if not self.Stale(parity_server_num, parity_block_num):
+                    self.QueueWrite(parity_server_num, parity_block_num, new_parity)
             except socket.error:
-                pass
+                self.missed[parity_server_num].add(parity_block_num)
 
-            return 0
-        else:
-            logging.error('Put: Block out of range: ' + str(block_number))
-            quit()
+        return 0
 
     ## Get: interface to read a raw block of data from block indexed by block number
     ## Equivalent to the textbook's BLOCK_NUMBER_TO_BLOCK(b)
     def Get(self, block_number):
-        logging.debug('Get: ' + str(block_number))
+        LOG.Debug('Get: %s', block_number)
         if block_number in range(0, TOTAL_NUM_BLOCKS + 1):
             # logging.debug ('\n' + str((self.block[block_number]).hex()))
-            physical_block = self.Map(block_number)
+            server = self.map_server[block_number]
+
+            self.metrics.Count('block_get', server)
 
-            self.servers_get[physical_block['server']] += 1
+            if self.hedge_percentile is not None:
+                return self.HedgedRead(server, self.map_block[block_number])
+            return self.ReadPhysical(server, self.map_block[block_number])
+
+        LOG.Error('Get: Block number larger than TOTAL_NUM_BLOCKS: %s', block_number)
+        quit()
 
+    ## GetMany: reads a list of logical blocks with one request per server involved (GetMany and Get_Checksums)
+    ## Blocks that fail their checksum, are stale, or sit on a server that fails are read again one by one
+    ## through ReadPhysical, which reconstructs and repairs them. Returns bytearrays in the order of block_numbers.
+
+    def GetMany(self, block_numbers):
+        LOG.Debug('GetMany: %s', block_numbers)
+        for block_number in block_numbers:
+            if block_number not in range(0, TOTAL_NUM_BLOCKS):
+                LOG.Error('GetMany: Block number larger than TOTAL_NUM_BLOCKS: %s', block_number)
+                quit()
+
+        # positions in block_numbers of the blocks read from each server
+        per_server = {}
+        for k in range(len(block_numbers)):
+            server = self.map_server[block_numbers[k]]
+            self.metrics.Count('block_get', server)
+            if not self.Stale(server, self.map_block[block_numbers[k]]):
+                per_server.setdefault(server, []).append(k)
+
+        result = [None] * len(block_numbers)
+        for server, positions in per_server.items():
+            physical = [self.map_block[block_numbers[k]] for k in positions]
             try:
-                checksum = self.servers[physical_block['server']].Get_Checksum(physical_block['block'])
-                cur_content = self.servers[physical_block['server']].Get(physical_block['block'])
-                if checksum == hashlib.md5(cur_content).hexdigest():
-                    content = cur_content
-                    trans = bytearray(content)
-                else:
-                    trans = self.Retrieve_Block_Content(physical_block)
+                contents, checksums = self.ServerCalls(server, [('GetMany', (physical,)),
+                                                                ('Get_Checksums', (physical,))])
             except socket.error:
-                trans = self.Retrieve_Block_Content(physical_block)
-            return trans
+                continue
+            for k, content, checksum in zip(positions, contents, checksums):
+                if checksum == self.Checksum(content):
+                    result[k] = bytearray(content)
+
+        for k in range(len(block_numbers)):
+            if result[k] is None:
+                result[k] = self.ReadPhysical(self.map_server[block_numbers[k]], self.map_block[block_numbers[k]])
+        return result
+
+    ## ReadPhysical: reads a physical block (data or parity) from its server and verifies its checksum
+    ## Falls back to reconstruction from the other servers if the server is unreachable, and to
+    ## reconstruction plus read-repair if the block is corrupt or stale
+
+    def ReadPhysical(self, server, block_num):
+        try:
+            if self.Stale(server, block_num):
+                return self.RepairBlock(server, block_num)
+            checksum, cur_content = self.ServerCalls(server, [('Get_Checksum', (block_num,)), ('Get', (block_num,))])
+            if checksum == self.Checksum(cur_content):
+                content = cur_content
+                trans = bytearray(content)
+            else:
+                logging.info('ReadPhysical: checksum mismatch on server ' + str(server) + ' block ' + str(block_num))
+                self.metrics.Count('checksum_mismatches', server)
+                trans = self.RepairBlock(server, block_num)
+        except socket.error:
+            trans = self.Retrieve_Block_Content(server, block_num)
+        return trans
 
-        logging.error('Get: Block number larger than TOTAL_NUM_BLOCKS: ' + str(block_number))
-        quit()
+    ## HedgedRead: ReadPhysical, with a reconstruction from the other servers started as a hedge when the
+    ## home server is slower than the hedge_percentile of its recent latencies; the first answer wins.
+    ## A slow home server (GC pause, overload) then costs about one threshold plus one parallel stripe read.
+    ## Must not be called with rebuild_lock held (PutBlock reads with ReadPhysical): the home read runs on a pool
+    ## thread and may need the lock to repair the block.
+
+    def HedgedRead(self, server, block_num):
+        if self.health[server] != SERVER_UP or self.Stale(server, block_num):
+            return self.ReadPhysical(server, block_num)
+
+        started = time.perf_counter()
+        home = self.hedge_pool.submit(self.ReadPhysical, server, block_num)
+        home.add_done_callback(lambda f: self.RecordHomeLatency(time.perf_counter() - started))
+        with self.hedge_lock:
+            self.hedge_stats['reads'] += 1
+            threshold = self.hedge_threshold
+
+        if threshold is None or len(wait([home], timeout=threshold).done) > 0:
+            return home.result()
+
+        hedge = self.hedge_pool.submit(self.HedgeReconstruct, server, block_num)
+        done = wait([home, hedge], return_when=FIRST_COMPLETED).done
+        if home in done:
+            return home.result()
+        trans = hedge.result()
+        if trans is None:
+            return home.result()
+
+        # the hedge won; the latency saved is known once the home server answers
+        finished = time.perf_counter()
+        with self.hedge_lock:
+            self.hedge_stats['won'] += 1
+        home.add_done_callback(lambda f: self.RecordHedgeSaving(time.perf_counter() - finished))
+        return trans
+
+    ## HedgeReconstruct: reads the other members of the stripe in parallel and decodes the block
+    ## Returns None if no hedge could be made: a Put holds rebuild_lock (the stripe may be mid-update),
+    ## or too many members are missing
+
+    def HedgeReconstruct(self, server, block_num):
+        if not self.rebuild_lock.acquire(blocking=False):
+            return None
+        try:
+            with self.hedge_lock:
+                self.hedge_stats['hedged'] += 1
+            reads = {}
+            for i in range(self.N):
+                if i != server and not self.Stale(i, block_num):
+                    reads[i] = self.member_pool.submit(self.VerifiedMember, i, block_num)
+            members = {}
+            for i in range(self.N):
+                if i != server:
+                    members[i] = None
+                    if i in reads:
+                        try:
+                            members[i] = reads[i].result()
+                        except socket.error:
+                            pass
+            try:
+                return self.Decode(block_num, server, members)
+            except socket.error:
+                return None
+        finally:
+            self.rebuild_lock.release()
+
+    ## VerifiedMember: a stripe member read with its checksum, as ReadPhysical reads; None if the checksum does not
+    ## match, so that Decode treats the member as missing rather than rebuilding from corrupt bytes
+
+    def VerifiedMember(self, server, block_num):
+        checksum, content = self.ServerCalls(server, [('Get_Checksum', (block_num,)), ('Get', (block_num,))])
+        if checksum != self.Checksum(content):
+            logging.info('VerifiedMember: checksum mismatch on server ' + str(server) + ' block ' + str(block_num))
+            self.metrics.Count('checksum_mismatches', server)
+            return None
+        return content
+
+    ## Adds a home-server latency sample; the threshold is recomputed every HEDGE_MIN_SAMPLES samples
+
+    def RecordHomeLatency(self, elapsed):
+        with self.hedge_lock:
+            self.hedge_samples.append(elapsed)
+            self.hedge_recorded += 1
+            count = len(self.hedge_samples)
+            if count >= HEDGE_MIN_SAMPLES and self.hedge_recorded % HEDGE_MIN_SAMPLES == 0:
+                ordered = sorted(self.hedge_samples)
+                rank = max(0, min(count - 1, int(round(self.hedge_percentile / 100.0 * count)) - 1))
+                self.hedge_threshold = ordered[rank]
+
+    def RecordHedgeSaving(self, saved):
+        with self.hedge_lock:
+            self.hedge_stats['saved'] += saved
+
+    ## RepairBlock: reconstructs a corrupt or missing block from the other servers, then writes the good copy
+    ## back to its home server with a fresh checksum (read-repair), so the next read costs a single Get again.
+    ## The write-back is skipped if the home server is not up, or is being rebuilt and the rebuild has not
+    ## reached the block yet. The block is read back before the repair is counted in read_repairs; a rewrite the
+    ## server dropped (a failing block) counts in failed_repairs instead.
+
+    def RepairBlock(self, server, block_num):
+        with self.rebuild_lock:
+            trans = self.Retrieve_Block_Content(server, block_num)
+            rebuild = self.rebuild
+            if self.health[server] != SERVER_UP:
+                return trans
+            if rebuild is not None and rebuild['target'] == server and block_num >= rebuild['next_block']:
+                return trans
+            try:
+                self.QueueWrite(server, block_num, trans)
+                # read back: a server can drop writes to a failing block, and that block is not repaired
+                checksum, content = self.ServerCalls(server, [('Get_Checksum', (block_num,)), ('Get', (block_num,))])
+            except socket.error:
+                return trans
+            if content != trans or checksum != self.Checksum(content):
+                self.metrics.Count('failed_repairs', server)
+                logging.info('RepairBlock: rewrite of server ' + str(server) + ' block ' + str(block_num) + ' did not stick')
+                return trans
+            self.missed[server].discard(block_num)
+            self.metrics.Count('read_repairs', server)
+            logging.info('RepairBlock: rewrote server ' + str(server) + ' block ' + str(block_num))
+        return trans
+
+    ## Stripe layout
+    ## With K = chunk_size, stripe s holds data blocks s*data_per_stripe*K .. (s+1)*data_per_stripe*K-1 and
+    ## occupies physical blocks s*K .. s*K+K-1 on every server. Its data blocks are cut into data_per_stripe
+    ## chunks of K consecutive blocks; chunk i goes to the i-th data server. Physical block s*K+j of each parity
+    ## server protects block j of every chunk. Parity rotates from the last server towards the first: P is on
+    ## server N-1-(s % N), and for raid6 Q is on the next server (wrapping around). Data chunks fill the
+    ## remaining servers in order. K = 1 is the classic one-block stripe unit.
+
+    def Stripe_Parity_Servers(self, stripe):
+        p = self.N - 1 - (stripe % self.N)
+        if self.parity_count == 1:
+            return [p]
+        return [p, (p + 1) % self.N]
+
+    ## Returns the list of data servers of a stripe, in data index order
+
+    def Stripe_Data_Servers(self, stripe):
+        parity_servers = self.Stripe_Parity_Servers(stripe)
+        data_servers = []
+        for i in range(self.N):
+            if i not in parity_servers:
+                data_servers.append(i)
+        return data_servers
+
+    ## Data_Index: index of the chunk holding a logical block within its stripe (the i in g^i for raid6)
+
+    def Data_Index(self, block_number):
+        return (block_number % self.stripe_blocks) // self.chunk_size
+
+    ## Row: physical block, on every server of the stripe, that holds a logical block or its parity
+
+    def Row(self, block_number):
+        return (block_number // self.stripe_blocks) * self.chunk_size + block_number % self.chunk_size
+
+    ## BuildMapTables: precomputes the stripe layout for every logical block, once per DiskBlocks
+    ## Parallel arrays indexed by logical block number: data server, physical block, chunk index in the stripe,
+    ## P server and Q server (equal to P for raid5). The parity blocks live at the same physical block as the
+    ## data block. Get and Put index these arrays instead of recomputing the layout.
+
+    def BuildMapTables(self):
+        self.map_server = array('I')
+        self.map_block = array('I')
+        self.map_index = array('I')
+        self.map_parity = array('I')
+        self.map_q = array('I')
+        # Get accepts block numbers up to TOTAL_NUM_BLOCKS inclusive
+        for block_number in range(TOTAL_NUM_BLOCKS + 1):
+            stripe = block_number // self.stripe_blocks
+            parity_servers = self.Stripe_Parity_Servers(stripe)
+            server = self.Data_Index(block_number)
+            for parity_server in sorted(parity_servers):
+                if server >= parity_server:
+                    server += 1
+            self.map_server.append(server)
+            self.map_block.append(self.Row(block_number))
+            self.map_index.append(self.Data_Index(block_number))
+            self.map_parity.append(parity_servers[0])
+            self.map_q.append(parity_servers[-1])
 
     def Map(self, block_number):
         physical_block = {}
-        line = (block_number // (self.N - 1)) % self.N
-        parity_server = self.N - 1 - line
-        if block_number % (self.N - 1) >= parity_server:
-            server = (block_number % (self.N - 1)) + 1
-        else:
-            server = block_number % (self.N - 1)
-        physical_block['server'] = server
-        physical_block['block'] = block_number // (self.N - 1)
+        physical_block['server'] = self.map_server[block_number]
+        physical_block['block'] = self.map_block[block_number]
         return physical_block
 
     def Parity_Map(self, block_number):
         parity_block = {}
-        line = (block_number // (self.N - 1)) % self.N
-        server_number = self.N - 1 - line
-        parity_block['server'] = server_number
-        parity_block['block'] = block_number // (self.N - 1)
+        parity_block['server'] = self.map_parity[block_number]
+        parity_block['block'] = self.map_block[block_number]
         return parity_block
 
-    def Retrieve_Block_Content(self, physical_block):
-        tmp = []
-        for i in range(len(self.servers)):
-            if i != physical_block['server']:
-                tmp.append(i)
-        content = self.servers[tmp[0]].Get(physical_block['block'])
-        trans = bytearray(content)
-        for j in range(1, len(tmp)):
-            tmp_block = self.servers[tmp[j]].Get(physical_block['block'])
-            trans_tmp_block = bytearray(tmp_block)
-            for k in range(len(content)):
-                trans[k] = trans[k] ^ trans_tmp_block[k]
+    ## Q_Map: location of the Reed-Solomon Q parity block (raid6 only)
+
+    def Q_Map(self, block_number):
+        q_block = {}
+        q_block['server'] = self.map_q[block_number]
+        q_block['block'] = self.map_block[block_number]
+        return q_block
+
+    ## MapMany: maps a list of logical block numbers at once
+    ## Returns a list of (data server, physical block) tuples, in the order of block_numbers
+
+    def MapMany(self, block_numbers):
+        return list(zip([self.map_server[b] for b in block_numbers], [self.map_block[b] for b in block_numbers]))
+
+    ## Retrieve_Block_Content: reconstructs physical block block_num of server from the other servers of its stripe
+    ## Servers that are unreachable, or whose copy is stale, count as missing; raid5 tolerates none besides the
+    ## block itself, raid6 one more. Raises socket.error if too many are missing.
+
+    def Retrieve_Block_Content(self, server, block_num):
+        self.metrics.Count('reconstructions', server)
+        members = {}
+        for i in range(self.N):
+            if i != server:
+                members[i] = None
+                if not self.Stale(i, block_num):
+                    try:
+                        members[i] = self.ServerCall(i, 'Get', block_num)
+                    except socket.error:
+                        if self.parity_count == 1:
+                            raise
+        return self.Decode(block_num, server, members)
+
+    ## Decode: computes physical block block_num of server target from the same physical block of the other
+    ## servers; members maps every other server to its block, or None if that block is missing
+
+    def Decode(self, block_num, target, members):
+        missing = [target]
+        for i in members:
+            if members[i] is None:
+                missing.append(i)
+        if len(missing) > self.parity_count:
+            raise ConnectionRefusedError('block ' + str(block_num) + ': cannot reconstruct, servers ' + str(missing) + ' missing')
+        stripe = block_num // self.chunk_size
+
+        if self.parity_count == 1:
+            trans = bytearray(BLOCK_SIZE)
+            for i in members:
+                trans = XorBlocks(trans, members[i])
+            return trans
+
+        data_servers = self.Stripe_Data_Servers(stripe)
+        p, q = self.Stripe_Parity_Servers(stripe)
+        data = []
+        for i in data_servers:
+            data.append(members.get(i))
+        lost = [x for x in range(len(data_servers)) if data_servers[x] in missing]
+
+        if len(lost) == 1:
+            x = lost[0]
+            if p not in missing:
+                # D_x = P ^ sum of the other data blocks
+                trans = bytearray(members[p])
+                for i in range(len(data)):
+                    if i != x:
+                        trans = XorBlocks(trans, data[i])
+            else:
+                # D_x = (Q ^ sum of g^i * D_i over the other data blocks) / g^x
+                trans = bytearray(members[q])
+                for i in range(len(data)):
+                    if i != x:
+                        trans = XorBlocks(trans, GFMulBlock(GF_EXP[i], data[i]))
+                trans = GFMulBlock(GFInv(GF_EXP[x]), trans)
+            data[x] = trans
+        elif len(lost) == 2:
+            # two data blocks lost, P and Q both present
+            x, y = lost
+            pxy = bytearray(members[p])
+            qxy = bytearray(members[q])
+            for i in range(len(data)):
+                if i != x and i != y:
+                    pxy = XorBlocks(pxy, data[i])
+                    qxy = XorBlocks(qxy, GFMulBlock(GF_EXP[i], data[i]))
+            # pxy = D_x ^ D_y, qxy = g^x * D_x ^ g^y * D_y
+            # D_x = (g^(y-x) * pxy ^ g^-x * qxy) / (g^(y-x) ^ 1)
+            gyx = GF_EXP[y - x]
+            denominator = GFInv(gyx ^ 1)
+            a = GFMul(gyx, denominator)
+            b = GFMul(GFInv(GF_EXP[x]), denominator)
+            data[x] = XorBlocks(GFMulBlock(a, pxy), GFMulBlock(b, qxy))
+            data[y] = XorBlocks(pxy, data[x])
+
+        if target in data_servers:
+            return data[data_servers.index(target)]
+        trans = bytearray(BLOCK_SIZE)
+        for i in range(len(data)):
+            if target == p:
+                trans = XorBlocks(trans, data[i])
+            else:
+                trans = XorBlocks(trans, GFMulBlock(GF_EXP[i], data[i]))
         return trans
 
+    ## Rebuild: reconstructs every physical block of server target from the other N-1 servers
+    ## Meant for a fresh replacement server brought up at the failed server's address.
+    ##   batch_size: physical blocks per batch; each surviving server is read with one GetMany per batch, all in parallel
+    ##   max_bytes_per_sec: limit on the rate at which rebuilt data is written (None: no limit)
+    ##   checkpoint: file name; progress is saved there after every batch and a later call resumes from it
+    ## Foreground Get/Put from other threads keep working: blocks not rebuilt yet are reconstructed from parity,
+    ## and writes to blocks already rebuilt go to the new server.
+    ## Returns a dict with the number of blocks rebuilt and the blocks whose sources failed their checksum
+
+    def Rebuild(self, target, batch_size=32, max_bytes_per_sec=None, checkpoint=None):
+        logging.info('Rebuild: server ' + str(target) + ', batch ' + str(batch_size) + ', limit ' + str(max_bytes_per_sec))
+        # the sources must hold every write made so far
+        self.Flush()
+
+        next_block = 0
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                saved = json.load(f)
+            if saved['target'] == target:
+                next_block = saved['next_block']
+                logging.info('Rebuild: resuming at block ' + str(next_block))
+
+        sources = []
+        for i in range(self.N):
+            if i != target:
+                sources.append(i)
+
+        unrecoverable = []
+        rebuilt = 0
+        started = time.monotonic()
+        self.rebuild = {'target': target, 'next_block': next_block}
+        # the replacement is reachable; foreground writes to rebuilt blocks must go to it
+        self.boot_ids[target] = self.Proxy(target).Get_Boot_Id()
+        self.SetHealth(target, SERVER_UP)
+        self.missed[target] = set()
+        try:
+            with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+                while next_block < self.num_rows:
+                    block_numbers = list(range(next_block, min(next_block + batch_size, self.num_rows)))
+
+                    with self.rebuild_lock:
+                        reads = []
+                        for i in sources:
+                            reads.append(pool.submit(self.ReadSourceBatch, i, block_numbers))
+                        results = []
+                        for r in reads:
+                            try:
+                                results.append(r.result())
+                            except socket.error:
+                                # an unreachable source: all its blocks are missing (raid6 can do without one)
+                                results.append(([None] * len(block_numbers), [False] * len(block_numbers)))
+
+                        blocks = []
+                        checksums = []
+                        for k in range(len(block_numbers)):
+                            # a source block that fails its checksum counts as missing; raid6 can do without one
+                            members = {}
+                            for i, (contents, verified) in zip(sources, results):
+                                members[i] = contents[k] if verified[k] else None
+                            try:
+                                trans = self.Decode(block_numbers[k], target, members)
+                            except socket.error:
+                                # too many missing: count the block as lost, and write the best guess
+                                unrecoverable.append(block_numbers[k])
+                                trans = bytearray(BLOCK_SIZE)
+                                for i, (contents, verified) in zip(sources, results):
+                                    if contents[k] is not None:
+                                        trans = XorBlocks(trans, contents[k])
+                            blocks.append(trans)
+                            checksums.append(self.Checksum(trans))
+
+                        self.ServerCalls(target, [('PutMany', (block_numbers, blocks)),
+                                                  ('Put_Checksums', (block_numbers, checksums))])
+
+                        next_block = block_numbers[-1] + 1
+                        self.rebuild['next_block'] = next_block
+
+                    rebuilt += len(block_numbers)
+                    if checkpoint is not None:
+                        with open(checkpoint + '.tmp', 'w') as f:
+                            json.dump({'target': target, 'next_block': next_block}, f)
+                        os.replace(checkpoint + '.tmp', checkpoint)
+
+                    if max_bytes_per_sec is not None:
+                        ahead = rebuilt * BLOCK_SIZE / max_bytes_per_sec - (time.monotonic() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+        finally:
+            self.rebuild = None
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        unrecoverable = sorted(set(unrecoverable))
+        if len(unrecoverable) > 0:
+            LOG.Error('Rebuild: source blocks failed checksum, rebuilt contents are wrong for: %s', unrecoverable)
+        logging.info('Rebuild: server ' + str(target) + ' done, ' + str(rebuilt) + ' block(s) in ' + str(
+            round(time.monotonic() - started, 3)) + 's')
+        return {'rebuilt': rebuilt, 'unrecoverable': unrecoverable}
+
+    ## Reads a batch of physical blocks from one surviving server for Rebuild()
+    ## Returns (contents, verified), verified[k] being False if block k does not match its checksum
+
+    def ReadSourceBatch(self, server, block_numbers):
+        contents, checksums = self.ServerCalls(server, [('GetMany', (block_numbers,)), ('Get_Checksums', (block_numbers,))])
+        verified = []
+        for content, checksum in zip(contents, checksums):
+            verified.append(checksum == self.Checksum(content))
+        if not all(verified):
+            self.metrics.Count('checksum_mismatches', server, verified.count(False))
+        return contents, verified
+
     ## Serializes and saves block[] data structure to a disk file
 
     def DumpToDisk(self, prefix):
@@ -233,22 +1059,31 @@ class DiskBlocks():
     def InitializeBlocks(self, cleanslate, prefix):
 
         if cleanslate:
+            # Every server resets all its blocks to zeros and switches to the volume's checksum algorithm, in one
+            # request; all-zero blocks are consistent parity for each other, so nothing else needs writing
+            #   Free block bitmap: All blocks start free, so safe to initialize with zeroes
+            #   Inode table: zero indicates an invalid inode, so also safe to initialize with zeroes
+            #   Data blocks: safe to init with zeroes
+            for i in range(self.N):
+                self.boot_ids[i] = self.ServerCall(i, 'Format', self.checksum_name)
+                self.missed[i].clear()
+
             # Block 0: No real boot code here, just write the given prefix
             self.Put(0, prefix)
 
-            # Block 1: Superblock contains basic file system constants
+            # Block 1: Superblock contains basic file system constants, the block checksum algorithm and RAID layout
             # First, we write it as a list
-            superblock = [TOTAL_NUM_BLOCKS, BLOCK_SIZE, MAX_NUM_INODES, INODE_SIZE]
+            superblock = [TOTAL_NUM_BLOCKS, BLOCK_SIZE, MAX_NUM_INODES, INODE_SIZE, self.checksum_name, self.layout,
+                          self.chunk_size]
             # Now we serialize it into a byte array
             self.Put(1, pickle.dumps(superblock))
+            self.Flush()
 
-            # Blocks 2-TOTAL_NUM_BLOCKS are initialized with zeroes
-            #   Free block bitmap: All blocks start free, so safe to initialize with zeroes
-            #   Inode table: zero indicates an invalid inode, so also safe to initialize with zeroes
-            #   Data blocks: safe to init with zeroes
-            zeroblock = bytearray(BLOCK_SIZE)
-            for i in range(FREEBITMAP_BLOCK_OFFSET, TOTAL_NUM_BLOCKS):
-                self.Put(i, zeroblock)
+            # a volume mounted before the format now has an empty inode table, and nothing left to free
+            if self.inode_table is not None:
+                self.inode_table.Load(self)
+            if self.reclaimer is not None:
+                self.reclaimer.Discard()
         else:
             self.LoadFromDisk(prefix)
 
@@ -309,6 +1144,9 @@ class DiskBlocks():
 #  3. Serialize and write Inode object back to raw block storage (InodeToBytearray)
 
 class Inode():
+    # fixed attributes: no per-inode __dict__, and faster attribute access
+    __slots__ = ['type', 'size', 'refcnt', 'block_numbers']
+
     def __init__(self):
 
         # inode is initialized empty
@@ -316,12 +1154,8 @@ class Inode():
         self.size = 0
         self.refcnt = 0
 
-        # We store inode block_numbers as a list
-        self.block_numbers = []
-
-        # initialize list with zeroes
-        for i in range(0, MAX_INODE_BLOCK_NUMBERS):
-            self.block_numbers.append(0)
+        # We store inode block_numbers as a list, initialized with zeroes
+        self.block_numbers = [0] * MAX_INODE_BLOCK_NUMBERS
 
     ## Set inode object values from a raw bytearray
     ## This is used when we read an inode from raw block storage to the inode data structure
@@ -329,57 +1163,39 @@ class Inode():
     def InodeFromBytearray(self, b):
 
         if len(b) > INODE_SIZE:
-            logging.error('InodeFromBytearray: exceeds inode size ' + str(b))
+            LOG.Error('InodeFromBytearray: exceeds inode size %s', b)
             quit()
 
-        # slice the raw bytes for the different fields
-        # size is 4 bytes, type 2 bytes, refcnt 2 bytes
-        size_slice = b[0:4]
-        type_slice = b[4:6]
-        refcnt_slice = b[6:8]
+        self.InodeFromBlock(b, 0)
 
-        # converts from raw bytes to integers using big-endian
-        # store scalars
-        self.size = int.from_bytes(size_slice, byteorder='big')
-        self.type = int.from_bytes(type_slice, byteorder='big')
-        self.refcnt = int.from_bytes(refcnt_slice, byteorder='big')
+    ## Set inode object values from the inode stored at offset in a block (e.g. an inode table block)
+    ## The fields are decoded in place, without slicing the block
 
-        # each block number entry is 4 bytes, big-endian
-        for i in range(0, MAX_INODE_BLOCK_NUMBERS):
-            start = 8 + i * 4
-            blocknumber_slice = b[start:start + 4]
-            self.block_numbers[i] = int.from_bytes(blocknumber_slice, byteorder='big')
-
-        ## Create a raw byte array, serializing Inode object values to prepare to write
+    def InodeFromBlock(self, block, offset):
+        fields = INODE_STRUCT.unpack_from(block, offset)
+        self.size = fields[0]
+        self.type = fields[1]
+        self.refcnt = fields[2]
+        # the list is updated in place, so references to it stay valid
+        self.block_numbers[:] = fields[3:]
 
+    ## Create a raw byte array, serializing Inode object values to prepare to write
     ## This is used when we write an inode to raw block storage
 
     def InodeToBytearray(self):
 
         # Temporary bytearray - we'll load it with the different inode fields
         temparray = bytearray(INODE_SIZE)
-
-        # We assume size is 4 bytes, and we store it in Big Endian format
-        intsize = self.size
-        temparray[0:4] = intsize.to_bytes(4, 'big')
-
-        # We assume type is 2 bytes, and we store it in Big Endian format
-        inttype = self.type
-        temparray[4:6] = inttype.to_bytes(2, 'big')
-
-        # We assume refcnt is 2 bytes, and we store it in Big Endian format
-        intrefcnt = self.refcnt
-        temparray[6:8] = intrefcnt.to_bytes(2, 'big')
-
-        # We assume each block number is 4 bytes, and we store each in Big Endian format
-        for i in range(0, MAX_INODE_BLOCK_NUMBERS):
-            start = 8 + i * 4
-            intbn = self.block_numbers[i]
-            temparray[start:start + 4] = intbn.to_bytes(4, 'big')
+        self.InodeToBlock(temparray, 0)
 
         # Return the byte array
         return temparray
 
+    ## Serialize this inode into a block at offset, in place
+
+    def InodeToBlock(self, block, offset):
+        INODE_STRUCT.pack_into(block, offset, self.size, self.type, self.refcnt, *self.block_numbers)
+
     ## Prints out this inode object's information to the log
 
     def Print(self):
@@ -394,6 +1210,165 @@ class Inode():
         logging.info(s)
 
 
+#### Inode table cache
+
+## InodeTable: the whole inode table in columns, one array per inode field, indexed by inode number
+## A FileName loads it when it mounts the volume, with one GetMany of the INODE_NUM_BLOCKS inode table blocks, and
+## DiskBlocks.Put keeps it up to date, since every write of an inode table block goes through Put. With it,
+## reading an inode needs no Get, and scans over all inodes (free inodes, inodes of a type) run on the arrays.
+## Like the rest of this build, it assumes a single client writes the volume.
+
+class InodeTable():
+    def __init__(self):
+        self.size = array('L', [0]) * MAX_NUM_INODES
+        self.type = array('H', [INODE_TYPE_INVALID]) * MAX_NUM_INODES
+        self.refcnt = array('H', [0]) * MAX_NUM_INODES
+        # MAX_INODE_BLOCK_NUMBERS entries per inode; those of inode i start at i * MAX_INODE_BLOCK_NUMBERS
+        self.block_numbers = array('L', [0]) * (MAX_NUM_INODES * MAX_INODE_BLOCK_NUMBERS)
+
+    ## Load: reads the inode table from RawBlocks
+
+    def Load(self, RawBlocks):
+        blocks = RawBlocks.GetMany(list(range(INODE_BLOCK_OFFSET, INODE_BLOCK_OFFSET + INODE_NUM_BLOCKS)))
+        for index in range(INODE_NUM_BLOCKS):
+            self.LoadBlock(index, blocks[index])
+
+    ## LoadBlock: decodes inode table block index (0 for the block at INODE_BLOCK_OFFSET) into the arrays
+
+    def LoadBlock(self, index, block):
+        number = index * INODES_PER_BLOCK
+        for fields in INODE_STRUCT.iter_unpack(block):
+            self.size[number] = fields[0]
+            self.type[number] = fields[1]
+            self.refcnt[number] = fields[2]
+            first = number * MAX_INODE_BLOCK_NUMBERS
+            self.block_numbers[first:first + MAX_INODE_BLOCK_NUMBERS] = array('L', fields[3:])
+            number += 1
+
+    ## Block: inode table block index, encoded from the arrays
+
+    def Block(self, index):
+        block = bytearray(BLOCK_SIZE)
+        for slot in range(INODES_PER_BLOCK):
+            number = index * INODES_PER_BLOCK + slot
+            first = number * MAX_INODE_BLOCK_NUMBERS
+            INODE_STRUCT.pack_into(block, slot * INODE_SIZE, self.size[number], self.type[number], self.refcnt[number],
+                                   *self.block_numbers[first:first + MAX_INODE_BLOCK_NUMBERS])
+        return block
+
+    ## Fill: sets the fields of an Inode object to those of inode number
+
+    def Fill(self, number, inode):
+        inode.size = self.size[number]
+        inode.type = self.type[number]
+        inode.refcnt = self.refcnt[number]
+        first = number * MAX_INODE_BLOCK_NUMBERS
+        inode.block_numbers[:] = self.block_numbers[first:first + MAX_INODE_BLOCK_NUMBERS]
+
+    ## Find: the lowest inode number of the given type, or -1
+
+    def Find(self, type):
+        try:
+            return self.type.index(type)
+        except ValueError:
+            return -1
+
+    ## Count: the number of inodes of the given type
+
+    def Count(self, type):
+        return self.type.count(type)
+
+
+#### Block reclamation
+
+## Reclaimer: frees data blocks in the background
+## Free() only records the blocks to free, grouped by the free bitmap block holding their entries; a background
+## thread applies them RECLAIM_DELAY seconds later, with one Get and one Put per bitmap block however many of its
+## blocks were freed, so deleting a large file does not wait for the bitmap. Blocks stay marked used until then,
+## which is what makes deferring safe: nothing can allocate a block before it is really free.
+## AllocateDataBlock and Apply update the bitmap under bitmap_lock; AllocateDataBlock calls Flush() before it
+## gives up on a full volume.
+
+class Reclaimer():
+    def __init__(self, RawBlocks, delay=RECLAIM_DELAY):
+        self.RawBlocks = RawBlocks
+        self.delay = delay
+        # held for every read-modify-write of a free bitmap block
+        self.bitmap_lock = threading.Lock()
+        # free bitmap block number -> set of data block numbers to free, protected by pending_lock
+        self.pending = {}
+        self.pending_lock = threading.Condition()
+        self.thread = None
+
+    ## Free: queues data blocks to be freed
+
+    def Free(self, block_numbers):
+        if len(block_numbers) == 0:
+            return
+        LOG.Debug('Reclaimer.Free: %s', block_numbers)
+        with self.pending_lock:
+            for block_number in block_numbers:
+                bitmap_block = FREEBITMAP_BLOCK_OFFSET + (block_number // BLOCK_SIZE)
+                self.pending.setdefault(bitmap_block, set()).add(block_number)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.Run, daemon=True)
+                self.thread.start()
+            self.pending_lock.notify()
+
+    ## Discard: forgets the queued blocks, for a volume that was formatted since they were freed
+
+    def Discard(self):
+        with self.pending_lock:
+            self.pending = {}
+
+    ## Pending: the number of blocks queued and not freed yet
+
+    def Pending(self):
+        with self.pending_lock:
+            return sum(len(block_numbers) for block_numbers in self.pending.values())
+
+    ## Run: the background thread; frees arriving during the delay join the same batch
+
+    def Run(self):
+        while True:
+            with self.pending_lock:
+                while len(self.pending) == 0:
+                    self.pending_lock.wait()
+            time.sleep(self.delay)
+            self.Flush()
+
+    ## Flush: frees every queued block now
+
+    def Flush(self):
+        with self.bitmap_lock:
+            with self.pending_lock:
+                pending = self.pending
+                self.pending = {}
+            try:
+                self.Apply(pending)
+            except socket.error as e:
+                # too many servers unreachable to read a bitmap block: keep the blocks for the next round
+                LOG.Error('Reclaimer: free bitmap not updated: %s', e)
+                with self.pending_lock:
+                    for bitmap_block, block_numbers in pending.items():
+                        self.pending.setdefault(bitmap_block, set()).update(block_numbers)
+                return
+            self.RawBlocks.Flush()
+
+    ## Apply: clears the bitmap entries of the blocks in pending, one bitmap block at a time
+
+    def Apply(self, pending):
+        while len(pending) > 0:
+            bitmap_block, block_numbers = min(pending.items())
+            block = self.RawBlocks.Get(bitmap_block)
+            for block_number in block_numbers:
+                block[block_number % BLOCK_SIZE] = 0
+            self.RawBlocks.Put(bitmap_block, block)
+            del pending[bitmap_block]
+            self.RawBlocks.metrics.Count('blocks_freed', n=len(block_numbers))
+            self.RawBlocks.metrics.Count('bitmap_flushes')
+
+
 #### Inode number layer
 
 
@@ -404,7 +1379,7 @@ class InodeNumber():
 
         # This stores the inode number
         if number > MAX_NUM_INODES:
-            logging.error('InodeNumber: inode number exceeds limit: ' + str(number))
+            LOG.Error('InodeNumber: inode number exceeds limit: %s', number)
             quit()
         self.inode_number = number
 
@@ -415,7 +1390,13 @@ class InodeNumber():
     ## The inode data structure loaded from raw storage goes in the self.inode object
 
     def InodeNumberToInode(self):
-        logging.debug('InodeNumberToInode: ' + str(self.inode_number))
+        LOG.Debug('InodeNumberToInode: %s', self.inode_number)
+
+        # served from the inode table cache when the volume is mounted
+        inode_table = self.RawBlocks.inode_table
+        if inode_table is not None:
+            inode_table.Fill(self.inode_number, self.inode)
+            return
 
         # locate which block has the inode we want
         raw_block_number = INODE_BLOCK_OFFSET + ((self.inode_number * INODE_SIZE) // BLOCK_SIZE)
@@ -427,41 +1408,38 @@ class InodeNumber():
         start = (self.inode_number * INODE_SIZE) % BLOCK_SIZE
         end = start + INODE_SIZE
 
-        # extract byte array for this inode
-        tempinode = tempblock[start:end]
+        # load inode from its slice of the block
+        self.inode.InodeFromBlock(tempblock, start)
 
-        # load inode from byte array
-        self.inode.InodeFromBytearray(tempinode)
-
-        logging.debug('InodeNumberToInode : inode_number ' + str(self.inode_number) + ' raw_block_number: ' + str(
-            raw_block_number) + ' slice start: ' + str(start) + ' end: ' + str(end))
-        logging.debug('tempinode: ' + str(tempinode.hex()))
+        LOG.Debug('InodeNumberToInode : inode_number %s raw_block_number: %s slice start: %s end: %s',
+                  self.inode_number, raw_block_number, start, end)
 
     ## Stores (Put) this inode into raw storage
     ## Since an inode is a slice of a block, we first Get() the block, update the slice, and Put()
 
     def StoreInode(self):
-        logging.debug('StoreInode: ' + str(self.inode_number))
+        LOG.Debug('StoreInode: %s', self.inode_number)
 
         # locate which block has the inode we want
         raw_block_number = INODE_BLOCK_OFFSET + ((self.inode_number * INODE_SIZE) // BLOCK_SIZE)
-        logging.debug('StoreInode: raw_block_number ' + str(raw_block_number))
+        LOG.Debug('StoreInode: raw_block_number %s', raw_block_number)
 
-        # Get the entire block containing inode from raw storage
-        tempblock = self.RawBlocks.Get(raw_block_number)
-        logging.debug('StoreInode: tempblock:\n' + str(tempblock.hex()))
+        # Get the entire block containing inode from raw storage, or from the inode table cache
+        inode_table = self.RawBlocks.inode_table
+        if inode_table is not None:
+            tempblock = inode_table.Block(raw_block_number - INODE_BLOCK_OFFSET)
+        else:
+            tempblock = self.RawBlocks.Get(raw_block_number)
+        LOG.Debug('StoreInode: tempblock:\n%s', Hex(tempblock))
 
         # Find the slice of the block for this inode_number
         start = (self.inode_number * INODE_SIZE) % BLOCK_SIZE
         end = start + INODE_SIZE
-        logging.debug('StoreInode: start: ' + str(start) + ', end: ' + str(end))
-
-        # serialize inode into byte array
-        inode_bytearray = self.inode.InodeToBytearray()
+        LOG.Debug('StoreInode: start: %s, end: %s', start, end)
 
-        # Update slice of block with this inode's bytearray
-        tempblock[start:end] = inode_bytearray
-        logging.debug('StoreInode: tempblock:\n' + str(tempblock.hex()))
+        # Update slice of block with this inode, serialized in place
+        self.inode.InodeToBlock(tempblock, start)
+        LOG.Debug('StoreInode: tempblock:\n%s', Hex(tempblock))
 
         # Update raw storage with new inode
         self.RawBlocks.Put(raw_block_number, tempblock)
@@ -470,7 +1448,7 @@ class InodeNumber():
     ## Equivalent to textbook's INODE_NUMBER_TO_BLOCK
 
     def InodeNumberToBlock(self, offset):
-        logging.debug('InodeNumberToBlock: ' + str(offset))
+        LOG.Debug('InodeNumberToBlock: %s', offset)
 
         # Load object's inode
         self.InodeNumberToInode()
@@ -494,12 +1472,21 @@ class FileName():
     def __init__(self, RawBlocks):
         self.RawBlocks = RawBlocks
 
+        # Mount: the inode table cache and the reclaimer, shared by every FileName of the same RawBlocks
+        # (none without RawBlocks: AsyncFileName keeps such a FileName for its helper functions)
+        if RawBlocks is not None and RawBlocks.inode_table is None:
+            inode_table = InodeTable()
+            inode_table.Load(RawBlocks)
+            RawBlocks.inode_table = inode_table
+        if RawBlocks is not None and RawBlocks.reclaimer is None:
+            RawBlocks.reclaimer = Reclaimer(RawBlocks)
+
     ## This helper function extracts a file name string from a directory data block
     ## The index selects which file name entry to extract within the block - e.g. index 0 is the first file name, 1 second file name
 
     def HelperGetFilenameString(self, block, index):
 
-        logging.debug('HelperGetFilenameString: ' + str(block.hex()) + ', ' + str(index))
+        LOG.Debug('HelperGetFilenameString: %s, %s', Hex(block), index)
 
         # Locate bytes that store string - first MAX_FILENAME characters aligned by MAX_FILENAME + INODE_NUMBER_DIRENTRY_SIZE
         string_start = index * FILE_NAME_DIRENTRY_SIZE
@@ -512,7 +1499,7 @@ class FileName():
 
     def HelperGetFilenameInodeNumber(self, block, index):
 
-        logging.debug('HelperGetFilenameInodeNumber: ' + str(block.hex()) + ', ' + str(index))
+        LOG.Debug('HelperGetFilenameInodeNumber: %s, %s', Hex(block), index)
 
         # Locate bytes that store inode
         inode_start = (index * FILE_NAME_DIRENTRY_SIZE) + MAX_FILENAME
@@ -527,20 +1514,20 @@ class FileName():
 
     def InsertFilenameInodeNumber(self, insert_to, filename, inodenumber):
 
-        logging.debug('InsertFilenameInodeNumber: ' + str(filename) + ', ' + str(inodenumber))
+        LOG.Debug('InsertFilenameInodeNumber: %s, %s', filename, inodenumber)
 
         if len(filename) > MAX_FILENAME:
-            logging.error('InsertFilenameInodeNumber: file name exceeds maximum')
+            LOG.Error('InsertFilenameInodeNumber: file name exceeds maximum')
             quit()
 
         if insert_to.inode.type != INODE_TYPE_DIR:
-            logging.error('InsertFilenameInodeNumber: not a directory inode: ' + str(insert_to.inode.type))
+            LOG.Error('InsertFilenameInodeNumber: not a directory inode: %s', insert_to.inode.type)
             quit()
 
         # We insert a new entry at the end of the existing table, so determine its position based on inode's size
         index = insert_to.inode.size
         if index >= MAX_FILE_SIZE:
-            logging.error('InsertFilenameInodeNumber: no space for another entry in inode')
+            LOG.Error('InsertFilenameInodeNumber: no space for another entry in inode')
             quit()
 
         # Check if we need to allocate another data block for this inode
@@ -570,10 +1557,9 @@ class FileName():
         inode_start = index_modulo + MAX_FILENAME
         inode_end = inode_start + INODE_NUMBER_DIRENTRY_SIZE
 
-        logging.debug('InsertFilenameInodeNumber: \n' + str(block.hex()))
-        logging.debug('InsertFilenameInodeNumber: inode_start ' + str(inode_start) + ', inode_end ' + str(inode_end))
-        logging.debug(
-            'InsertFilenameInodeNumber: string_start ' + str(string_start) + ', string_end ' + str(string_end))
+        LOG.Debug('InsertFilenameInodeNumber: \n%s', Hex(block))
+        LOG.Debug('InsertFilenameInodeNumber: inode_start %s, inode_end %s', inode_start, inode_end)
+        LOG.Debug('InsertFilenameInodeNumber: string_start %s, string_end %s', string_start, string_end)
 
         # Update and write data block with (filename,inode) mapping
         block[inode_start:inode_end] = inodenumber.to_bytes(INODE_NUMBER_DIRENTRY_SIZE, 'big')
@@ -586,16 +1572,17 @@ class FileName():
 
     ## Lookup string filename in the context of inode dir - same as textbook's LOOKUP
 
+    @MeasuredOp
     def Lookup(self, filename, dir):
 
-        logging.debug('Lookup: ' + str(filename) + ', ' + str(dir))
+        LOG.Debug('Lookup: %s, %s', filename, dir)
 
         # Initialize inode_number object from raw storage
         inode_number = InodeNumber(self.RawBlocks, dir)
         inode_number.InodeNumberToInode()
 
         if inode_number.inode.type != INODE_TYPE_DIR:
-            logging.error("Lookup: not a directory inode: " + str(dir) + " , " + str(inode_number.inode.type))
+            LOG.Error("Lookup: not a directory inode: %s , %s", dir, inode_number.inode.type)
             return -1
 
         offset = 0
@@ -619,8 +1606,7 @@ class FileName():
                     # Extract padded MAX_FILENAME string as a bytearray from data block for comparison
                     filestring = self.HelperGetFilenameString(b, i)
 
-                    logging.debug(
-                        "Lookup for " + filename + " in " + str(dir) + ": searching string " + str(filestring))
+                    LOG.Debug("Lookup for %s in %s: searching string %s", filename, dir, filestring)
 
                     # Pad filename with zeroes and make it a byte array
                     padded_filename = bytearray(filename, "utf-8")
@@ -630,20 +1616,100 @@ class FileName():
                     if filestring == padded_filename:
                         # On a match, retrieve and return inode number
                         fileinode = self.HelperGetFilenameInodeNumber(b, i)
-                        logging.debug("Lookup successful: " + str(fileinode))
+                        LOG.Debug("Lookup successful: %s", fileinode)
                         return fileinode
 
             # Skip to the next block, back to while loop
             offset += BLOCK_SIZE
 
-        logging.debug("Lookup: file not found: " + str(filename) + " in " + str(dir))
+        LOG.Debug("Lookup: file not found: %s in %s", filename, dir)
         return -1
 
+    ## InodesOf: the Inode objects of a list of inode numbers, from the inode table cache, or else with one GetMany
+    ## of the inode table blocks holding them (each block fetched once)
+
+    def InodesOf(self, numbers):
+        inodes = []
+        inode_table = self.RawBlocks.inode_table
+        if inode_table is not None:
+            for number in numbers:
+                inode = Inode()
+                inode_table.Fill(number, inode)
+                inodes.append(inode)
+            return inodes
+        block_numbers = sorted(set(INODE_BLOCK_OFFSET + (number * INODE_SIZE) // BLOCK_SIZE for number in numbers))
+        blocks = dict(zip(block_numbers, self.RawBlocks.GetMany(block_numbers)))
+        for number in numbers:
+            inode = Inode()
+            inode.InodeFromBlock(blocks[INODE_BLOCK_OFFSET + (number * INODE_SIZE) // BLOCK_SIZE],
+                                 (number * INODE_SIZE) % BLOCK_SIZE)
+            inodes.append(inode)
+        return inodes
+
+    ## DirPages: generator over the entries of a loaded directory InodeNumber, page_size entries at a time
+    ## Each page is a list of (name, inode number, Inode) tuples and costs one GetMany of the directory blocks it
+    ## spans, plus the inode table blocks of its entries (see InodesOf)
+
+    def DirPages(self, dir_inode, page_size):
+        entries = dir_inode.inode.size // FILE_NAME_DIRENTRY_SIZE
+        for first in range(0, entries, page_size):
+            last = min(entries, first + page_size)
+            first_block = first // FILE_ENTRIES_PER_DATA_BLOCK
+            last_block = (last - 1) // FILE_ENTRIES_PER_DATA_BLOCK
+            blocks = self.RawBlocks.GetMany(dir_inode.inode.block_numbers[first_block:last_block + 1])
+            names = []
+            numbers = []
+            for entry in range(first, last):
+                block = blocks[entry // FILE_ENTRIES_PER_DATA_BLOCK - first_block]
+                index = entry % FILE_ENTRIES_PER_DATA_BLOCK
+                names.append(bytes(self.HelperGetFilenameString(block, index)).rstrip(b'\x00').decode())
+                numbers.append(self.HelperGetFilenameInodeNumber(block, index))
+            yield list(zip(names, numbers, self.InodesOf(numbers)))
+
+    ## ReadDir: lists directory dir with the attributes of every entry (readdirplus)
+    ## Returns a list of (name, inode number, Inode) tuples in directory order, or -1 if dir is not a directory.
+    ## Costs one GetMany of the directory blocks and one of the inode table blocks, whatever the number of entries.
+
+    @MeasuredOp
+    def ReadDir(self, dir):
+        LOG.Debug('ReadDir: %s', dir)
+
+        dir_inode = InodeNumber(self.RawBlocks, dir)
+        dir_inode.InodeNumberToInode()
+        if dir_inode.inode.type != INODE_TYPE_DIR:
+            LOG.Debug("ReadDir: not a directory: %s", dir)
+            return -1
+
+        entries = []
+        for page in self.DirPages(dir_inode, max(1, dir_inode.inode.size // FILE_NAME_DIRENTRY_SIZE)):
+            entries.extend(page)
+        return entries
+
+    ## ReadDirPages: ReadDir for large directories, as a generator of pages of at most page_size entries
+    ## Only the blocks of the current page are fetched; nothing is yielded if dir is not a directory
+
+    def ReadDirPages(self, dir, page_size=FILE_ENTRIES_PER_DATA_BLOCK):
+        LOG.Debug('ReadDirPages: %s, %s', dir, page_size)
+
+        dir_inode = InodeNumber(self.RawBlocks, dir)
+        dir_inode.InodeNumberToInode()
+        if dir_inode.inode.type != INODE_TYPE_DIR:
+            LOG.Debug("ReadDirPages: not a directory: %s", dir)
+            return
+        for page in self.DirPages(dir_inode, page_size):
+            yield page
+
     ## Scans inode table to find an available entry
 
     def FindAvailableInode(self):
 
-        logging.debug('FindAvailableInode: ')
+        LOG.Debug('FindAvailableInode: ')
+
+        inode_table = self.RawBlocks.inode_table
+        if inode_table is not None:
+            i = inode_table.Find(INODE_TYPE_INVALID)
+            LOG.Debug("FindAvailableInode: %s", i)
+            return i
 
         for i in range(0, MAX_NUM_INODES):
 
@@ -652,17 +1718,17 @@ class FileName():
             inode_number.InodeNumberToInode()
 
             if inode_number.inode.type == INODE_TYPE_INVALID:
-                logging.debug("FindAvailableInode: " + str(i))
+                LOG.Debug("FindAvailableInode: %s", i)
                 return i
 
-        logging.debug("FindAvailableInode: no available inodes")
+        LOG.Debug("FindAvailableInode: no available inodes")
         return -1
 
     ## Returns index to an available entry in directory data block
 
     def FindAvailableFileEntry(self, dir):
 
-        logging.debug('FindAvailableFileEntry: dir: ' + str(dir))
+        LOG.Debug('FindAvailableFileEntry: dir: %s', dir)
 
         # Initialize inode_number object from raw storage
         inode_number = InodeNumber(self.RawBlocks, dir)
@@ -671,17 +1737,40 @@ class FileName():
         # Check if there is still room for another (filename,inode) entry
         # the inode cannot exceed maximum size
         if inode_number.inode.size >= MAX_FILE_SIZE:
-            logging.debug("FindAvailableFileEntry: no entries available")
+            LOG.Debug("FindAvailableFileEntry: no entries available")
             return -1
 
-        logging.debug("FindAvailableFileEntry: " + str(inode_number.inode.size))
+        LOG.Debug("FindAvailableFileEntry: %s", inode_number.inode.size)
         return inode_number.inode.size
 
     ## Allocate a data block, update free bitmap, and return its number
 
     def AllocateDataBlock(self):
 
-        logging.debug('AllocateDataBlock: ')
+        LOG.Debug('AllocateDataBlock: ')
+
+        # a full volume may only be waiting for the reclaimer: free what it holds and scan once more
+        for attempt in range(2):
+            block_number = self.ScanFreeBitmap()
+            if block_number != -1:
+                return block_number
+            if self.RawBlocks.reclaimer is None or self.RawBlocks.reclaimer.Pending() == 0:
+                break
+            self.RawBlocks.reclaimer.Flush()
+
+        LOG.Debug('AllocateDataBlock: no free data blocks available')
+        quit()
+
+    ## Finds a free data block in the bitmap and marks it used; returns its number, or -1 if there is none
+
+    def ScanFreeBitmap(self):
+        reclaimer = self.RawBlocks.reclaimer
+        if reclaimer is not None:
+            with reclaimer.bitmap_lock:
+                return self.ScanFreeBitmapLocked()
+        return self.ScanFreeBitmapLocked()
+
+    def ScanFreeBitmapLocked(self):
 
         # Scan through all available data blocks
         for block_number in range(DATA_BLOCKS_OFFSET, TOTAL_NUM_BLOCKS):
@@ -698,14 +1787,14 @@ class FileName():
                 # Mark it as used in bitmap
                 block[block_number % BLOCK_SIZE] = 1
                 self.RawBlocks.Put(bitmap_block, block)
-                logging.debug('AllocateDataBlock: allocated ' + str(block_number))
+                LOG.Debug('AllocateDataBlock: allocated %s', block_number)
                 return block_number
 
-        logging.debug('AllocateDataBlock: no free data blocks available')
-        quit()
+        return -1
 
     ## Initializes the root inode
 
+    @MeasuredOp
     def InitRootInode(self):
 
         # Root inode has well-known value 0
@@ -726,40 +1815,40 @@ class FileName():
     ## dir is the inode number of a directory to hold the object
     ## name is the object's name
 
+    @MeasuredOp
     def Create(self, dir, name, type):
-        logging.debug("Create: dir: " + str(dir) + ", name: " + str(name) + ", type: " + str(type))
+        LOG.Debug("Create: dir: %s, name: %s, type: %s", dir, name, type)
 
         # Ensure type is valid
         if not (type == INODE_TYPE_FILE or type == INODE_TYPE_DIR):
-            logging.debug("Create: type not supported")
+            LOG.Debug("Create: type not supported")
             return -1
 
         # Find if there is an available inode
         inode_position = self.FindAvailableInode()
         if inode_position == -1:
-            logging.debug("Create: no free inode available")
+            LOG.Debug("Create: no free inode available")
             return -1
 
         # Obtain dir_inode_number_inode, ensure it is a directory
         dir_inode = InodeNumber(self.RawBlocks, dir)
         dir_inode.InodeNumberToInode()
         if dir_inode.inode.type != INODE_TYPE_DIR:
-            logging.debug("Create: dir is not a directory")
+            LOG.Debug("Create: dir is not a directory")
             return -1
 
         # Find available slot in directory data block
         fileentry_position = self.FindAvailableFileEntry(dir)
         if fileentry_position == -1:
-            logging.debug("Create: no entry available for another object")
+            LOG.Debug("Create: no entry available for another object")
             return -1
 
         # Ensure it's not a duplicate - if Lookup returns anything other than -1
         if self.Lookup(name, dir) != -1:
-            logging.debug("Create: name already exists")
+            LOG.Debug("Create: name already exists")
             return -1
 
-        logging.debug(
-            "Create: inode_position: " + str(inode_position) + ", fileentry_position: " + str(fileentry_position))
+        LOG.Debug("Create: inode_position: %s, fileentry_position: %s", inode_position, fileentry_position)
 
         # time.sleep(3)
 
@@ -809,32 +1898,36 @@ class FileName():
         return inode_position
 
     ## Writes data to a file, starting at offset
-    ## offset must be less than or equal to the file's size
+    ## offset may be past the end of the file: the blocks in between are not allocated, they are holes that read
+    ## as zeros (see Seek)
     ## data is a block array
     ## returns number of bytes written
 
+    @MeasuredOp
     def Write(self, file_inode_number, offset, data):
 
-        logging.debug(
-            "Write: file_inode_number: " + str(file_inode_number) + ", offset: " + str(offset) + ", len(data): " + str(
-                len(data)))
+        LOG.Debug("Write: file_inode_number: %s, offset: %s, len(data): %s", file_inode_number, offset, len(data))
         # logging.debug (str(data))
 
         file_inode = InodeNumber(self.RawBlocks, file_inode_number)
         file_inode.InodeNumberToInode()
 
         if file_inode.inode.type != INODE_TYPE_FILE:
-            logging.debug("Write: not a file")
+            LOG.Debug("Write: not a file")
             return -1
 
-        if offset > file_inode.inode.size:
-            logging.debug("Write: offset larger than file size " + str(file_inode.inode.size))
+        if offset < 0:
+            LOG.Debug("Write: negative offset %s", offset)
             return -1
 
         if offset + len(data) > MAX_FILE_SIZE:
-            logging.debug("Write: exceeds maximum file size: " + str(MAX_FILE_SIZE))
+            LOG.Debug("Write: exceeds maximum file size: %s", MAX_FILE_SIZE)
             return -1
 
+        # an empty write leaves the file as it is, even past its end
+        if len(data) == 0:
+            return 0
+
         # initialize variables used in the while loop
         current_offset = offset
         bytes_written = 0
@@ -850,8 +1943,8 @@ class FileName():
             # next block's boundary (in Bytes relative to file 0)
             next_block_boundary = (current_block_index + 1) * BLOCK_SIZE
 
-            logging.debug('Write: current_block_index: ' + str(current_block_index) + ' , next_block_boundary: ' + str(
-                next_block_boundary))
+            LOG.Debug('Write: current_block_index: %s , next_block_boundary: %s',
+                      current_block_index, next_block_boundary)
 
             # byte position where the slice of data to write should start, within a block
             # the first time around in the loop, this may not be aligned with block boundary (i.e. 0) depending on offset
@@ -869,20 +1962,22 @@ class FileName():
                 # otherwise, the data is truncated within this block
                 write_end = (offset + len(data)) % BLOCK_SIZE
 
-            logging.debug('Write: write_start: ' + str(write_start) + ' , write_end: ' + str(write_end))
+            LOG.Debug('Write: write_start: %s , write_end: %s', write_start, write_end)
 
             # retrieve index of block to be written from inode's list
             block_number = file_inode.inode.block_numbers[current_block_index]
 
-            # if the block is not allocated, allocate
+            # if the block is not allocated, allocate; a new block starts out as zeros, not as whatever a freed
+            # block held before
             if block_number == 0:
                 new_block = self.AllocateDataBlock()
                 # update inode (it will be written to raw storage before the method returns)
                 file_inode.inode.block_numbers[current_block_index] = new_block
                 block_number = new_block
-
-            # first, we read the whole block from raw storage
-            block = file_inode.RawBlocks.Get(block_number)
+                block = bytearray(BLOCK_SIZE)
+            else:
+                # first, we read the whole block from raw storage
+                block = file_inode.RawBlocks.Get(block_number)
 
             # copy slice of data into the right position in the block
             block[write_start:write_end] = data[bytes_written:bytes_written + (write_end - write_start)]
@@ -894,30 +1989,29 @@ class FileName():
             current_offset += write_end - write_start
             bytes_written += write_end - write_start
 
-            logging.debug('Write: current_offset: ' + str(current_offset) + ' , bytes_written: ' + str(
-                bytes_written) + ' , len(data): ' + str(len(data)))
+            LOG.Debug('Write: current_offset: %s , bytes_written: %s , len(data): %s',
+                      current_offset, bytes_written, len(data))
 
         # Update inode's metadata and write to storage
-        file_inode.inode.size += bytes_written
+        file_inode.inode.size = max(file_inode.inode.size, offset + bytes_written)
         file_inode.StoreInode()
 
         return bytes_written
 
+    @MeasuredOp
     def Read(self, file_inode_number, offset, count):
 
-        logging.debug(
-            "Read: file_inode_number: " + str(file_inode_number) + ", offset: " + str(offset) + ", count: " + str(
-                count))
+        LOG.Debug("Read: file_inode_number: %s, offset: %s, count: %s", file_inode_number, offset, count)
 
         file_inode = InodeNumber(self.RawBlocks, file_inode_number)
         file_inode.InodeNumberToInode()
 
         if file_inode.inode.type != INODE_TYPE_FILE:
-            logging.debug("Read: not a file")
+            LOG.Debug("Read: not a file")
             return -1
 
         if offset > file_inode.inode.size:
-            logging.debug("Read: offset larger than file size " + str(file_inode.inode.size))
+            LOG.Debug("Read: offset larger than file size %s", file_inode.inode.size)
             return -1
 
         # initialize variables used in the while loop
@@ -940,8 +2034,8 @@ class FileName():
             # next block's boundary (in Bytes relative to file 0)
             next_block_boundary = (current_block_index + 1) * BLOCK_SIZE
 
-            logging.debug('Read: current_block_index: ' + str(current_block_index) + ' , next_block_boundary: ' + str(
-                next_block_boundary))
+            LOG.Debug('Read: current_block_index: %s , next_block_boundary: %s',
+                      current_block_index, next_block_boundary)
 
             read_start = current_offset % BLOCK_SIZE
 
@@ -952,88 +2046,133 @@ class FileName():
                 # otherwise, the data is truncated within this block
                 read_end = (offset + bytes_to_read) % BLOCK_SIZE
 
-            logging.debug('Read: read_start: ' + str(read_start) + ' , read_end: ' + str(read_end))
+            LOG.Debug('Read: read_start: %s , read_end: %s', read_start, read_end)
 
             # retrieve index of block to be written from inode's list
             block_number = file_inode.inode.block_numbers[current_block_index]
 
-            # first, we read the whole block from raw storage
-            block = file_inode.RawBlocks.Get(block_number)
+            # a hole: read_block already holds zeros there
+            if block_number != 0:
+                # first, we read the whole block from raw storage
+                block = file_inode.RawBlocks.Get(block_number)
 
-            # copy slice of data into the right position in the block
-            read_block[bytes_read:bytes_read + (read_end - read_start)] = block[read_start:read_end]
+                # copy slice of data into the right position in the block
+                read_block[bytes_read:bytes_read + (read_end - read_start)] = block[read_start:read_end]
 
             bytes_read += read_end - read_start
             current_offset += read_end - read_start
 
-            logging.debug('Read: current_offset: ' + str(current_offset) + ' , bytes_read: ' + str(bytes_read))
+            LOG.Debug('Read: current_offset: %s , bytes_read: %s', current_offset, bytes_read)
 
         return read_block
 
+    ## Seek: finds data or holes in a file, like lseek(2) with SEEK_DATA and SEEK_HOLE, so copy tools can skip holes
+    ## whence SEEK_DATA: the first offset at or after offset within an allocated block
+    ## whence SEEK_HOLE: the first offset at or after offset within a hole; the end of the file counts as a hole
+    ## Returns -1 if offset is not within the file, or for SEEK_DATA if only holes follow it
+    ## Only the inode is looked at, no data block is read
+
+    @MeasuredOp
+    def Seek(self, file_inode_number, offset, whence):
+
+        LOG.Debug("Seek: file_inode_number: %s, offset: %s, whence: %s", file_inode_number, offset, whence)
+
+        if whence != SEEK_DATA and whence != SEEK_HOLE:
+            LOG.Debug("Seek: whence not supported")
+            return -1
+
+        file_inode = InodeNumber(self.RawBlocks, file_inode_number)
+        file_inode.InodeNumberToInode()
+
+        if file_inode.inode.type != INODE_TYPE_FILE:
+            LOG.Debug("Seek: not a file")
+            return -1
+
+        if offset < 0 or offset >= file_inode.inode.size:
+            LOG.Debug("Seek: offset not within file size %s", file_inode.inode.size)
+            return -1
+
+        while offset < file_inode.inode.size:
+            allocated = file_inode.inode.block_numbers[offset // BLOCK_SIZE] != 0
+            if allocated == (whence == SEEK_DATA):
+                return offset
+            # skip to the next block
+            offset = (offset // BLOCK_SIZE + 1) * BLOCK_SIZE
+
+        if whence == SEEK_HOLE:
+            return file_inode.inode.size
+        return -1
+
     def PathToInodeNumber(self, path, dir):
 
-        logging.debug("PathToInodeNumber: path: " + str(path) + ", dir: " + str(dir))
+        LOG.Debug("PathToInodeNumber: path: %s, dir: %s", path, dir)
 
         if "/" in path:
             split_path = path.split("/")
             first = split_path[0]
             del split_path[0]
             rest = "/".join(split_path)
-            logging.debug("PathToInodeNumber: first: " + str(first) + ", rest: " + str(rest))
+            LOG.Debug("PathToInodeNumber: first: %s, rest: %s", first, rest)
             d = self.Lookup(first, dir)
             return self.PathToInodeNumber(rest, d)
         else:
             return self.Lookup(path, dir)
 
+    @MeasuredOp
     def GeneralPathToInodeNumber(self, path, cwd):
 
-        logging.debug("GeneralPathToInodeNumber: path: " + str(path) + ", cwd: " + str(cwd))
+        LOG.Debug("GeneralPathToInodeNumber: path: %s, cwd: %s", path, cwd)
 
         if path[0] == "/":
             if len(path) == 1:  # special case: root
                 return 0
             cut_path = path[1:len(path)]
-            logging.debug("GeneralPathToInodeNumber: cut_path: " + str(cut_path))
+            LOG.Debug("GeneralPathToInodeNumber: cut_path: %s", cut_path)
             return self.PathToInodeNumber(cut_path, 0)
         else:
             return self.PathToInodeNumber(path, cwd)
 
+    @MeasuredOp
     def Link(self, target, name, cwd):
 
-        logging.debug("Link: target: " + str(target) + ", name: " + str(name) + ", cwd: " + str(cwd))
+        LOG.Debug("Link: target: %s, name: %s, cwd: %s", target, name, cwd)
 
         target_inode_number = self.GeneralPathToInodeNumber(target, cwd)
         if target_inode_number == -1:
-            logging.debug("Link: target does not exist")
+            LOG.Debug("Link: target does not exist")
             return -1
 
         cwd_inode = InodeNumber(self.RawBlocks, cwd)
         cwd_inode.InodeNumberToInode()
         if cwd_inode.inode.type != INODE_TYPE_DIR:
-            logging.debug("Link: cwd is not a directory")
+            LOG.Debug("Link: cwd is not a directory")
             return -1
 
         # Find available slot in directory data block
         fileentry_position = self.FindAvailableFileEntry(cwd)
         if fileentry_position == -1:
-            logging.debug("Link: no entry available for another link")
+            LOG.Debug("Link: no entry available for another link")
             return -1
 
         # Ensure it's not a duplicate - if Lookup returns anything other than -1
         if self.Lookup(name, cwd) != -1:
-            logging.debug("Link: name already exists")
+            LOG.Debug("Link: name already exists")
             return -1
 
         # Ensure target is a file
         target_obj = InodeNumber(self.RawBlocks, target_inode_number)
         target_obj.InodeNumberToInode()
         if target_obj.inode.type != INODE_TYPE_FILE:
-            logging.debug("Link: target must be a file")
+            LOG.Debug("Link: target must be a file")
             return -1
 
         # Add to directory (filename,inode) table
         self.InsertFilenameInodeNumber(cwd_inode, name, target_inode_number)
 
+        # Update directory inode: refcnt counts the entries created in it, as for Create
+        cwd_inode.inode.refcnt += 1
+        cwd_inode.StoreInode()
+
         # Update refcnt of target and write to file system
         target_inode_number_object = InodeNumber(self.RawBlocks, target_inode_number)
         target_inode_number_object.InodeNumberToInode()
@@ -1044,3 +2183,188 @@ class FileName():
 
 
 
+
+    ## Removes entry name from a loaded directory InodeNumber and stores the directory's inode
+    ## The directory's last entry moves into the freed slot, so at most one directory block is written, and a last
+    ## directory block left empty is freed. Returns the inode number of the removed entry, or -1 if there is none.
+
+    def RemoveEntry(self, dir_inode, name):
+
+        LOG.Debug('RemoveEntry: %s, %s', dir_inode.inode_number, name)
+
+        padded_name = bytearray(bytearray(name, "utf-8").ljust(MAX_FILENAME, b'\x00'))
+        entries = dir_inode.inode.size // FILE_NAME_DIRENTRY_SIZE
+        block_count = (dir_inode.inode.size + BLOCK_SIZE - 1) // BLOCK_SIZE
+        blocks = self.RawBlocks.GetMany(dir_inode.inode.block_numbers[:block_count])
+
+        for entry in range(entries):
+            block = blocks[entry // FILE_ENTRIES_PER_DATA_BLOCK]
+            index = entry % FILE_ENTRIES_PER_DATA_BLOCK
+            if self.HelperGetFilenameString(block, index) == padded_name:
+                break
+        else:
+            LOG.Debug("RemoveEntry: not found: %s", name)
+            return -1
+
+        removed = self.HelperGetFilenameInodeNumber(block, index)
+
+        # Move the last entry into the slot of the removed one
+        last = entries - 1
+        if entry != last:
+            last_block = blocks[last // FILE_ENTRIES_PER_DATA_BLOCK]
+            last_start = (last % FILE_ENTRIES_PER_DATA_BLOCK) * FILE_NAME_DIRENTRY_SIZE
+            start = index * FILE_NAME_DIRENTRY_SIZE
+            block[start:start + FILE_NAME_DIRENTRY_SIZE] = last_block[last_start:last_start + FILE_NAME_DIRENTRY_SIZE]
+            self.RawBlocks.Put(dir_inode.inode.block_numbers[entry // FILE_ENTRIES_PER_DATA_BLOCK], block)
+
+        # Shrink the directory; its first block stays, as InsertFilenameInodeNumber expects
+        dir_inode.inode.size -= FILE_NAME_DIRENTRY_SIZE
+        freed = []
+        if dir_inode.inode.size > 0 and dir_inode.inode.size % BLOCK_SIZE == 0:
+            block_number_index = dir_inode.inode.size // BLOCK_SIZE
+            freed.append(dir_inode.inode.block_numbers[block_number_index])
+            dir_inode.inode.block_numbers[block_number_index] = 0
+        dir_inode.StoreInode()
+        self.RawBlocks.reclaimer.Free(freed)
+
+        return removed
+
+    ## Frees a loaded InodeNumber: the inode is marked invalid at once, its data blocks go to the reclaimer
+
+    def FreeInode(self, inode_number):
+
+        LOG.Debug('FreeInode: %s', inode_number.inode_number)
+
+        freed = [b for b in inode_number.inode.block_numbers if b != 0]
+        inode_number.inode.type = INODE_TYPE_INVALID
+        inode_number.inode.size = 0
+        inode_number.inode.refcnt = 0
+        for i in range(MAX_INODE_BLOCK_NUMBERS):
+            inode_number.inode.block_numbers[i] = 0
+        inode_number.StoreInode()
+        self.RawBlocks.reclaimer.Free(freed)
+
+    ## Removes file name from directory dir - same as unlink
+    ## The file's refcnt is decremented; when it reaches 0 the file's inode and data blocks are freed
+    ## Returns 0, or -1 if name does not exist or is a directory
+
+    @MeasuredOp
+    def Unlink(self, name, dir):
+
+        LOG.Debug("Unlink: name: %s, dir: %s", name, dir)
+
+        if name == "." or name == "..":
+            LOG.Debug("Unlink: cannot unlink %s", name)
+            return -1
+
+        dir_inode = InodeNumber(self.RawBlocks, dir)
+        dir_inode.InodeNumberToInode()
+        if dir_inode.inode.type != INODE_TYPE_DIR:
+            LOG.Debug("Unlink: dir is not a directory")
+            return -1
+
+        target = self.Lookup(name, dir)
+        if target == -1:
+            LOG.Debug("Unlink: name does not exist")
+            return -1
+
+        target_inode = InodeNumber(self.RawBlocks, target)
+        target_inode.InodeNumberToInode()
+        if target_inode.inode.type == INODE_TYPE_DIR:
+            LOG.Debug("Unlink: %s is a directory", name)
+            return -1
+
+        # Remove the entry; the directory's refcnt counts the entries created or linked in it (see Create, Link)
+        dir_inode.inode.refcnt -= 1
+        self.RemoveEntry(dir_inode, name)
+
+        target_inode.inode.refcnt -= 1
+        if target_inode.inode.refcnt > 0:
+            target_inode.StoreInode()
+        else:
+            self.FreeInode(target_inode)
+
+        return 0
+
+    ## Removes empty directory name from directory dir
+    ## Returns 0, or -1 if name does not exist, is not a directory, or is not empty
+
+    @MeasuredOp
+    def Rmdir(self, name, dir):
+
+        LOG.Debug("Rmdir: name: %s, dir: %s", name, dir)
+
+        if name == "." or name == "..":
+            LOG.Debug("Rmdir: cannot remove %s", name)
+            return -1
+
+        dir_inode = InodeNumber(self.RawBlocks, dir)
+        dir_inode.InodeNumberToInode()
+        if dir_inode.inode.type != INODE_TYPE_DIR:
+            LOG.Debug("Rmdir: dir is not a directory")
+            return -1
+
+        target = self.Lookup(name, dir)
+        if target == -1:
+            LOG.Debug("Rmdir: name does not exist")
+            return -1
+
+        target_inode = InodeNumber(self.RawBlocks, target)
+        target_inode.InodeNumberToInode()
+        if target_inode.inode.type != INODE_TYPE_DIR:
+            LOG.Debug("Rmdir: %s is not a directory", name)
+            return -1
+
+        # An empty directory only holds "." and ".."
+        if target_inode.inode.size > 2 * FILE_NAME_DIRENTRY_SIZE:
+            LOG.Debug("Rmdir: %s is not empty", name)
+            return -1
+
+        dir_inode.inode.refcnt -= 1
+        self.RemoveEntry(dir_inode, name)
+        self.FreeInode(target_inode)
+
+        return 0
+
+    ## Sets the size of a file to size bytes
+    ## Shrinking frees the blocks past the new end (through the reclaimer) and zeroes the rest of the last block, so
+    ## that data written before the truncate cannot reappear when the file grows again; growing allocates nothing,
+    ## the new bytes are a hole
+    ## Returns the new size, or -1
+
+    @MeasuredOp
+    def Truncate(self, file_inode_number, size):
+
+        LOG.Debug("Truncate: file_inode_number: %s, size: %s", file_inode_number, size)
+
+        file_inode = InodeNumber(self.RawBlocks, file_inode_number)
+        file_inode.InodeNumberToInode()
+
+        if file_inode.inode.type != INODE_TYPE_FILE:
+            LOG.Debug("Truncate: not a file")
+            return -1
+
+        if size < 0 or size > MAX_FILE_SIZE:
+            LOG.Debug("Truncate: size not between 0 and maximum file size %s", MAX_FILE_SIZE)
+            return -1
+
+        freed = []
+        if size < file_inode.inode.size:
+            # Zero the rest of the block holding the new end
+            block_number = file_inode.inode.block_numbers[size // BLOCK_SIZE] if size % BLOCK_SIZE != 0 else 0
+            if block_number != 0:
+                block = self.RawBlocks.Get(block_number)
+                block[size % BLOCK_SIZE:] = bytearray(BLOCK_SIZE - size % BLOCK_SIZE)
+                self.RawBlocks.Put(block_number, block)
+
+            keep = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+            for i in range(keep, MAX_INODE_BLOCK_NUMBERS):
+                if file_inode.inode.block_numbers[i] != 0:
+                    freed.append(file_inode.inode.block_numbers[i])
+                    file_inode.inode.block_numbers[i] = 0
+
+        file_inode.inode.size = size
+        file_inode.StoreInode()
+        self.RawBlocks.reclaimer.Free(freed)
+
+        return size
@@ -0,0 +1,227 @@
+import bisect, threading, time
+
+## Client-side metrics: per RPC type and server, per file system operation, and named counters
+## One Metrics object lives in every DiskBlocks (DiskBlocks.metrics); FileName operations find it through
+## their RawBlocks. Recording takes one lock and a few additions, small next to an XML-RPC round trip.
+
+# Upper bounds (seconds) of the latency histogram buckets: 1us to about 70s, four buckets per power of two,
+# so a percentile read from the histogram is within 19% of the true value
+LATENCY_BOUNDS = [1e-6 * 2 ** (k / 4.0) for k in range(0, 4 * 26 + 1)]
+
+## Size in bytes of the data carried by an RPC argument or result: block contents, strings, and lists of them
+## This is payload, not the size of the XML encoding on the wire; numbers count 8 bytes
+
+def PayloadSize(value):
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        size = 0
+        for item in value:
+            size += PayloadSize(item)
+        return size
+    return 8
+
+## Latency histogram with logarithmic buckets; exact count, mean and maximum
+
+class Histogram():
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def Record(self, seconds):
+        self.buckets[bisect.bisect_left(LATENCY_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def Merge(self, other):
+        for i in range(len(self.buckets)):
+            self.buckets[i] += other.buckets[i]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    ## Upper bound of the bucket holding the p-th percentile (nearest rank), p in [0, 100]
+
+    def Percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        rank = max(1, min(self.count, int(round(p / 100.0 * self.count))))
+        seen = 0
+        for i in range(len(self.buckets)):
+            seen += self.buckets[i]
+            if seen >= rank:
+                if i == len(LATENCY_BOUNDS):
+                    return self.max
+                return min(LATENCY_BOUNDS[i], self.max)
+        return self.max
+
+    def Summary(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_us': round(self.total / self.count * 1e6, 1),
+            'p50_us': round(self.Percentile(50) * 1e6, 1),
+            'p90_us': round(self.Percentile(90) * 1e6, 1),
+            'p99_us': round(self.Percentile(99) * 1e6, 1),
+            'max_us': round(self.max * 1e6, 1),
+        }
+
+## Statistics of one kind of call: count, calls that failed, bytes sent and received, latency
+
+class CallStats():
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.latency = Histogram()
+
+    def Merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.bytes_out += other.bytes_out
+        self.bytes_in += other.bytes_in
+        self.latency.Merge(other.latency)
+
+    def Summary(self):
+        return {'count': self.count, 'errors': self.errors, 'bytes_out': self.bytes_out, 'bytes_in': self.bytes_in,
+                'latency': self.latency.Summary()}
+
+class Metrics():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.Reset()
+
+    ## Reset: drops everything recorded so far, e.g. between the two halves of an A/B run
+
+    def Reset(self):
+        with self.lock:
+            self.started = time.monotonic()
+            # (server, method) -> CallStats of the requests sent to that server
+            self.rpcs = {}
+            # file system operation name -> CallStats
+            self.ops = {}
+            # (counter name, server or None) -> value
+            self.counters = {}
+
+    ## RecordRPC: one request to a server; method is 'system.multicall' for a pipelined batch
+
+    def RecordRPC(self, server, method, seconds, bytes_out, bytes_in, error=False):
+        with self.lock:
+            stats = self.rpcs.get((server, method))
+            if stats is None:
+                stats = self.rpcs[(server, method)] = CallStats()
+            stats.count += 1
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            if error:
+                stats.errors += 1
+            stats.latency.Record(seconds)
+
+    ## RecordOp: one file system operation; failed operations are those that returned -1 or raised
+
+    def RecordOp(self, name, seconds, error=False):
+        with self.lock:
+            stats = self.ops.get(name)
+            if stats is None:
+                stats = self.ops[name] = CallStats()
+            stats.count += 1
+            if error:
+                stats.errors += 1
+            stats.latency.Record(seconds)
+
+    ## Count: adds n to a named counter, optionally for one server (reconstructions, cache hits, ...)
+
+    def Count(self, name, server=None, n=1):
+        with self.lock:
+            self.counters[(name, server)] = self.counters.get((name, server), 0) + n
+
+    def Counter(self, name, server=None):
+        return self.counters.get((name, server), 0)
+
+    ## Total: a counter summed over all servers
+
+    def Total(self, name):
+        with self.lock:
+            return sum(value for (counter, server), value in self.counters.items() if counter == name)
+
+    ## Requests: number of requests sent to a server, all methods together
+
+    def Requests(self, server):
+        with self.lock:
+            return sum(stats.count for (rpc_server, method), stats in self.rpcs.items() if rpc_server == server)
+
+    ## Snapshot: everything recorded since the last Reset, as plain dicts and lists (JSON serializable)
+    ##   rpc: per method, all servers together; servers: per server, per method, plus that server's counters;
+    ##   ops: per file system operation; counters: every counter summed over servers
+
+    def Snapshot(self):
+        with self.lock:
+            rpc = {}
+            servers = {}
+            for (server, method), stats in sorted(self.rpcs.items(), key=str):
+                rpc.setdefault(method, CallStats()).Merge(stats)
+                servers.setdefault(server, {'rpc': {}, 'counters': {}})['rpc'][method] = stats.Summary()
+            counters = {}
+            for (name, server), value in sorted(self.counters.items(), key=str):
+                counters[name] = counters.get(name, 0) + value
+                if server is not None:
+                    servers.setdefault(server, {'rpc': {}, 'counters': {}})['counters'][name] = value
+            return {
+                'elapsed_s': round(time.monotonic() - self.started, 3),
+                'rpc': {method: stats.Summary() for method, stats in rpc.items()},
+                'servers': servers,
+                'ops': {name: stats.Summary() for name, stats in sorted(self.ops.items())},
+                'counters': counters,
+            }
+
+## FormatSnapshot: a Snapshot() as text tables, for the shells' stats command
+
+def FormatSnapshot(snapshot):
+    lines = ['Metrics over ' + str(snapshot['elapsed_s']) + 's']
+
+    def Table(title, rows):
+        lines.append('')
+        lines.append(title.ljust(24) + 'count'.rjust(8) + 'errors'.rjust(8) + 'KB out'.rjust(10) + 'KB in'.rjust(10) +
+                     'p50 us'.rjust(10) + 'p90 us'.rjust(10) + 'p99 us'.rjust(10) + 'max us'.rjust(10))
+        for name, summary in rows:
+            latency = summary['latency']
+            lines.append(str(name).ljust(24) + str(summary['count']).rjust(8) + str(summary['errors']).rjust(8) +
+                         str(round(summary['bytes_out'] / 1024.0, 1)).rjust(10) +
+                         str(round(summary['bytes_in'] / 1024.0, 1)).rjust(10) +
+                         str(latency.get('p50_us', 0)).rjust(10) + str(latency.get('p90_us', 0)).rjust(10) +
+                         str(latency.get('p99_us', 0)).rjust(10) + str(latency.get('max_us', 0)).rjust(10))
+
+    Table('Operation', sorted(snapshot['ops'].items()))
+    Table('RPC', sorted(snapshot['rpc'].items()))
+    for server, stats in sorted(snapshot['servers'].items()):
+        Table('Server ' + str(server), sorted(stats['rpc'].items()))
+        if len(stats['counters']) > 0:
+            lines.append('  ' + ', '.join(name + '=' + str(value) for name, value in sorted(stats['counters'].items())))
+    lines.append('')
+    lines.append('Counters: ' + ', '.join(name + '=' + str(value) for name, value in sorted(snapshot['counters'].items())))
+    return '\n'.join(lines)
+
+## MeasuredOp: decorator for FileName methods, recording each call in self.RawBlocks.metrics
+
+def MeasuredOp(method):
+    name = method.__name__
+
+    def Measured(self, *args):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = method(self, *args)
+            failed = isinstance(result, int) and result == -1
+            return result
+        finally:
+            self.RawBlocks.metrics.RecordOp(name, time.perf_counter() - started, failed)
+
+    Measured.__name__ = name
+    Measured.__doc__ = method.__doc__
+    return Measured
@@ -1,55 +1,174 @@
 from xmlrpc.server import SimpleXMLRPCServer
 from xmlrpc.server import SimpleXMLRPCRequestHandler
 from memoryfs_client import *
-import sys, hashlib
+import sys, os, argparse, threading, time, random
 
 # Restrict to a particular path.
 class RequestHandler(SimpleXMLRPCRequestHandler):
     rpc_paths = ('/RPC2',)
 
-port = int(sys.argv[1])
+parser = argparse.ArgumentParser(description='memoryfs block server')
+parser.add_argument('port', type=int)
+parser.add_argument('damage_block', type=int, nargs='?', default=None,
+                    help='block that starts out corrupt and silently drops writes')
+parser.add_argument('--scrub-rate', type=float, default=0,
+                    help='blocks per second verified by the background scrubber (default 0: scrubber off)')
+parser.add_argument('--checksum', choices=sorted(CHECKSUM_ALGORITHMS), default=DEFAULT_CHECKSUM,
+                    help='checksum algorithm until a client formats the volume with Format')
+parser.add_argument('--stall-ms', type=float, default=0,
+                    help='length of a simulated pause (GC, overload) during which the server answers nothing')
+parser.add_argument('--stall-interval', type=float, default=0,
+                    help='mean seconds between simulated pauses (default 0: no pauses)')
+args = parser.parse_args()
+
+port = args.port
+damage_block_number = args.damage_block
 error_content = bytearray('error', 'utf-8')
 error_flag = bytearray(error_content.ljust(BLOCK_SIZE, b'\x00'))
+zero_block = bytes(BLOCK_SIZE)
 
 # Create server
-with SimpleXMLRPCServer(('localhost', port), requestHandler=RequestHandler) as server:
+# use_builtin_types makes block data arrive as bytes rather than xmlrpc.client.Binary, so it can be hashed
+with SimpleXMLRPCServer(('localhost', port), requestHandler=RequestHandler, use_builtin_types=True) as server:
+
+    # Raw blocks, stored sparsely: block number -> contents, for blocks that are not all zeros
+    # A block missing from block is zero_block; a checksum missing from checksums is the checksum of zero_block
+    block = {}
+    checksums = {}
+    # Checksum algorithm, used for the initial blocks and by the scrubber, and the checksum of zero_block
+    algorithm = {}
+    def SetAlgorithm(name):
+        algorithm['checksum'] = CHECKSUM_ALGORITHMS[name]
+        algorithm['zero'] = algorithm['checksum'](zero_block)
+    SetAlgorithm(args.checksum)
+
+    if damage_block_number is not None:
+        block[damage_block_number] = error_flag
 
-    block = []
-    checksums = []
-    # Initialize raw blocks
-    for i in range(0, TOTAL_NUM_BLOCKS):
-        putdata = bytearray(BLOCK_SIZE)
-        block.insert(i, putdata)
-        checksums.insert(i, hashlib.md5(block[i]).hexdigest())
+    # Blocks found by the scrubber whose contents do not match their checksum
+    corrupt = set()
 
-    if len(sys.argv) == 3:
-        damage_block_number = int(sys.argv[2])
-        block.insert(damage_block_number, error_flag)
+    # Random id of this server process; blocks live in memory, so a new id means every block was lost
+    boot_id = os.urandom(8).hex()
+
+    ## Stall: simulated pause of the whole server for the hedged-read benchmark, at exponentially distributed
+    ## intervals; the server is single-threaded, so requests queued behind a paused one wait as well
+    next_stall = [time.monotonic() + random.expovariate(1 / args.stall_interval) if args.stall_interval > 0 else None]
+    def Stall():
+        if next_stall[0] is not None and time.monotonic() >= next_stall[0]:
+            time.sleep(args.stall_ms / 1000.0)
+            next_stall[0] = time.monotonic() + random.expovariate(1 / args.stall_interval)
 
     ## Put: interface to write a raw block of data to the block indexed by block number
     ## Blocks are padded with zeroes up to BLOCK_SIZE
     def Put(block_number, putdata):
         # Write block
-        if len(sys.argv) == 3 and block_number == sys.argv[2]:
+        if block_number == damage_block_number:
             return 0
-        block[block_number] = putdata
+        if putdata == zero_block:
+            block.pop(block_number, None)
+        else:
+            block[block_number] = putdata
         return 0
     server.register_function(Put, 'Put')
 
     ## Get: interface to read a raw block of data from block indexed by block number
     ## Equivalent to the textbook's BLOCK_NUMBER_TO_BLOCK(b)
     def Get(block_number):
-        return block[block_number]
+        Stall()
+        return block.get(block_number, zero_block)
     server.register_function(Get, 'Get')
 
     def Put_Checksum(block_number, checksum):
-        checksums[block_number] = checksum
+        if checksum == algorithm['zero']:
+            checksums.pop(block_number, None)
+        else:
+            checksums[block_number] = checksum
+        # the block was just rewritten; the scrubber decides again on its next pass
+        corrupt.discard(block_number)
         return 0
     server.register_function(Put_Checksum, 'Put_Checksum')
 
     def Get_Checksum(block_number):
-        return checksums[block_number]
+        return checksums.get(block_number, algorithm['zero'])
     server.register_function(Get_Checksum, 'Get_Checksum')
 
+    ## Batched variants of Get/Put/Get_Checksum/Put_Checksum, one request for a list of blocks
+    ## Used by DiskBlocks.Rebuild to stream many stripes per round trip
+    def GetMany(block_numbers):
+        return [block.get(block_number, zero_block) for block_number in block_numbers]
+    server.register_function(GetMany, 'GetMany')
+
+    def PutMany(block_numbers, blocks):
+        for block_number, putdata in zip(block_numbers, blocks):
+            Put(block_number, putdata)
+        return 0
+    server.register_function(PutMany, 'PutMany')
+
+    def Get_Checksums(block_numbers):
+        return [checksums.get(block_number, algorithm['zero']) for block_number in block_numbers]
+    server.register_function(Get_Checksums, 'Get_Checksums')
+
+    def Put_Checksums(block_numbers, block_checksums):
+        for block_number, checksum in zip(block_numbers, block_checksums):
+            Put_Checksum(block_number, checksum)
+        return 0
+    server.register_function(Put_Checksums, 'Put_Checksums')
+
+    ## Format: resets every block to zeros and switches to checksum algorithm name, in one request
+    ## Returns the boot id, which DiskBlocks records for a volume it formats; the damaged block stays damaged
+    def Format(name):
+        SetAlgorithm(name)
+        block.clear()
+        checksums.clear()
+        if damage_block_number is not None:
+            block[damage_block_number] = error_flag
+        corrupt.clear()
+        return boot_id
+    server.register_function(Format, 'Format')
+
+    def Get_Boot_Id():
+        return boot_id
+    server.register_function(Get_Boot_Id, 'Get_Boot_Id')
+
+    ## ListCorrupt: block numbers the scrubber has found not to match their checksum
+    def ListCorrupt():
+        return sorted(corrupt)
+    server.register_function(ListCorrupt, 'ListCorrupt')
+
+    ## Scrub: walks block/checksums forever, verifying scrub_rate blocks per second
+    ## Clients send Put and Put_Checksum as two requests, so a block is briefly out of sync with its checksum;
+    ## a mismatch is only reported once it is seen again on the same, unchanged block object and checksum
+    ## The thread never takes a lock and sleeps between blocks, so it does not hold up the request loop
+    def Scrub(scrub_rate):
+        interval = 1.0 / scrub_rate
+        suspect = {}
+        deadline = time.monotonic()
+        while True:
+            for i in range(0, TOTAL_NUM_BLOCKS):
+                data = block.get(i, zero_block)
+                checksum = checksums.get(i, algorithm['zero'])
+                if (data is zero_block and checksum == algorithm['zero']) or algorithm['checksum'](data) == checksum:
+                    suspect.pop(i, None)
+                    corrupt.discard(i)
+                elif i in suspect and suspect[i][0] is data and suspect[i][1] == checksum:
+                    corrupt.add(i)
+                else:
+                    suspect[i] = (data, checksum)
+
+                deadline += interval
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # fell behind (e.g. the process was suspended); do not try to catch up in a burst
+                    deadline = time.monotonic()
+
+    if args.scrub_rate > 0:
+        threading.Thread(target=Scrub, args=(args.scrub_rate,), daemon=True).start()
+
+    # system.multicall: a client can send several of the calls above in one HTTP request
+    server.register_multicall_functions()
+
     # Run the server's main loop
     server.serve_forever()
\ No newline at end of file
@@ -1,5 +1,8 @@
 from memoryfs_client import *
-import sys
+from memoryfs_metrics import FormatSnapshot
+from memoryfs_trace import Tracer, FormatTree
+from memoryfs_log import PROFILES
+import sys, threading, argparse, json
 
 ## This class implements an interactive shell to navigate the file system
 
@@ -9,6 +12,7 @@ class FSShell():
     # we start in the root directory
     self.cwd = 0
     self.FileObject = file
+    self.tracer = Tracer()
 
   # implements cd (change directory)
   def cd(self, dir):
@@ -63,30 +67,70 @@ class FSShell():
       return -1
     return 0
 
+  # implements rm (removes a file name; the file is freed with its last name)
+  def rm(self, name):
+    i = self.FileObject.Unlink(name, self.cwd)
+    if i == -1:
+      print ("Error: cannot remove file\n")
+      return -1
+    return 0
+
+  # implements rmdir (removes an empty directory)
+  def rmdir(self, name):
+    i = self.FileObject.Rmdir(name, self.cwd)
+    if i == -1:
+      print ("Error: cannot remove directory\n")
+      return -1
+    return 0
+
+  # implements truncate (sets the size of a file: shrinking frees the blocks past it, growing adds a hole that reads as zeros)
+  def truncate(self, filename, size):
+    i = self.FileObject.Lookup(filename, self.cwd)
+    if i == -1:
+      print ("Error: not found\n")
+      return -1
+    if self.FileObject.Truncate(i, size) == -1:
+      print ("Error: cannot truncate file\n")
+      return -1
+    return 0
+
+  # implements write (writes a string at an offset; past the end of the file, the bytes skipped are a hole)
+  def write(self, filename, offset, string):
+    i = self.FileObject.Lookup(filename, self.cwd)
+    if i == -1:
+      print ("Error: not found\n")
+      return -1
+    written = self.FileObject.Write(i, offset, bytearray(string,"utf-8"))
+    if written == -1:
+      print ("Error: cannot write file\n")
+      return -1
+    print ("Successfully wrote " + str(written) + " bytes.")
+    return 0
+
+  # implements extents (lists the byte ranges of a file that hold data, skipping holes)
+  def extents(self, filename):
+    i = self.FileObject.Lookup(filename, self.cwd)
+    if i == -1:
+      print ("Error: not found\n")
+      return -1
+    offset = self.FileObject.Seek(i, 0, SEEK_DATA)
+    while offset != -1:
+      end = self.FileObject.Seek(i, offset, SEEK_HOLE)
+      print ("data: " + str(offset) + "-" + str(end))
+      offset = self.FileObject.Seek(i, end, SEEK_DATA)
+    return 0
+
   # implements ls (lists files in directory)
   def ls(self):
-    inobj = InodeNumber(self.FileObject.RawBlocks, self.cwd)
-    inobj.InodeNumberToInode()
-    block_index = 0
-    while block_index <= (inobj.inode.size // BLOCK_SIZE):
-      block = self.FileObject.RawBlocks.Get(inobj.inode.block_numbers[block_index])
-      if block_index == (inobj.inode.size // BLOCK_SIZE):
-        end_position = inobj.inode.size % BLOCK_SIZE
+    entries = self.FileObject.ReadDir(self.cwd)
+    if entries == -1:
+      print ("Error: not a directory\n")
+      return -1
+    for name, number, inode in entries:
+      if inode.type == INODE_TYPE_DIR:
+        print ("[" + str(inode.refcnt) + "]:" + name + "/")
       else:
-        end_position = BLOCK_SIZE
-      current_position = 0
-      while current_position < end_position:
-        entryname = block[current_position:current_position+MAX_FILENAME]
-        entryinode = block[current_position+MAX_FILENAME:current_position+FILE_NAME_DIRENTRY_SIZE]
-        entryinodenumber = int.from_bytes(entryinode, byteorder='big')
-        inobj2 = InodeNumber(self.FileObject.RawBlocks, entryinodenumber)
-        inobj2.InodeNumberToInode()
-        if inobj2.inode.type == INODE_TYPE_DIR:
-          print ("[" + str(inobj2.inode.refcnt) + "]:" + entryname.decode() + "/")
-        else:
-          print ("[" + str(inobj2.inode.refcnt) + "]:" + entryname.decode())
-        current_position += FILE_NAME_DIRENTRY_SIZE
-      block_index += 1
+        print ("[" + str(inode.refcnt) + "]:" + name)
     return 0
 
   # implements cat (print file contents)
@@ -104,6 +148,14 @@ class FSShell():
     print (data.decode())
     return 0
 
+  # implements rebuild (reconstructs a replaced server in the background)
+  def rebuild(self, server, batch_size, max_bytes_per_sec):
+    def run():
+      result = self.FileObject.RawBlocks.Rebuild(server, batch_size, max_bytes_per_sec, 'rebuild_' + str(server) + '.checkpoint')
+      print("\nRebuild of server " + str(server) + " finished: " + str(result['rebuilt']) + " block(s), " + str(len(result['unrecoverable'])) + " unrecoverable")
+    threading.Thread(target=run, daemon=True).start()
+    return 0
+
   def show_request(self):
     print(" ")
     put_requests = self.FileObject.RawBlocks.get_put_request()
@@ -117,6 +169,40 @@ class FSShell():
       total_get += get_requests[i]
     print("Average Put() request(s): " + str(total_put / N))
     print("Average Get() request(s): " + str(total_get / N))
+    print("Server health: " + str(self.FileObject.RawBlocks.health))
+    print("Read repair(s): " + str(self.FileObject.RawBlocks.get_repairs()))
+    print("Round trips: " + str(self.FileObject.RawBlocks.get_round_trips()))
+    if self.FileObject.RawBlocks.hedge_percentile is not None:
+      print("Hedged reads: " + str(self.FileObject.RawBlocks.get_hedge_stats()))
+
+  # implements stats: the client metrics as tables, as JSON (stats json), or resets them (stats reset)
+  def stats(self, mode):
+    if mode == "reset":
+      self.FileObject.RawBlocks.reset_metrics()
+      print("Metrics reset")
+    elif mode == "json":
+      print(json.dumps(self.FileObject.RawBlocks.get_metrics(), indent=1))
+    else:
+      print(FormatSnapshot(self.FileObject.RawBlocks.get_metrics()))
+    return 0
+
+  # implements trace: on/off, show [depth] (spans merged by call path, then cleared), save <file> [chrome]
+  def trace(self, args):
+    if args[0] == "on":
+      self.tracer.Clear()
+      self.tracer.Enable()
+    elif args[0] == "off":
+      self.tracer.Disable()
+    elif args[0] == "show":
+      print(FormatTree(self.tracer.Tree(), int(args[1]) if len(args) == 2 else None))
+      self.tracer.Clear()
+    elif args[0] == "save":
+      if len(args) == 3 and args[2] == "chrome":
+        self.tracer.ExportChrome(args[1])
+      else:
+        self.tracer.ExportJSON(args[1])
+      print("Saved " + str(len(self.tracer.Spans())) + " span(s) to " + args[1])
+    return 0
 
   def Interpreter(self):
     try:
@@ -153,36 +239,112 @@ class FSShell():
             print("Error: append requires two arguments")
           else:
             self.append(splitcmd[1], splitcmd[2])
+        elif splitcmd[0] == "rm":
+          if len(splitcmd) != 2:
+            print("Error: rm requires one argument")
+          else:
+            self.rm(splitcmd[1])
+        elif splitcmd[0] == "rmdir":
+          if len(splitcmd) != 2:
+            print("Error: rmdir requires one argument")
+          else:
+            self.rmdir(splitcmd[1])
+        elif splitcmd[0] == "truncate":
+          if len(splitcmd) != 3 or not splitcmd[2].isdigit():
+            print("Error: truncate requires a file name and a size")
+          else:
+            self.truncate(splitcmd[1], int(splitcmd[2]))
+        elif splitcmd[0] == "write":
+          if len(splitcmd) != 4 or not splitcmd[2].isdigit():
+            print("Error: write requires a file name, an offset and a string")
+          else:
+            self.write(splitcmd[1], int(splitcmd[2]), splitcmd[3])
+        elif splitcmd[0] == "extents":
+          if len(splitcmd) != 2:
+            print("Error: extents requires one argument")
+          else:
+            self.extents(splitcmd[1])
         elif splitcmd[0] == "ls":
           self.ls()
+        elif splitcmd[0] == "rebuild":
+          if len(splitcmd) < 2 or len(splitcmd) > 4:
+            print("Error: rebuild requires a server number, and optionally a batch size and a bytes/s limit")
+          else:
+            batch_size = 32
+            max_bytes_per_sec = None
+            if len(splitcmd) >= 3:
+              batch_size = int(splitcmd[2])
+            if len(splitcmd) == 4:
+              max_bytes_per_sec = int(splitcmd[3])
+            self.rebuild(int(splitcmd[1]), batch_size, max_bytes_per_sec)
         elif splitcmd[0] == "exit":
+          # blocks still waiting in the reclaimer are freed before the client goes away
+          self.FileObject.RawBlocks.reclaimer.Flush()
           return
         elif splitcmd[0] == "show_request":
           self.show_request()
+        elif splitcmd[0] == "stats":
+          if len(splitcmd) > 2 or (len(splitcmd) == 2 and splitcmd[1] not in ("json", "reset")):
+            print("Error: stats takes no argument, json or reset")
+          else:
+            self.stats(splitcmd[1] if len(splitcmd) == 2 else "")
+        elif splitcmd[0] == "trace":
+          arguments = {"on": (2,), "off": (2,), "show": (2, 3), "save": (3, 4)}
+          if len(splitcmd) < 2 or splitcmd[1] not in arguments or len(splitcmd) not in arguments[splitcmd[1]]:
+            print("Error: trace requires on, off, show [depth] or save <file> [chrome]")
+          else:
+            self.trace(splitcmd[1:])
         else:
           print("command " + splitcmd[0] + " not valid.\n")
+        # with --pipeline, the writes of the command that are still queued go out now
+        self.FileObject.RawBlocks.Flush()
     except EOFError:
+      self.FileObject.RawBlocks.reclaimer.Flush()
       self.show_request()
 
 
 
 if __name__ == "__main__":
 
-  # Initialize file for logging
-  # Changer logging level to INFO to remove debugging messages
-  logging.basicConfig(filename='memoryfs.log', filemode='w', level=logging.DEBUG)
-
   # Replace with your UUID, encoded as a byte array
   UUID = b'\x12\x34\x56\x78'
 
-  N = int(sys.argv[1])
+  parser = argparse.ArgumentParser(description='memoryfs shell over N RAID-5 or RAID-6 block servers')
+  parser.add_argument('N', type=int, help='number of servers')
+  parser.add_argument('servers', nargs='+', help='host:port of each server')
+  parser.add_argument('--checksum', choices=sorted(CHECKSUM_ALGORITHMS), default=DEFAULT_CHECKSUM,
+                      help='block checksum algorithm recorded in the superblock')
+  parser.add_argument('--layout', choices=sorted(RAID_LAYOUTS), default=DEFAULT_LAYOUT,
+                      help='raid5 (one parity block per stripe) or raid6 (P and Q parity blocks per stripe)')
+  parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                      help='stripe unit: consecutive blocks stored on one server before moving to the next')
+  parser.add_argument('--hedge-percentile', type=float, default=None,
+                      help='hedge a read with a parity reconstruction once the home server is slower than this '
+                           'percentile of its recent latencies (default: no hedging)')
+  parser.add_argument('--pipeline', action='store_true',
+                      help='queue block writes and send them per server in one multicall request per command')
+  parser.add_argument('--log-profile', choices=PROFILES, default='debug',
+                      help='debug: every debugging message goes to memoryfs.log; production: the client builds no '
+                           'debugging messages and only INFO and above are logged')
+  parser.add_argument('--log-ring', type=int, default=0,
+                      help='keep the last LOG_RING debug events in memory and log them after every error')
+  args = parser.parse_args()
+
+  # Initialize file for logging
+  logging.basicConfig(filename='memoryfs.log', filemode='w',
+                      level=logging.DEBUG if args.log_profile == 'debug' else logging.INFO)
+  LOG.Configure(args.log_profile, ring_size=args.log_ring)
+
+  N = args.N
   ports = {}
   for i in range(N):
-    ports[i] = 'http://' + sys.argv[i + 2]
+    ports[i] = 'http://' + args.servers[i]
 
   # Initialize file system data
   logging.info('Initializing data structures...')
-  RawBlocks = DiskBlocks(N, ports)
+  RawBlocks = DiskBlocks(N, ports, checksum=args.checksum, layout=args.layout,
+                         chunk_size=args.chunk_size, hedge_percentile=args.hedge_percentile,
+                         pipeline=args.pipeline)
 
   RawBlocks.InitializeBlocks(True,UUID)
 
@@ -193,6 +355,7 @@ if __name__ == "__main__":
   # Initialize FileObject inode
   FileObject = FileName(RawBlocks)
   FileObject.InitRootInode()
+  RawBlocks.Flush()
 
   myshell = FSShell(FileObject)
   myshell.Interpreter()
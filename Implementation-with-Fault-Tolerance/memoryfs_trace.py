@@ -0,0 +1,180 @@
+import json, os, threading, time
+from memoryfs_client import DiskBlocks, InodeTable, Reclaimer, InodeNumber, FileName
+
+## Tracing: nested spans for the methods of FileName, InodeNumber and DiskBlocks, each with its duration and the
+## requests (RPCs) issued below it, so one can see that a mkdir cost 40 Gets and 24 Puts and which layer sent them.
+## Tracing is off unless Tracer.Enable() is called. Enable() replaces the traced methods on their classes with
+## wrappers and Disable() puts the originals back, so a disabled tracer costs nothing at all.
+## Spans are per thread: work handed to a thread pool (hedged reads, Rebuild) shows up as separate root spans.
+## The asyncio client (memoryfs_async_client) is not traced.
+
+# Traced methods, per class
+TRACED_METHODS = {
+    FileName: ['InitRootInode', 'Lookup', 'Create', 'Write', 'Read', 'Link', 'PathToInodeNumber',
+               'GeneralPathToInodeNumber', 'FindAvailableInode', 'FindAvailableFileEntry', 'AllocateDataBlock',
+               'InsertFilenameInodeNumber', 'ReadDir', 'InodesOf', 'Unlink', 'Rmdir', 'Truncate', 'RemoveEntry',
+               'FreeInode', 'Seek'],
+    InodeNumber: ['InodeNumberToInode', 'StoreInode', 'InodeNumberToBlock'],
+    InodeTable: ['Load'],
+    Reclaimer: ['Flush'],
+    DiskBlocks: ['Put', 'Get', 'GetMany', 'ReadPhysical', 'HedgedRead', 'RepairBlock', 'Retrieve_Block_Content',
+                 'Resync', 'Flush', 'Rebuild'],
+}
+
+# The method that sends one request to a server, and the position of the RPC method name in its arguments
+# (after self); its spans are named after the RPC method and counted in the rpcs of every enclosing span
+TRACED_RPC = (DiskBlocks, 'Request', 1)
+
+class Tracer():
+    def __init__(self, max_spans=100000):
+        # finished spans, in the order they ended; at most max_spans are kept, later ones are counted as dropped
+        self.max_spans = max_spans
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.originals = {}
+        self.Clear()
+
+    def Clear(self):
+        with self.lock:
+            self.spans = []
+            self.dropped = 0
+            self.next_id = 0
+            self.started = time.perf_counter()
+
+    def Enabled(self):
+        return len(self.originals) > 0
+
+    ## Enable: starts tracing by wrapping every method of TRACED_METHODS and TRACED_RPC
+
+    def Enable(self):
+        if self.Enabled():
+            return
+        for cls, names in TRACED_METHODS.items():
+            for name in names:
+                if name in cls.__dict__:
+                    self.Wrap(cls, name, None)
+        cls, name, position = TRACED_RPC
+        self.Wrap(cls, name, position)
+
+    ## Disable: stops tracing; the methods are exactly the original ones again. Recorded spans are kept.
+
+    def Disable(self):
+        for (cls, name), method in self.originals.items():
+            setattr(cls, name, method)
+        self.originals = {}
+
+    def Wrap(self, cls, name, rpc_position):
+        method = cls.__dict__[name]
+        self.originals[(cls, name)] = method
+        tracer = self
+        label = cls.__name__ + '.' + name
+
+        def Traced(obj, *args, **kwargs):
+            stack = getattr(tracer.local, 'stack', None)
+            if stack is None:
+                stack = tracer.local.stack = []
+            if rpc_position is None:
+                span = tracer.Open(label, stack)
+            else:
+                span = tracer.Open(args[rpc_position], stack)
+                span['rpc'] = True
+                for enclosing in stack:
+                    enclosing['rpcs'][span['name']] = enclosing['rpcs'].get(span['name'], 0) + 1
+            stack.append(span)
+            try:
+                return method(obj, *args, **kwargs)
+            finally:
+                stack.pop()
+                tracer.Close(span)
+
+        Traced.__name__ = name
+        Traced.__doc__ = method.__doc__
+        setattr(cls, name, Traced)
+
+    def Open(self, name, stack):
+        with self.lock:
+            span_id = self.next_id
+            self.next_id += 1
+        return {'id': span_id, 'parent': stack[-1]['id'] if len(stack) > 0 else None, 'name': name,
+                'thread': threading.get_ident(), 'start': time.perf_counter(), 'rpcs': {}}
+
+    def Close(self, span):
+        span['duration'] = time.perf_counter() - span['start']
+        with self.lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    ## Spans: the finished spans as JSON-serializable dicts, sorted by start time; times in microseconds
+    ## relative to the last Clear()
+
+    def Spans(self):
+        with self.lock:
+            spans = list(self.spans)
+        result = []
+        for span in sorted(spans, key=lambda s: (s['start'], s['id'])):
+            result.append({'id': span['id'], 'parent': span['parent'], 'name': span['name'],
+                           'rpc': span.get('rpc', False), 'thread': span['thread'],
+                           'start_us': round((span['start'] - self.started) * 1e6, 1),
+                           'duration_us': round(span['duration'] * 1e6, 1), 'rpcs': dict(span['rpcs'])})
+        return result
+
+    def ExportJSON(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'spans': self.Spans(), 'dropped': self.dropped}, f)
+
+    ## ExportChrome: Chrome trace-event format ("X" complete events), for chrome://tracing or Perfetto
+
+    def ExportChrome(self, filename):
+        events = []
+        for span in self.Spans():
+            events.append({'name': span['name'], 'cat': 'rpc' if span['rpc'] else 'fs', 'ph': 'X',
+                           'ts': span['start_us'], 'dur': span['duration_us'], 'pid': os.getpid(),
+                           'tid': span['thread'], 'args': {'rpcs': span['rpcs']}})
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    ## Tree: the spans merged by call path: every root span, and under it its children by name, with the number
+    ## of calls, total time and RPCs. Returns a list of (depth, name, calls, total seconds, rpcs).
+
+    def Tree(self):
+        spans = self.Spans()
+        children = {}
+        for span in spans:
+            children.setdefault(span['parent'], []).append(span)
+        rows = []
+
+        def Merge(group, depth):
+            merged = {}
+            for span in group:
+                entry = merged.setdefault(span['name'], {'calls': 0, 'total': 0.0, 'rpcs': {}, 'children': []})
+                entry['calls'] += 1
+                entry['total'] += span['duration_us'] / 1e6
+                for method, count in span['rpcs'].items():
+                    entry['rpcs'][method] = entry['rpcs'].get(method, 0) + count
+                entry['children'].extend(children.get(span['id'], []))
+            for name, entry in merged.items():
+                rows.append((depth, name, entry['calls'], entry['total'], entry['rpcs']))
+                Merge(entry['children'], depth + 1)
+
+        # spans whose parent was dropped (or is still open) are shown as roots
+        known = set(span['id'] for span in spans)
+        Merge([span for span in spans if span['parent'] not in known], 0)
+        return rows
+
+## FormatTree: a Tracer.Tree() as indented text, for the shells' trace command
+
+def FormatTree(rows, max_depth=None):
+    lines = []
+    for depth, name, calls, total, rpcs in rows:
+        if max_depth is not None and depth > max_depth:
+            continue
+        line = '  ' * depth + name
+        if calls > 1:
+            line += ' x' + str(calls)
+        line = line.ljust(48) + str(round(total * 1e3, 3)).rjust(10) + ' ms'
+        if len(rpcs) > 0:
+            line += '  ' + ', '.join(method + '=' + str(count) for method, count in sorted(rpcs.items()))
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,161 @@
+import argparse, contextlib, io, json, multiprocessing, os, random, socket, subprocess, sys, time
+from memoryfs_client import *
+from memoryfs_shell_rpc import FSShell
+
+## Lock contention of the ACQUIRE/RELEASE protocol: M client processes against one memoryfs_server.py
+## Every client runs shell commands drawn at random from a mix (ls, cat, write) for a fixed time, each command
+## between ACQUIRE and RELEASE, as the shell does. For every M the server is started on a free port and formatted.
+## Reported per M, as one JSON line:
+##   ops_per_s: commands completed by all clients per second
+##   lock_wait: fraction of client time spent in ACQUIRE (with --cache this includes its Revalidate request),
+##              and ReadSetBlock attempts per acquired lock
+##   fairness: commands per client (min, max) and Jain's index (1.0 when every client got the same share)
+##   requests_per_s: requests all clients sent to the server per second
+##   latency: per command, ACQUIRE to RELEASE
+## Clients and server share this machine's CPUs; with fewer CPUs than processes the curve also shows CPU contention.
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'memoryfs_server.py')
+UUID = b'\x12\x34\x56\x78'
+# files shared by the clients: all inodes except the root's
+FILES = MAX_NUM_INODES - 1
+WRITE = b'written!'
+
+def FreePort():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def StartServer():
+    port = FreePort()
+    proc = subprocess.Popen([sys.executable, SERVER_SCRIPT, str(port)], stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return proc, 'http://localhost:' + str(port)
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError('memoryfs_server.py did not start on port ' + str(port))
+            time.sleep(0.05)
+
+## Format: formats the volume and creates the shared files, as the first shell to start would
+
+def Format(url):
+    disk = DiskBlocks(url)
+    disk.InitializeBlocks(True, UUID)
+    fo = FileName(disk)
+    with contextlib.redirect_stdout(io.StringIO()):
+        fo.InitRootInode()
+        for i in range(FILES):
+            inode = fo.Create(0, 'f' + str(i), INODE_TYPE_FILE)
+            fo.Write(inode, 0, bytearray(('file ' + str(i) + ' ').encode() * 8))
+    disk.Call('Put', 0, b'\x00')
+    disk.Call('SetFlag')
+
+## Client: one client process; runs commands until the deadline and puts its counts on the queue
+
+def Client(url, index, start, duration, mix, cache, pipeline, results):
+    disk = DiskBlocks(url, cache=cache, pipeline=pipeline)
+    shell = FSShell(FileName(disk))
+    rng = random.Random(index)
+    commands = list(mix.keys())
+    weights = list(mix.values())
+    own = 'f' + str(index % FILES)
+
+    samples = []
+    lock_wait = 0.0
+    offset = 0
+    time.sleep(max(0.0, start - time.time()))
+    deadline = time.time() + duration
+    disk.reset_metrics()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while time.time() < deadline:
+            command = rng.choices(commands, weights)[0]
+            t0 = time.perf_counter()
+            shell.ACQUIRE()
+            acquired = time.perf_counter()
+            if command == 'ls':
+                shell.ls()
+            elif command == 'cat':
+                shell.cat('f' + str(rng.randrange(FILES)))
+            else:
+                inode = shell.FileObject.Lookup(own, 0)
+                shell.FileObject.Write(inode, offset, bytearray(WRITE))
+                offset = (offset + len(WRITE)) % (MAX_FILE_SIZE - len(WRITE))
+            shell.RELEASE()
+            lock_wait += acquired - t0
+            samples.append(time.perf_counter() - t0)
+            # empty the output buffer, it is not needed
+            sys.stdout.seek(0)
+            sys.stdout.truncate()
+
+    rpc = disk.get_metrics()['rpc']
+    results.put({'index': index, 'samples': samples, 'lock_wait': lock_wait,
+                 'attempts': rpc['ReadSetBlock']['count'] if 'ReadSetBlock' in rpc else 0,
+                 'requests': disk.get_round_trips()})
+
+def Percentile(samples, p):
+    if len(samples) == 0:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+def Measure(clients, duration, mix, cache, pipeline):
+    proc, url = StartServer()
+    try:
+        Format(url)
+        results = multiprocessing.Queue()
+        start = time.time() + 1.0
+        workers = [multiprocessing.Process(target=Client, args=(url, i, start, duration, mix, cache, pipeline, results))
+                   for i in range(clients)]
+        for worker in workers:
+            worker.start()
+        done = [results.get() for worker in workers]
+        for worker in workers:
+            worker.join()
+    finally:
+        proc.kill()
+        proc.wait()
+
+    ops = [len(r['samples']) for r in done]
+    samples = [s for r in done for s in r['samples']]
+    total = sum(ops)
+    return {
+        'clients': clients, 'cache': cache, 'pipeline': pipeline, 'duration_s': duration, 'mix': mix,
+        'ops': total,
+        'ops_per_s': round(total / duration, 1),
+        'lock_wait': {'fraction': round(sum(r['lock_wait'] for r in done) / (clients * duration), 3),
+                      'attempts_per_lock': round(sum(r['attempts'] for r in done) / max(1, total), 2)},
+        'fairness': {'min_ops': min(ops), 'max_ops': max(ops),
+                     'jain': round(total ** 2 / (clients * sum(x * x for x in ops)), 3) if total > 0 else None},
+        'requests_per_s': round(sum(r['requests'] for r in done) / duration, 1),
+        'latency': {'mean_us': round(sum(samples) / max(1, len(samples)) * 1e6, 1),
+                    'p50_us': round(Percentile(samples, 50) * 1e6, 1),
+                    'p99_us': round(Percentile(samples, 99) * 1e6, 1)},
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ACQUIRE/RELEASE contention with M concurrent clients')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds every client runs commands')
+    parser.add_argument('--mix', nargs='+', default=['ls=4', 'cat=4', 'write=2'],
+                        help='command=weight for the commands ls, cat and write')
+    parser.add_argument('--cache', action='store_true')
+    parser.add_argument('--pipeline', action='store_true')
+    options = parser.parse_args()
+
+    mix = {}
+    for item in options.mix:
+        command, weight = item.split('=')
+        if command not in ('ls', 'cat', 'write'):
+            parser.error('unknown command in --mix: ' + command)
+        mix[command] = float(weight)
+
+    logging.basicConfig(level=logging.CRITICAL)
+    for clients in options.clients:
+        print(json.dumps(Measure(clients, options.duration, mix, options.cache, options.pipeline)))
@@ -1,6 +1,8 @@
 import xmlrpc.client
 import pickle, logging
-import time
+import time, struct
+from memoryfs_metrics import Metrics, MeasuredOp, PayloadSize
+from memoryfs_log import LOG, Hex
 
 ##### File system constants
 
@@ -46,6 +48,9 @@ INODE_NUM_BLOCKS = (MAX_NUM_INODES * INODE_SIZE) // BLOCK_SIZE
 # In total, 4+2+2=8 bytes are used for size+type+refcnt, remaining bytes for block numbers
 MAX_INODE_BLOCK_NUMBERS = (INODE_SIZE - 8) // 4
 
+# On-disk inode layout: size, type, refcnt, then the block numbers, all big-endian
+INODE_STRUCT = struct.Struct('>IHH' + str(MAX_INODE_BLOCK_NUMBERS) + 'I')
+
 # maximum size of a file
 # maximum number of entries in an inode's block_numbers[], times block size
 MAX_FILE_SIZE = MAX_INODE_BLOCK_NUMBERS*BLOCK_SIZE
@@ -69,47 +74,218 @@ INODE_TYPE_FILE = 1
 INODE_TYPE_DIR = 2
 INODE_TYPE_SYM = 3
 
+# whence values of FileName.Seek, as in lseek(2)
+SEEK_DATA = 3
+SEEK_HOLE = 4
+
 #### BLOCK LAYER
 
 class DiskBlocks():
-    def __init__(self, server_url):
+    def __init__(self, server_url, cache=False, pipeline=False):
         self.server = xmlrpc.client.ServerProxy(server_url, use_builtin_types=True)
-        self.servers_put = 0
-        self.servers_get = 0
+        # Requests per method, file system operations, and counters (see memoryfs_metrics); the server is number 0
+        # Counters: block_put/block_get (blocks written to/read from the server), cache_hits, cache_misses
+        self.metrics = Metrics()
+
+        # Optional write pipelining: Puts are queued and sent with the next request, as one system.multicall
+        # HTTP request. Reads flush the queue first (in the same request), so they always see our own writes.
+        # Flush(), or a Call() such as the RELEASE of the lock, ends an operation and sends the queue.
+        self.pipeline = pipeline
+        self.pending = []
+
+        # Optional client-side block cache, kept across ACQUIRE/RELEASE cycles
+        # The server tracks which clients hold which blocks and queues invalidations when another client writes;
+        # Revalidate() must be called after ACQUIRE, before the cache is used
+        self.cache = None
+        if cache:
+            self.client_id = self.Call('Register')
+            self.cache = {}
+
+    def get_put_request(self):
+        return self.metrics.Counter('block_put')
+
+    def get_get_request(self):
+        return self.metrics.Counter('block_get')
+
+    def get_cache_hits(self):
+        return self.metrics.Counter('cache_hits')
+
+    ## Returns the number of HTTP requests sent to the server
+
+    def get_round_trips(self):
+        return self.metrics.Requests(0)
+
+    def get_metrics(self):
+        return self.metrics.Snapshot()
+
+    def reset_metrics(self):
+        self.metrics.Reset()
+
+    ## Returns True if block_number may be served from the cache
+    ## Block 0 doubles as the lock block and is updated with ReadSetBlock, so it is never cached
+
+    def Cacheable(self, block_number):
+        return self.cache is not None and block_number != 0
+
+    ## Drops every cached block that other clients have written since the last call
+    ## Called right after ACQUIRE; costs a single request
+
+    def Revalidate(self):
+        if self.cache is None:
+            return
+        invalid = self.Call('GetInvalidations', self.client_id)
+        for block_number in invalid:
+            self.cache.pop(block_number, None)
+        LOG.Debug('Revalidate: dropped %s block(s)', len(invalid))
 
     ## Put: interface to write a raw block of data to the block indexed by block number
     ## Blocks are padded with zeroes up to BLOCK_SIZE
     def Put(self, block_number, block_data):
-        logging.debug('Put: block number ' + str(block_number) + ' len ' + str(len(block_data)) + '\n' + str(block_data.hex()))
+        LOG.Debug('Put: block number %s len %s\n%s', block_number, len(block_data), Hex(block_data))
         if len(block_data) > BLOCK_SIZE:
-            logging.error('Put: Block larger than BLOCK_SIZE: ' + str(len(block_data)))
+            LOG.Error('Put: Block larger than BLOCK_SIZE: %s', len(block_data))
             quit()
 
         if block_number in range(0, TOTAL_NUM_BLOCKS):
             # ljust does the padding with zeros
             putdata = bytearray(block_data.ljust(BLOCK_SIZE, b'\x00'))
             # Write block
-            self.server.Put(block_number, putdata)
-            self.servers_put += 1
+            if self.Cacheable(block_number):
+                # write through, keeping our own copy valid
+                self.Send('Put', block_number, putdata, self.client_id)
+                self.cache[block_number] = bytes(putdata)
+            else:
+                self.Send('Put', block_number, putdata)
+            self.metrics.Count('block_put')
             return 0
         else:
-            logging.error('Put: Block out of range: ' + str(block_number))
+            LOG.Error('Put: Block out of range: %s', block_number)
             quit()
 
     ## Get: interface to read a raw block of data from block indexed by block number
     ## Equivalent to the textbook's BLOCK_NUMBER_TO_BLOCK(b)
     def Get(self, block_number):
-        logging.debug('Get: ' + str(block_number))
+        LOG.Debug('Get: %s', block_number)
         if block_number in range(0, TOTAL_NUM_BLOCKS):
             # logging.debug ('\n' + str((self.block[block_number]).hex()))
-            content = self.server.Get(block_number)
-            self.servers_get += 1
+            if self.Cacheable(block_number):
+                return self.GetMany([block_number])[0]
+            content = self.Call('Get', block_number)
+            self.metrics.Count('block_get')
             trans = bytearray(content)
             return trans
 
-        logging.error('Get: Block number larger than TOTAL_NUM_BLOCKS: ' + str(block_number))
+        LOG.Error('Get: Block number larger than TOTAL_NUM_BLOCKS: %s', block_number)
         quit()
 
+    ## ReadModifyWrite: writes data at offset in block block_number, leaving the rest of the block as it is
+    ## The server reads and updates the block itself: one request (queued when pipelining) instead of a Get and a Put
+    def ReadModifyWrite(self, block_number, offset, data):
+        LOG.Debug('ReadModifyWrite: block number %s offset %s len %s', block_number, offset, len(data))
+        if block_number not in range(0, TOTAL_NUM_BLOCKS) or offset < 0 or offset + len(data) > BLOCK_SIZE:
+            LOG.Error('ReadModifyWrite: out of range: block %s offset %s len %s', block_number, offset, len(data))
+            quit()
+
+        if self.Cacheable(block_number):
+            self.Send('ReadModifyWrite', block_number, offset, bytes(data), self.client_id)
+            # our copy, if we hold one, gets the same change
+            if block_number in self.cache:
+                updated = bytearray(self.cache[block_number])
+                updated[offset:offset + len(data)] = data
+                self.cache[block_number] = bytes(updated)
+        else:
+            self.Send('ReadModifyWrite', block_number, offset, bytes(data))
+        self.metrics.Count('block_put')
+        return 0
+
+    ## GetMany: reads a list of blocks, fetching all cache misses with a single request
+    ## Returns a list of bytearrays in the same order as block_numbers; callers may modify them freely
+
+    def GetMany(self, block_numbers):
+        LOG.Debug('GetMany: %s', block_numbers)
+        for block_number in block_numbers:
+            if block_number not in range(0, TOTAL_NUM_BLOCKS):
+                LOG.Error('GetMany: Block number larger than TOTAL_NUM_BLOCKS: %s', block_number)
+                quit()
+
+        if self.cache is None:
+            contents = self.Call('GetMany', block_numbers)
+            self.metrics.Count('block_get', n=len(block_numbers))
+            return [bytearray(content) for content in contents]
+
+        missing = []
+        for block_number in block_numbers:
+            if block_number in self.cache:
+                self.metrics.Count('cache_hits')
+            else:
+                self.metrics.Count('cache_misses')
+                if block_number not in missing:
+                    missing.append(block_number)
+
+        fetched = {}
+        if len(missing) > 0:
+            contents = self.Call('GetMany', missing, self.client_id)
+            self.metrics.Count('block_get', n=len(missing))
+            for block_number, content in zip(missing, contents):
+                fetched[block_number] = content
+                if self.Cacheable(block_number):
+                    self.cache[block_number] = bytes(content)
+
+        result = []
+        for block_number in block_numbers:
+            if block_number in fetched:
+                result.append(bytearray(fetched[block_number]))
+            else:
+                result.append(bytearray(self.cache[block_number]))
+        return result
+
+    ## Send: a call whose result is not needed; queued when pipelining, sent at once otherwise
+
+    def Send(self, method, *args):
+        if self.pipeline:
+            self.pending.append((method, args))
+        else:
+            self.Call(method, *args)
+
+    ## Call: sends one call and returns its result; when pipelining, the queued calls go first in the same request
+
+    def Call(self, method, *args):
+        if len(self.pending) == 0:
+            return self.Request(method, args)
+        self.pending.append((method, args))
+        return self.Flush()[-1]
+
+    ## Flush: sends the queued calls, if any, as one system.multicall request and returns their results
+
+    def Flush(self):
+        if len(self.pending) == 0:
+            return []
+        multicall = xmlrpc.client.MultiCall(self.server)
+        for queued_method, queued_args in self.pending:
+            getattr(multicall, queued_method)(*queued_args)
+            self.metrics.Count('multicall.' + queued_method)
+        calls = self.pending
+        self.pending = []
+        return self.Request('system.multicall', [args for method, args in calls], multicall)
+
+    ## Request: sends one HTTP request and records it in the metrics
+    ## A multicall is sent by passing the xmlrpc.client.MultiCall (args then only serve to count the bytes sent),
+    ## and returns the list of its results
+
+    def Request(self, method, args, multicall=None):
+        started = time.perf_counter()
+        try:
+            if multicall is None:
+                result = getattr(self.server, method)(*args)
+            else:
+                # iterating the results raises xmlrpc.client.Fault for a call that failed on the server
+                result = list(multicall())
+        except Exception:
+            self.metrics.RecordRPC(0, method, time.perf_counter() - started, PayloadSize(args), 0, True)
+            raise
+        self.metrics.RecordRPC(0, method, time.perf_counter() - started, PayloadSize(args), PayloadSize(result))
+        return result
+
     ## Serializes and saves block[] data structure to a disk file
 
     def DumpToDisk(self, prefix):
@@ -139,6 +315,14 @@ class DiskBlocks():
     def InitializeBlocks(self, cleanslate, prefix):
 
         if cleanslate:
+            # The server resets all its blocks to zeros in one request
+            #   Free block bitmap: All blocks start free, so safe to initialize with zeroes
+            #   Inode table: zero indicates an invalid inode, so also safe to initialize with zeroes
+            #   Data blocks: safe to init with zeroes
+            self.Call('Format')
+            if self.cache is not None:
+                self.cache.clear()
+
             # Block 0: No real boot code here, just write the given prefix
             self.Put(0, prefix)
 
@@ -147,14 +331,6 @@ class DiskBlocks():
             superblock = [TOTAL_NUM_BLOCKS, BLOCK_SIZE, MAX_NUM_INODES, INODE_SIZE]
             # Now we serialize it into a byte array
             self.Put(1, pickle.dumps(superblock))
-
-            # Blocks 2-TOTAL_NUM_BLOCKS are initialized with zeroes
-            #   Free block bitmap: All blocks start free, so safe to initialize with zeroes
-            #   Inode table: zero indicates an invalid inode, so also safe to initialize with zeroes
-            #   Data blocks: safe to init with zeroes
-            zeroblock = bytearray(BLOCK_SIZE)
-            for i in range(FREEBITMAP_BLOCK_OFFSET, TOTAL_NUM_BLOCKS):
-                self.Put(i, zeroblock)
         else:
             self.LoadFromDisk(prefix)
 
@@ -215,6 +391,9 @@ class DiskBlocks():
 #  3. Serialize and write Inode object back to raw block storage (InodeToBytearray)
 
 class Inode():
+    # fixed attributes: no per-inode __dict__, and faster attribute access
+    __slots__ = ['type', 'size', 'refcnt', 'block_numbers']
+
     def __init__(self):
 
         # inode is initialized empty
@@ -222,12 +401,8 @@ class Inode():
         self.size = 0
         self.refcnt = 0
 
-        # We store inode block_numbers as a list
-        self.block_numbers = []
-
-        # initialize list with zeroes
-        for i in range(0, MAX_INODE_BLOCK_NUMBERS):
-            self.block_numbers.append(0)
+        # We store inode block_numbers as a list, initialized with zeroes
+        self.block_numbers = [0] * MAX_INODE_BLOCK_NUMBERS
 
     ## Set inode object values from a raw bytearray
     ## This is used when we read an inode from raw block storage to the inode data structure
@@ -235,57 +410,39 @@ class Inode():
     def InodeFromBytearray(self, b):
 
         if len(b) > INODE_SIZE:
-            logging.error('InodeFromBytearray: exceeds inode size ' + str(b))
+            LOG.Error('InodeFromBytearray: exceeds inode size %s', b)
             quit()
 
-        # slice the raw bytes for the different fields
-        # size is 4 bytes, type 2 bytes, refcnt 2 bytes
-        size_slice = b[0:4]
-        type_slice = b[4:6]
-        refcnt_slice = b[6:8]
+        self.InodeFromBlock(b, 0)
 
-        # converts from raw bytes to integers using big-endian
-        # store scalars
-        self.size = int.from_bytes(size_slice, byteorder='big')
-        self.type = int.from_bytes(type_slice, byteorder='big')
-        self.refcnt = int.from_bytes(refcnt_slice, byteorder='big')
+    ## Set inode object values from the inode stored at offset in a block (e.g. an inode table block)
+    ## The fields are decoded in place, without slicing the block
 
-        # each block number entry is 4 bytes, big-endian
-        for i in range(0, MAX_INODE_BLOCK_NUMBERS):
-            start = 8 + i * 4
-            blocknumber_slice = b[start:start + 4]
-            self.block_numbers[i] = int.from_bytes(blocknumber_slice, byteorder='big')
-
-        ## Create a raw byte array, serializing Inode object values to prepare to write
+    def InodeFromBlock(self, block, offset):
+        fields = INODE_STRUCT.unpack_from(block, offset)
+        self.size = fields[0]
+        self.type = fields[1]
+        self.refcnt = fields[2]
+        # the list is updated in place, so references to it stay valid
+        self.block_numbers[:] = fields[3:]
 
+    ## Create a raw byte array, serializing Inode object values to prepare to write
     ## This is used when we write an inode to raw block storage
 
     def InodeToBytearray(self):
 
         # Temporary bytearray - we'll load it with the different inode fields
         temparray = bytearray(INODE_SIZE)
-
-        # We assume size is 4 bytes, and we store it in Big Endian format
-        intsize = self.size
-        temparray[0:4] = intsize.to_bytes(4, 'big')
-
-        # We assume type is 2 bytes, and we store it in Big Endian format
-        inttype = self.type
-        temparray[4:6] = inttype.to_bytes(2, 'big')
-
-        # We assume refcnt is 2 bytes, and we store it in Big Endian format
-        intrefcnt = self.refcnt
-        temparray[6:8] = intrefcnt.to_bytes(2, 'big')
-
-        # We assume each block number is 4 bytes, and we store each in Big Endian format
-        for i in range(0, MAX_INODE_BLOCK_NUMBERS):
-            start = 8 + i * 4
-            intbn = self.block_numbers[i]
-            temparray[start:start + 4] = intbn.to_bytes(4, 'big')
+        self.InodeToBlock(temparray, 0)
 
         # Return the byte array
         return temparray
 
+    ## Serialize this inode into a block at offset, in place
+
+    def InodeToBlock(self, block, offset):
+        INODE_STRUCT.pack_into(block, offset, self.size, self.type, self.refcnt, *self.block_numbers)
+
     ## Prints out this inode object's information to the log
 
     def Print(self):
@@ -310,7 +467,7 @@ class InodeNumber():
 
         # This stores the inode number
         if number > MAX_NUM_INODES:
-            logging.error('InodeNumber: inode number exceeds limit: ' + str(number))
+            LOG.Error('InodeNumber: inode number exceeds limit: %s', number)
             quit()
         self.inode_number = number
 
@@ -321,7 +478,7 @@ class InodeNumber():
     ## The inode data structure loaded from raw storage goes in the self.inode object
 
     def InodeNumberToInode(self):
-        logging.debug('InodeNumberToInode: ' + str(self.inode_number))
+        LOG.Debug('InodeNumberToInode: %s', self.inode_number)
 
         # locate which block has the inode we want
         raw_block_number = INODE_BLOCK_OFFSET + ((self.inode_number * INODE_SIZE) // BLOCK_SIZE)
@@ -333,50 +490,35 @@ class InodeNumber():
         start = (self.inode_number * INODE_SIZE) % BLOCK_SIZE
         end = start + INODE_SIZE
 
-        # extract byte array for this inode
-        tempinode = tempblock[start:end]
+        # load inode from its slice of the block
+        self.inode.InodeFromBlock(tempblock, start)
 
-        # load inode from byte array
-        self.inode.InodeFromBytearray(tempinode)
-
-        logging.debug('InodeNumberToInode : inode_number ' + str(self.inode_number) + ' raw_block_number: ' + str(
-            raw_block_number) + ' slice start: ' + str(start) + ' end: ' + str(end))
-        logging.debug('tempinode: ' + str(tempinode.hex()))
+        LOG.Debug('InodeNumberToInode : inode_number %s raw_block_number: %s slice start: %s end: %s',
+                  self.inode_number, raw_block_number, start, end)
 
     ## Stores (Put) this inode into raw storage
     ## Since an inode is a slice of a block, we first Get() the block, update the slice, and Put()
 
     def StoreInode(self):
-        logging.debug('StoreInode: ' + str(self.inode_number))
+        LOG.Debug('StoreInode: %s', self.inode_number)
 
         # locate which block has the inode we want
         raw_block_number = INODE_BLOCK_OFFSET + ((self.inode_number * INODE_SIZE) // BLOCK_SIZE)
-        logging.debug('StoreInode: raw_block_number ' + str(raw_block_number))
-
-        # Get the entire block containing inode from raw storage
-        tempblock = self.RawBlocks.Get(raw_block_number)
-        logging.debug('StoreInode: tempblock:\n' + str(tempblock.hex()))
+        LOG.Debug('StoreInode: raw_block_number %s', raw_block_number)
 
         # Find the slice of the block for this inode_number
         start = (self.inode_number * INODE_SIZE) % BLOCK_SIZE
         end = start + INODE_SIZE
-        logging.debug('StoreInode: start: ' + str(start) + ', end: ' + str(end))
-
-        # serialize inode into byte array
-        inode_bytearray = self.inode.InodeToBytearray()
-
-        # Update slice of block with this inode's bytearray
-        tempblock[start:end] = inode_bytearray
-        logging.debug('StoreInode: tempblock:\n' + str(tempblock.hex()))
+        LOG.Debug('StoreInode: start: %s, end: %s', start, end)
 
-        # Update raw storage with new inode
-        self.RawBlocks.Put(raw_block_number, tempblock)
+        # Update raw storage with new inode: the server updates the slice of the block, no Get needed
+        self.RawBlocks.ReadModifyWrite(raw_block_number, start, self.inode.InodeToBytearray())
 
     ## Returns a block of data from raw storage, given its offset
     ## Equivalent to textbook's INODE_NUMBER_TO_BLOCK
 
     def InodeNumberToBlock(self, offset):
-        logging.debug('InodeNumberToBlock: ' + str(offset))
+        LOG.Debug('InodeNumberToBlock: %s', offset)
 
         # Load object's inode
         self.InodeNumberToInode()
@@ -405,7 +547,7 @@ class FileName():
 
     def HelperGetFilenameString(self, block, index):
 
-        logging.debug('HelperGetFilenameString: ' + str(block.hex()) + ', ' + str(index))
+        LOG.Debug('HelperGetFilenameString: %s, %s', Hex(block), index)
 
         # Locate bytes that store string - first MAX_FILENAME characters aligned by MAX_FILENAME + INODE_NUMBER_DIRENTRY_SIZE
         string_start = index * FILE_NAME_DIRENTRY_SIZE
@@ -418,7 +560,7 @@ class FileName():
 
     def HelperGetFilenameInodeNumber(self, block, index):
 
-        logging.debug('HelperGetFilenameInodeNumber: ' + str(block.hex()) + ', ' + str(index))
+        LOG.Debug('HelperGetFilenameInodeNumber: %s, %s', Hex(block), index)
 
         # Locate bytes that store inode
         inode_start = (index * FILE_NAME_DIRENTRY_SIZE) + MAX_FILENAME
@@ -433,20 +575,20 @@ class FileName():
 
     def InsertFilenameInodeNumber(self, insert_to, filename, inodenumber):
 
-        logging.debug('InsertFilenameInodeNumber: ' + str(filename) + ', ' + str(inodenumber))
+        LOG.Debug('InsertFilenameInodeNumber: %s, %s', filename, inodenumber)
 
         if len(filename) > MAX_FILENAME:
-            logging.error('InsertFilenameInodeNumber: file name exceeds maximum')
+            LOG.Error('InsertFilenameInodeNumber: file name exceeds maximum')
             quit()
 
         if insert_to.inode.type != INODE_TYPE_DIR:
-            logging.error('InsertFilenameInodeNumber: not a directory inode: ' + str(insert_to.inode.type))
+            LOG.Error('InsertFilenameInodeNumber: not a directory inode: %s', insert_to.inode.type)
             quit()
 
         # We insert a new entry at the end of the existing table, so determine its position based on inode's size
         index = insert_to.inode.size
         if index >= MAX_FILE_SIZE:
-            logging.error('InsertFilenameInodeNumber: no space for another entry in inode')
+            LOG.Error('InsertFilenameInodeNumber: no space for another entry in inode')
             quit()
 
         # Check if we need to allocate another data block for this inode
@@ -460,9 +602,8 @@ class FileName():
                 # update inode (it will be written to raw storage before the method returns)
                 insert_to.inode.block_numbers[block_number_index] = new_block
 
-        # Retrieve the data block where the new (filename,inodenumber) will be stored
+        # The data block where the new (filename,inodenumber) will be stored
         block_number = insert_to.inode.block_numbers[block_number_index]
-        block = self.RawBlocks.Get(block_number)
 
         # Compute module of index to locate entry within block
         index_modulo = index % BLOCK_SIZE
@@ -476,15 +617,13 @@ class FileName():
         inode_start = index_modulo + MAX_FILENAME
         inode_end = inode_start + INODE_NUMBER_DIRENTRY_SIZE
 
-        logging.debug('InsertFilenameInodeNumber: \n' + str(block.hex()))
-        logging.debug('InsertFilenameInodeNumber: inode_start ' + str(inode_start) + ', inode_end ' + str(inode_end))
-        logging.debug(
-            'InsertFilenameInodeNumber: string_start ' + str(string_start) + ', string_end ' + str(string_end))
+        LOG.Debug('InsertFilenameInodeNumber: inode_start %s, inode_end %s', inode_start, inode_end)
+        LOG.Debug('InsertFilenameInodeNumber: string_start %s, string_end %s', string_start, string_end)
 
-        # Update and write data block with (filename,inode) mapping
-        block[inode_start:inode_end] = inodenumber.to_bytes(INODE_NUMBER_DIRENTRY_SIZE, 'big')
-        block[string_start:string_end] = bytearray(stringbyte.ljust(MAX_FILENAME, b'\x00'))
-        self.RawBlocks.Put(block_number, block)
+        # Write the (filename,inode) entry into the data block; the server updates the block in place
+        entry = bytearray(stringbyte.ljust(MAX_FILENAME, b'\x00'))
+        entry += inodenumber.to_bytes(INODE_NUMBER_DIRENTRY_SIZE, 'big')
+        self.RawBlocks.ReadModifyWrite(block_number, string_start, entry)
 
         # Increment size, and write inode
         insert_to.inode.size += FILE_NAME_DIRENTRY_SIZE
@@ -492,16 +631,28 @@ class FileName():
 
     ## Lookup string filename in the context of inode dir - same as textbook's LOOKUP
 
+    @MeasuredOp
     def Lookup(self, filename, dir):
 
-        logging.debug('Lookup: ' + str(filename) + ', ' + str(dir))
+        LOG.Debug('Lookup: %s, %s', filename, dir)
+
+        # Without a cache, the directory inode and blocks would all come from the server one request at a time:
+        # the server searches them instead (LookupInDir), in a single request
+        if self.RawBlocks.cache is None:
+            padded_filename = bytes(bytearray(filename, "utf-8").ljust(MAX_FILENAME, b'\x00'))
+            fileinode = self.RawBlocks.Call('LookupInDir', dir, padded_filename)
+            if fileinode == -2:
+                LOG.Error("Lookup: not a directory inode: %s", dir)
+                return -1
+            LOG.Debug("Lookup: %s in %s: %s", filename, dir, fileinode)
+            return fileinode
 
         # Initialize inode_number object from raw storage
         inode_number = InodeNumber(self.RawBlocks, dir)
         inode_number.InodeNumberToInode()
 
         if inode_number.inode.type != INODE_TYPE_DIR:
-            logging.error("Lookup: not a directory inode: " + str(dir) + " , " + str(inode_number.inode.type))
+            LOG.Error("Lookup: not a directory inode: %s , %s", dir, inode_number.inode.type)
             return -1
 
         offset = 0
@@ -525,8 +676,7 @@ class FileName():
                     # Extract padded MAX_FILENAME string as a bytearray from data block for comparison
                     filestring = self.HelperGetFilenameString(b, i)
 
-                    logging.debug(
-                        "Lookup for " + filename + " in " + str(dir) + ": searching string " + str(filestring))
+                    LOG.Debug("Lookup for %s in %s: searching string %s", filename, dir, filestring)
 
                     # Pad filename with zeroes and make it a byte array
                     padded_filename = bytearray(filename, "utf-8")
@@ -536,20 +686,87 @@ class FileName():
                     if filestring == padded_filename:
                         # On a match, retrieve and return inode number
                         fileinode = self.HelperGetFilenameInodeNumber(b, i)
-                        logging.debug("Lookup successful: " + str(fileinode))
+                        LOG.Debug("Lookup successful: %s", fileinode)
                         return fileinode
 
             # Skip to the next block, back to while loop
             offset += BLOCK_SIZE
 
-        logging.debug("Lookup: file not found: " + str(filename) + " in " + str(dir))
+        LOG.Debug("Lookup: file not found: %s in %s", filename, dir)
         return -1
 
+    ## InodesOf: the Inode objects of a list of inode numbers, with one GetMany of the inode table blocks holding
+    ## them (each block fetched once)
+
+    def InodesOf(self, numbers):
+        inodes = []
+        block_numbers = sorted(set(INODE_BLOCK_OFFSET + (number * INODE_SIZE) // BLOCK_SIZE for number in numbers))
+        blocks = dict(zip(block_numbers, self.RawBlocks.GetMany(block_numbers)))
+        for number in numbers:
+            inode = Inode()
+            inode.InodeFromBlock(blocks[INODE_BLOCK_OFFSET + (number * INODE_SIZE) // BLOCK_SIZE],
+                                 (number * INODE_SIZE) % BLOCK_SIZE)
+            inodes.append(inode)
+        return inodes
+
+    ## DirPages: generator over the entries of a loaded directory InodeNumber, page_size entries at a time
+    ## Each page is a list of (name, inode number, Inode) tuples and costs one GetMany of the directory blocks it
+    ## spans, plus the inode table blocks of its entries (see InodesOf)
+
+    def DirPages(self, dir_inode, page_size):
+        entries = dir_inode.inode.size // FILE_NAME_DIRENTRY_SIZE
+        for first in range(0, entries, page_size):
+            last = min(entries, first + page_size)
+            first_block = first // FILE_ENTRIES_PER_DATA_BLOCK
+            last_block = (last - 1) // FILE_ENTRIES_PER_DATA_BLOCK
+            blocks = self.RawBlocks.GetMany(dir_inode.inode.block_numbers[first_block:last_block + 1])
+            names = []
+            numbers = []
+            for entry in range(first, last):
+                block = blocks[entry // FILE_ENTRIES_PER_DATA_BLOCK - first_block]
+                index = entry % FILE_ENTRIES_PER_DATA_BLOCK
+                names.append(bytes(self.HelperGetFilenameString(block, index)).rstrip(b'\x00').decode())
+                numbers.append(self.HelperGetFilenameInodeNumber(block, index))
+            yield list(zip(names, numbers, self.InodesOf(numbers)))
+
+    ## ReadDir: lists directory dir with the attributes of every entry (readdirplus)
+    ## Returns a list of (name, inode number, Inode) tuples in directory order, or -1 if dir is not a directory.
+    ## Costs one GetMany of the directory blocks and one of the inode table blocks, whatever the number of entries.
+
+    @MeasuredOp
+    def ReadDir(self, dir):
+        LOG.Debug('ReadDir: %s', dir)
+
+        dir_inode = InodeNumber(self.RawBlocks, dir)
+        dir_inode.InodeNumberToInode()
+        if dir_inode.inode.type != INODE_TYPE_DIR:
+            LOG.Debug("ReadDir: not a directory: %s", dir)
+            return -1
+
+        entries = []
+        for page in self.DirPages(dir_inode, max(1, dir_inode.inode.size // FILE_NAME_DIRENTRY_SIZE)):
+            entries.extend(page)
+        return entries
+
+    ## ReadDirPages: ReadDir for large directories, as a generator of pages of at most page_size entries
+    ## Only the blocks of the current page are fetched; nothing is yielded if dir is not a directory
+
+    def ReadDirPages(self, dir, page_size=FILE_ENTRIES_PER_DATA_BLOCK):
+        LOG.Debug('ReadDirPages: %s, %s', dir, page_size)
+
+        dir_inode = InodeNumber(self.RawBlocks, dir)
+        dir_inode.InodeNumberToInode()
+        if dir_inode.inode.type != INODE_TYPE_DIR:
+            LOG.Debug("ReadDirPages: not a directory: %s", dir)
+            return
+        for page in self.DirPages(dir_inode, page_size):
+            yield page
+
     ## Scans inode table to find an available entry
 
     def FindAvailableInode(self):
 
-        logging.debug('FindAvailableInode: ')
+        LOG.Debug('FindAvailableInode: ')
 
         for i in range(0, MAX_NUM_INODES):
 
@@ -558,17 +775,17 @@ class FileName():
             inode_number.InodeNumberToInode()
 
             if inode_number.inode.type == INODE_TYPE_INVALID:
-                logging.debug("FindAvailableInode: " + str(i))
+                LOG.Debug("FindAvailableInode: %s", i)
                 return i
 
-        logging.debug("FindAvailableInode: no available inodes")
+        LOG.Debug("FindAvailableInode: no available inodes")
         return -1
 
     ## Returns index to an available entry in directory data block
 
     def FindAvailableFileEntry(self, dir):
 
-        logging.debug('FindAvailableFileEntry: dir: ' + str(dir))
+        LOG.Debug('FindAvailableFileEntry: dir: %s', dir)
 
         # Initialize inode_number object from raw storage
         inode_number = InodeNumber(self.RawBlocks, dir)
@@ -577,17 +794,17 @@ class FileName():
         # Check if there is still room for another (filename,inode) entry
         # the inode cannot exceed maximum size
         if inode_number.inode.size >= MAX_FILE_SIZE:
-            logging.debug("FindAvailableFileEntry: no entries available")
+            LOG.Debug("FindAvailableFileEntry: no entries available")
             return -1
 
-        logging.debug("FindAvailableFileEntry: " + str(inode_number.inode.size))
+        LOG.Debug("FindAvailableFileEntry: %s", inode_number.inode.size)
         return inode_number.inode.size
 
     ## Allocate a data block, update free bitmap, and return its number
 
     def AllocateDataBlock(self):
 
-        logging.debug('AllocateDataBlock: ')
+        LOG.Debug('AllocateDataBlock: ')
 
         # Scan through all available data blocks
         for block_number in range(DATA_BLOCKS_OFFSET, TOTAL_NUM_BLOCKS):
@@ -604,14 +821,15 @@ class FileName():
                 # Mark it as used in bitmap
                 block[block_number % BLOCK_SIZE] = 1
                 self.RawBlocks.Put(bitmap_block, block)
-                logging.debug('AllocateDataBlock: allocated ' + str(block_number))
+                LOG.Debug('AllocateDataBlock: allocated %s', block_number)
                 return block_number
 
-        logging.debug('AllocateDataBlock: no free data blocks available')
+        LOG.Debug('AllocateDataBlock: no free data blocks available')
         quit()
 
     ## Initializes the root inode
 
+    @MeasuredOp
     def InitRootInode(self):
 
         # Root inode has well-known value 0
@@ -632,40 +850,40 @@ class FileName():
     ## dir is the inode number of a directory to hold the object
     ## name is the object's name
 
+    @MeasuredOp
     def Create(self, dir, name, type):
-        logging.debug("Create: dir: " + str(dir) + ", name: " + str(name) + ", type: " + str(type))
+        LOG.Debug("Create: dir: %s, name: %s, type: %s", dir, name, type)
 
         # Ensure type is valid
         if not (type == INODE_TYPE_FILE or type == INODE_TYPE_DIR):
-            logging.debug("Create: type not supported")
+            LOG.Debug("Create: type not supported")
             return -1
 
         # Find if there is an available inode
         inode_position = self.FindAvailableInode()
         if inode_position == -1:
-            logging.debug("Create: no free inode available")
+            LOG.Debug("Create: no free inode available")
             return -1
 
         # Obtain dir_inode_number_inode, ensure it is a directory
         dir_inode = InodeNumber(self.RawBlocks, dir)
         dir_inode.InodeNumberToInode()
         if dir_inode.inode.type != INODE_TYPE_DIR:
-            logging.debug("Create: dir is not a directory")
+            LOG.Debug("Create: dir is not a directory")
             return -1
 
         # Find available slot in directory data block
         fileentry_position = self.FindAvailableFileEntry(dir)
         if fileentry_position == -1:
-            logging.debug("Create: no entry available for another object")
+            LOG.Debug("Create: no entry available for another object")
             return -1
 
         # Ensure it's not a duplicate - if Lookup returns anything other than -1
         if self.Lookup(name, dir) != -1:
-            logging.debug("Create: name already exists")
+            LOG.Debug("Create: name already exists")
             return -1
 
-        logging.debug(
-            "Create: inode_position: " + str(inode_position) + ", fileentry_position: " + str(fileentry_position))
+        LOG.Debug("Create: inode_position: %s, fileentry_position: %s", inode_position, fileentry_position)
 
         # time.sleep(3)
 
@@ -715,32 +933,36 @@ class FileName():
         return inode_position
 
     ## Writes data to a file, starting at offset
-    ## offset must be less than or equal to the file's size
+    ## offset may be past the end of the file: the blocks in between are not allocated, they are holes that read
+    ## as zeros (see Seek)
     ## data is a block array
     ## returns number of bytes written
 
+    @MeasuredOp
     def Write(self, file_inode_number, offset, data):
 
-        logging.debug(
-            "Write: file_inode_number: " + str(file_inode_number) + ", offset: " + str(offset) + ", len(data): " + str(
-                len(data)))
+        LOG.Debug("Write: file_inode_number: %s, offset: %s, len(data): %s", file_inode_number, offset, len(data))
         # logging.debug (str(data))
 
         file_inode = InodeNumber(self.RawBlocks, file_inode_number)
         file_inode.InodeNumberToInode()
 
         if file_inode.inode.type != INODE_TYPE_FILE:
-            logging.debug("Write: not a file")
+            LOG.Debug("Write: not a file")
             return -1
 
-        if offset > file_inode.inode.size:
-            logging.debug("Write: offset larger than file size " + str(file_inode.inode.size))
+        if offset < 0:
+            LOG.Debug("Write: negative offset %s", offset)
             return -1
 
         if offset + len(data) > MAX_FILE_SIZE:
-            logging.debug("Write: exceeds maximum file size: " + str(MAX_FILE_SIZE))
+            LOG.Debug("Write: exceeds maximum file size: %s", MAX_FILE_SIZE)
             return -1
 
+        # an empty write leaves the file as it is, even past its end
+        if len(data) == 0:
+            return 0
+
         # initialize variables used in the while loop
         current_offset = offset
         bytes_written = 0
@@ -756,8 +978,8 @@ class FileName():
             # next block's boundary (in Bytes relative to file 0)
             next_block_boundary = (current_block_index + 1) * BLOCK_SIZE
 
-            logging.debug('Write: current_block_index: ' + str(current_block_index) + ' , next_block_boundary: ' + str(
-                next_block_boundary))
+            LOG.Debug('Write: current_block_index: %s , next_block_boundary: %s',
+                      current_block_index, next_block_boundary)
 
             # byte position where the slice of data to write should start, within a block
             # the first time around in the loop, this may not be aligned with block boundary (i.e. 0) depending on offset
@@ -775,7 +997,7 @@ class FileName():
                 # otherwise, the data is truncated within this block
                 write_end = (offset + len(data)) % BLOCK_SIZE
 
-            logging.debug('Write: write_start: ' + str(write_start) + ' , write_end: ' + str(write_end))
+            LOG.Debug('Write: write_start: %s , write_end: %s', write_start, write_end)
 
             # retrieve index of block to be written from inode's list
             block_number = file_inode.inode.block_numbers[current_block_index]
@@ -787,43 +1009,37 @@ class FileName():
                 file_inode.inode.block_numbers[current_block_index] = new_block
                 block_number = new_block
 
-            # first, we read the whole block from raw storage
-            block = file_inode.RawBlocks.Get(block_number)
-
-            # copy slice of data into the right position in the block
-            block[write_start:write_end] = data[bytes_written:bytes_written + (write_end - write_start)]
-
-            # now write modified block back to disk
-            file_inode.RawBlocks.Put(block_number, block)
+            # write the slice of data into the right position in the block; the server keeps the rest of the block
+            file_inode.RawBlocks.ReadModifyWrite(block_number, write_start,
+                                                 data[bytes_written:bytes_written + (write_end - write_start)])
 
             # update offset, bytes written
             current_offset += write_end - write_start
             bytes_written += write_end - write_start
 
-            logging.debug('Write: current_offset: ' + str(current_offset) + ' , bytes_written: ' + str(
-                bytes_written) + ' , len(data): ' + str(len(data)))
+            LOG.Debug('Write: current_offset: %s , bytes_written: %s , len(data): %s',
+                      current_offset, bytes_written, len(data))
 
         # Update inode's metadata and write to storage
-        file_inode.inode.size += bytes_written
+        file_inode.inode.size = max(file_inode.inode.size, offset + bytes_written)
         file_inode.StoreInode()
 
         return bytes_written
 
+    @MeasuredOp
     def Read(self, file_inode_number, offset, count):
 
-        logging.debug(
-            "Read: file_inode_number: " + str(file_inode_number) + ", offset: " + str(offset) + ", count: " + str(
-                count))
+        LOG.Debug("Read: file_inode_number: %s, offset: %s, count: %s", file_inode_number, offset, count)
 
         file_inode = InodeNumber(self.RawBlocks, file_inode_number)
         file_inode.InodeNumberToInode()
 
         if file_inode.inode.type != INODE_TYPE_FILE:
-            logging.debug("Read: not a file")
+            LOG.Debug("Read: not a file")
             return -1
 
         if offset > file_inode.inode.size:
-            logging.debug("Read: offset larger than file size " + str(file_inode.inode.size))
+            LOG.Debug("Read: offset larger than file size %s", file_inode.inode.size)
             return -1
 
         # initialize variables used in the while loop
@@ -846,8 +1062,8 @@ class FileName():
             # next block's boundary (in Bytes relative to file 0)
             next_block_boundary = (current_block_index + 1) * BLOCK_SIZE
 
-            logging.debug('Read: current_block_index: ' + str(current_block_index) + ' , next_block_boundary: ' + str(
-                next_block_boundary))
+            LOG.Debug('Read: current_block_index: %s , next_block_boundary: %s',
+                      current_block_index, next_block_boundary)
 
             read_start = current_offset % BLOCK_SIZE
 
@@ -858,83 +1074,124 @@ class FileName():
                 # otherwise, the data is truncated within this block
                 read_end = (offset + bytes_to_read) % BLOCK_SIZE
 
-            logging.debug('Read: read_start: ' + str(read_start) + ' , read_end: ' + str(read_end))
+            LOG.Debug('Read: read_start: %s , read_end: %s', read_start, read_end)
 
             # retrieve index of block to be written from inode's list
             block_number = file_inode.inode.block_numbers[current_block_index]
 
-            # first, we read the whole block from raw storage
-            block = file_inode.RawBlocks.Get(block_number)
+            # a hole: read_block already holds zeros there
+            if block_number != 0:
+                # first, we read the whole block from raw storage
+                block = file_inode.RawBlocks.Get(block_number)
 
-            # copy slice of data into the right position in the block
-            read_block[bytes_read:bytes_read + (read_end - read_start)] = block[read_start:read_end]
+                # copy slice of data into the right position in the block
+                read_block[bytes_read:bytes_read + (read_end - read_start)] = block[read_start:read_end]
 
             bytes_read += read_end - read_start
             current_offset += read_end - read_start
 
-            logging.debug('Read: current_offset: ' + str(current_offset) + ' , bytes_read: ' + str(bytes_read))
+            LOG.Debug('Read: current_offset: %s , bytes_read: %s', current_offset, bytes_read)
 
         return read_block
 
+    ## Seek: finds data or holes in a file, like lseek(2) with SEEK_DATA and SEEK_HOLE, so copy tools can skip holes
+    ## whence SEEK_DATA: the first offset at or after offset within an allocated block
+    ## whence SEEK_HOLE: the first offset at or after offset within a hole; the end of the file counts as a hole
+    ## Returns -1 if offset is not within the file, or for SEEK_DATA if only holes follow it
+    ## Only the inode is looked at, no data block is read
+
+    @MeasuredOp
+    def Seek(self, file_inode_number, offset, whence):
+
+        LOG.Debug("Seek: file_inode_number: %s, offset: %s, whence: %s", file_inode_number, offset, whence)
+
+        if whence != SEEK_DATA and whence != SEEK_HOLE:
+            LOG.Debug("Seek: whence not supported")
+            return -1
+
+        file_inode = InodeNumber(self.RawBlocks, file_inode_number)
+        file_inode.InodeNumberToInode()
+
+        if file_inode.inode.type != INODE_TYPE_FILE:
+            LOG.Debug("Seek: not a file")
+            return -1
+
+        if offset < 0 or offset >= file_inode.inode.size:
+            LOG.Debug("Seek: offset not within file size %s", file_inode.inode.size)
+            return -1
+
+        while offset < file_inode.inode.size:
+            allocated = file_inode.inode.block_numbers[offset // BLOCK_SIZE] != 0
+            if allocated == (whence == SEEK_DATA):
+                return offset
+            # skip to the next block
+            offset = (offset // BLOCK_SIZE + 1) * BLOCK_SIZE
+
+        if whence == SEEK_HOLE:
+            return file_inode.inode.size
+        return -1
+
     def PathToInodeNumber(self, path, dir):
 
-        logging.debug("PathToInodeNumber: path: " + str(path) + ", dir: " + str(dir))
+        LOG.Debug("PathToInodeNumber: path: %s, dir: %s", path, dir)
 
         if "/" in path:
             split_path = path.split("/")
             first = split_path[0]
             del split_path[0]
             rest = "/".join(split_path)
-            logging.debug("PathToInodeNumber: first: " + str(first) + ", rest: " + str(rest))
+            LOG.Debug("PathToInodeNumber: first: %s, rest: %s", first, rest)
             d = self.Lookup(first, dir)
             return self.PathToInodeNumber(rest, d)
         else:
             return self.Lookup(path, dir)
 
+    @MeasuredOp
     def GeneralPathToInodeNumber(self, path, cwd):
 
-        logging.debug("GeneralPathToInodeNumber: path: " + str(path) + ", cwd: " + str(cwd))
+        LOG.Debug("GeneralPathToInodeNumber: path: %s, cwd: %s", path, cwd)
 
         if path[0] == "/":
             if len(path) == 1:  # special case: root
                 return 0
             cut_path = path[1:len(path)]
-            logging.debug("GeneralPathToInodeNumber: cut_path: " + str(cut_path))
+            LOG.Debug("GeneralPathToInodeNumber: cut_path: %s", cut_path)
             return self.PathToInodeNumber(cut_path, 0)
         else:
             return self.PathToInodeNumber(path, cwd)
 
+    @MeasuredOp
     def Link(self, target, name, cwd):
 
-        logging.debug("Link: target: " + str(target) + ", name: " + str(name) + ", cwd: " + str(cwd))
+        LOG.Debug("Link: target: %s, name: %s, cwd: %s", target, name, cwd)
 
         target_inode_number = self.GeneralPathToInodeNumber(target, cwd)
         if target_inode_number == -1:
-            logging.debug("Link: target does not exist")
+            LOG.Debug("Link: target does not exist")
             return -1
 
         cwd_inode = InodeNumber(self.RawBlocks, cwd)
         cwd_inode.InodeNumberToInode()
         if cwd_inode.inode.type != INODE_TYPE_DIR:
-            logging.debug("Link: cwd is not a directory")
+            LOG.Debug("Link: cwd is not a directory")
             return -1
 
         # Find available slot in directory data block
         fileentry_position = self.FindAvailableFileEntry(cwd)
         if fileentry_position == -1:
-            logging.debug("Link: no entry available for another link")
+            LOG.Debug("Link: no entry available for another link")
             return -1
 
         # Ensure it's not a duplicate - if Lookup returns anything other than -1
         if self.Lookup(name, cwd) != -1:
-            logging.debug("Link: name already exists")
+            LOG.Debug("Link: name already exists")
             return -1
 
         # Ensure target is a file
         target_obj = InodeNumber(self.RawBlocks, target_inode_number)
         target_obj.InodeNumberToInode()
         if target_obj.inode.type != INODE_TYPE_FILE:
-            logging.debug("Link: target must be a file")
+            LOG.Debug("Link: target must be a file")
             return -1
 
         # Add to directory (filename,inode) table
@@ -0,0 +1,83 @@
+import collections, logging, time
+
+## Hot-path logging for DiskBlocks, InodeNumber and FileName
+## logging.debug('Put: ' + str(block.hex())) builds its message, hex dump included, even when DEBUG is off.
+## LOG.Debug('Put: %s', Hex(block)) takes the format and its arguments instead and formats nothing itself; what it
+## does is decided once, by LOG.Configure, which binds LOG.Debug to one of:
+##   production: an empty function; no message is built and nothing is kept
+##   debug: logging.debug, which formats the message only if a handler wants DEBUG records
+## With ring_size > 0, every Debug event is also kept, unformatted, in a ring buffer of the last ring_size events,
+## and LOG.Error logs them after the error, so a failure comes with the events that led to it.
+## Until Configure is called, LOG uses the production profile without a ring buffer.
+
+PROFILES = ['production', 'debug']
+
+## Hex: block contents in a log event, turned into a hex string only when the event is formatted
+
+class Hex():
+    __slots__ = ['data']
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return self.data.hex()
+
+def Ignore(msg, *args):
+    pass
+
+class HotLog():
+    def __init__(self):
+        self.Configure('production')
+
+    ## Configure: selects the profile and the ring buffer size (0: no ring buffer)
+
+    def Configure(self, profile, ring_size=0):
+        if profile not in PROFILES:
+            raise ValueError('unknown logging profile: ' + str(profile))
+        self.profile = profile
+        self.ring = collections.deque(maxlen=ring_size) if ring_size > 0 else None
+        # True when Debug does anything; call sites with costly arguments can test it first
+        self.debug = profile == 'debug' or self.ring is not None
+        if profile == 'debug':
+            self.Debug = self.Forward if self.ring is not None else logging.debug
+        else:
+            self.Debug = self.Record if self.ring is not None else Ignore
+
+    ## Record: keeps one event in the ring buffer; block contents are copied, as the caller may reuse its buffer
+
+    def Record(self, msg, *args):
+        for arg in args:
+            if arg.__class__ is Hex:
+                args = tuple(Hex(bytes(a.data)) if a.__class__ is Hex else a for a in args)
+                break
+        self.ring.append((time.time(), msg, args))
+
+    def Forward(self, msg, *args):
+        self.Record(msg, *args)
+        logging.debug(msg, *args)
+
+    ## Error: logs an error, followed by the events in the ring buffer (which is then emptied)
+
+    def Error(self, msg, *args):
+        logging.error(msg, *args)
+        if self.ring is not None and len(self.ring) > 0:
+            lines = self.Recent()
+            self.ring.clear()
+            logging.error('%d event(s) before the error:\n%s', len(lines), '\n'.join(lines))
+
+    ## Recent: the events in the ring buffer, oldest first, formatted
+
+    def Recent(self):
+        if self.ring is None:
+            return []
+        lines = []
+        for stamp, msg, args in list(self.ring):
+            try:
+                text = msg % args if len(args) > 0 else msg
+            except (TypeError, ValueError):
+                text = msg + ' ' + repr(args)
+            lines.append(time.strftime('%H:%M:%S', time.localtime(stamp)) + ('%.6f' % (stamp % 1))[1:] + ' ' + text)
+        return lines
+
+LOG = HotLog()
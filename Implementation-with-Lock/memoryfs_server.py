@@ -1,20 +1,41 @@
 from xmlrpc.server import SimpleXMLRPCServer
 from xmlrpc.server import SimpleXMLRPCRequestHandler
 from memoryfs_client import *
+import sys, xmlrpc.client
 
 # Restrict to a particular path.
 class RequestHandler(SimpleXMLRPCRequestHandler):
     rpc_paths = ('/RPC2',)
 
+# Port to listen on, 8080 unless given as the first argument (the benchmarks start servers on free ports)
+port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+
 # Create server
-with SimpleXMLRPCServer(('localhost', 8080), requestHandler=RequestHandler) as server:
+with SimpleXMLRPCServer(('localhost', port), requestHandler=RequestHandler) as server:
 
-    block = []
+    # Raw blocks, stored sparsely: block number -> contents, for blocks that are not all zeros
+    # A block missing from block is zero_block
+    zero_block = bytes(BLOCK_SIZE)
+    block = {}
     initialized = {'flag': 0}
-    # Initialize raw blocks
+
+    # Cache coherence state
+    # holders[i] is the set of client ids that hold a cached copy of block i
+    # invalidations[client_id] is the set of blocks that client must drop before it uses its cache again
+    holders = []
     for i in range(0, TOTAL_NUM_BLOCKS):
-        putdata = bytearray(BLOCK_SIZE)
-        block.insert(i, putdata)
+        holders.insert(i, set())
+    invalidations = {}
+
+    ## Invalidate: called on every write; other clients holding block_number are told to drop it
+    ## The writer keeps its copy, since it wrote the new contents through its own cache
+    def Invalidate(block_number, writer):
+        for client_id in holders[block_number]:
+            if client_id != writer:
+                invalidations[client_id].add(block_number)
+        holders[block_number] = set()
+        if writer in invalidations:
+            holders[block_number].add(writer)
 
     def GetFlag():
         return initialized['flag']
@@ -25,25 +46,117 @@ with SimpleXMLRPCServer(('localhost', 8080), requestHandler=RequestHandler) as s
         return 0
     server.register_function(SetFlag, 'SetFlag')
 
+    ## Register: gives a caching client the id it passes to Put and GetMany
+    def Register():
+        client_id = len(invalidations)
+        invalidations[client_id] = set()
+        return client_id
+    server.register_function(Register, 'Register')
+
     ## Put: interface to write a raw block of data to the block indexed by block number
     ## Blocks are padded with zeroes up to BLOCK_SIZE
-    def Put(block_number, putdata):
+    ## client_id is only passed by caching clients, so that their own copy is not invalidated
+    def Put(block_number, putdata, client_id=-1):
         # Write block
-        block[block_number] = putdata
+        if (putdata.data if isinstance(putdata, xmlrpc.client.Binary) else putdata) == zero_block:
+            block.pop(block_number, None)
+        else:
+            block[block_number] = putdata
+        Invalidate(block_number, client_id)
         return 0
     server.register_function(Put, 'Put')
 
     ## Get: interface to read a raw block of data from block indexed by block number
     ## Equivalent to the textbook's BLOCK_NUMBER_TO_BLOCK(b)
     def Get(block_number):
-        return block[block_number]
+        return block.get(block_number, zero_block)
     server.register_function(Get, 'Get')
 
+    ## GetMany: reads a list of blocks in one request
+    ## A caching client passes its client_id and is recorded as a holder of every block returned
+    def GetMany(block_numbers, client_id=-1):
+        if client_id in invalidations:
+            for block_number in block_numbers:
+                holders[block_number].add(client_id)
+        return [block.get(block_number, zero_block) for block_number in block_numbers]
+    server.register_function(GetMany, 'GetMany')
+
+    ## Format: resets every block to zeros in one request; caching clients drop every block they hold
+    def Format():
+        block.clear()
+        for i in range(0, TOTAL_NUM_BLOCKS):
+            holders[i] = set()
+        for client_id in invalidations:
+            invalidations[client_id] = set(range(0, TOTAL_NUM_BLOCKS))
+        return 0
+    server.register_function(Format, 'Format')
+
+    ## GetInvalidations: returns (and forgets) the blocks written by other clients since the last call
+    ## Caching clients call this right after ACQUIRE, before trusting their cache
+    def GetInvalidations(client_id):
+        invalid = sorted(invalidations[client_id])
+        invalidations[client_id] = set()
+        return invalid
+    server.register_function(GetInvalidations, 'GetInvalidations')
+
+    ## Compound operations: a read and the write or search that depends on it, done on the server in one request
+    ## instead of a Get followed by a Put or by a scan on the client. The server handles one request at a time,
+    ## so each runs atomically.
+
+    ## Contents: block block_number as bytes (blocks written by clients are stored as xmlrpc.client.Binary)
+    def Contents(block_number):
+        content = block.get(block_number, zero_block)
+        if isinstance(content, xmlrpc.client.Binary):
+            return content.data
+        return bytes(content)
+
+    ## ReadModifyWrite: replaces the bytes at offset in block block_number with data, keeping the rest of the block
+    ## client_id as in Put
+    def ReadModifyWrite(block_number, offset, data, client_id=-1):
+        if isinstance(data, xmlrpc.client.Binary):
+            data = data.data
+        updated = bytearray(Contents(block_number))
+        updated[offset:offset + len(data)] = data
+        return Put(block_number, updated, client_id)
+    server.register_function(ReadModifyWrite, 'ReadModifyWrite')
+
+    ## LookupInDirBlocks: searches the first size bytes of a directory, stored in blocks block_numbers, for the entry
+    ## name (padded with zeroes to MAX_FILENAME); returns its inode number, or -1
+    def LookupInDirBlocks(block_numbers, size, name):
+        if isinstance(name, xmlrpc.client.Binary):
+            name = name.data
+        scanned = 0
+        for block_number in block_numbers:
+            content = Contents(block_number)
+            position = 0
+            while position < BLOCK_SIZE and scanned < size:
+                if content[position:position + MAX_FILENAME] == name:
+                    return int.from_bytes(content[position + MAX_FILENAME:position + FILE_NAME_DIRENTRY_SIZE], 'big')
+                position += FILE_NAME_DIRENTRY_SIZE
+                scanned += FILE_NAME_DIRENTRY_SIZE
+        return -1
+    server.register_function(LookupInDirBlocks, 'LookupInDirBlocks')
+
+    ## LookupInDir: LookupInDirBlocks on directory inode dir, read from the inode table here as well
+    ## Returns the inode number of name, -1 if not found, or -2 if dir is not a directory
+    def LookupInDir(dir, name):
+        inode = Inode()
+        inode.InodeFromBlock(Contents(INODE_BLOCK_OFFSET + (dir * INODE_SIZE) // BLOCK_SIZE),
+                             (dir * INODE_SIZE) % BLOCK_SIZE)
+        if inode.type != INODE_TYPE_DIR:
+            return -2
+        blocks = (inode.size + BLOCK_SIZE - 1) // BLOCK_SIZE
+        return LookupInDirBlocks(inode.block_numbers[:blocks], inode.size, name)
+    server.register_function(LookupInDir, 'LookupInDir')
+
     def ReadSetBlock(block_number, lock_flag):
-        lock = block[block_number]
+        lock = block.get(block_number, zero_block)
         Put(block_number, lock_flag)
         return lock
     server.register_function(ReadSetBlock, 'ReadSetBlock')
 
+    # system.multicall: a client can send several of the calls above in one HTTP request
+    server.register_multicall_functions()
+
     # Run the server's main loop
     server.serve_forever()
\ No newline at end of file
@@ -1,5 +1,7 @@
 from memoryfs_client import *
-import time
+from memoryfs_metrics import FormatSnapshot
+from memoryfs_trace import Tracer, FormatTree
+import sys, time, json
 
 ## This class implements an interactive shell to navigate the file system
 
@@ -9,6 +11,7 @@ class FSShell():
     # we start in the root directory
     self.cwd = 0
     self.FileObject = file
+    self.tracer = Tracer()
 
   # implements cd (change directory)
   def cd(self, dir):
@@ -65,30 +68,43 @@ class FSShell():
       return -1
     return 0
 
+  # implements write (writes a string at an offset; past the end of the file, the bytes skipped are a hole)
+  def write(self, filename, offset, string):
+    i = self.FileObject.Lookup(filename, self.cwd)
+    if i == -1:
+      print ("Error: not found\n")
+      return -1
+    written = self.FileObject.Write(i, offset, bytearray(string,"utf-8"))
+    if written == -1:
+      print ("Error: cannot write file\n")
+      return -1
+    print ("Successfully wrote " + str(written) + " bytes.")
+    return 0
+
+  # implements extents (lists the byte ranges of a file that hold data, skipping holes)
+  def extents(self, filename):
+    i = self.FileObject.Lookup(filename, self.cwd)
+    if i == -1:
+      print ("Error: not found\n")
+      return -1
+    offset = self.FileObject.Seek(i, 0, SEEK_DATA)
+    while offset != -1:
+      end = self.FileObject.Seek(i, offset, SEEK_HOLE)
+      print ("data: " + str(offset) + "-" + str(end))
+      offset = self.FileObject.Seek(i, end, SEEK_DATA)
+    return 0
+
   # implements ls (lists files in directory)
   def ls(self):
-    inobj = InodeNumber(self.FileObject.RawBlocks, self.cwd)
-    inobj.InodeNumberToInode()
-    block_index = 0
-    while block_index <= (inobj.inode.size // BLOCK_SIZE):
-      block = self.FileObject.RawBlocks.Get(inobj.inode.block_numbers[block_index])
-      if block_index == (inobj.inode.size // BLOCK_SIZE):
-        end_position = inobj.inode.size % BLOCK_SIZE
+    entries = self.FileObject.ReadDir(self.cwd)
+    if entries == -1:
+      print ("Error: not a directory\n")
+      return -1
+    for name, number, inode in entries:
+      if inode.type == INODE_TYPE_DIR:
+        print ("[" + str(inode.refcnt) + "]:" + name + "/")
       else:
-        end_position = BLOCK_SIZE
-      current_position = 0
-      while current_position < end_position:
-        entryname = block[current_position:current_position+MAX_FILENAME]
-        entryinode = block[current_position+MAX_FILENAME:current_position+FILE_NAME_DIRENTRY_SIZE]
-        entryinodenumber = int.from_bytes(entryinode, byteorder='big')
-        inobj2 = InodeNumber(self.FileObject.RawBlocks, entryinodenumber)
-        inobj2.InodeNumberToInode()
-        if inobj2.inode.type == INODE_TYPE_DIR:
-          print ("[" + str(inobj2.inode.refcnt) + "]:" + entryname.decode() + "/")
-        else:
-          print ("[" + str(inobj2.inode.refcnt) + "]:" + entryname.decode())
-        current_position += FILE_NAME_DIRENTRY_SIZE
-      block_index += 1
+        print ("[" + str(inode.refcnt) + "]:" + name)
     return 0
 
   # implements cat (print file contents)
@@ -109,19 +125,54 @@ class FSShell():
   def ACQUIRE(self):
     lock_block = 0
     lock_flag = b'\x01'
-    cur_lock = self.FileObject.RawBlocks.server.ReadSetBlock(lock_block, lock_flag)
+    cur_lock = self.FileObject.RawBlocks.Call('ReadSetBlock', lock_block, lock_flag)
     while cur_lock == lock_flag:
-      cur_lock = self.FileObject.RawBlocks.server.ReadSetBlock(lock_block, lock_flag)
+      cur_lock = self.FileObject.RawBlocks.Call('ReadSetBlock', lock_block, lock_flag)
+    # blocks written by other clients while we did not hold the lock are dropped from our cache
+    self.FileObject.RawBlocks.Revalidate()
 
   def RELEASE(self):
     lock_block = 0
     unlock_flag = b'\x00'
-    self.FileObject.RawBlocks.server.Put(lock_block, unlock_flag)
+    # with pipelining, the writes of the command are sent in the same request, just before the unlock
+    self.FileObject.RawBlocks.Call('Put', lock_block, unlock_flag)
 
   def show_request(self):
     print("")
-    print("Put() request number: " + str(self.FileObject.RawBlocks.servers_put))
-    print("Get() request number: " + str(self.FileObject.RawBlocks.servers_get))
+    print("Put() block(s): " + str(self.FileObject.RawBlocks.get_put_request()))
+    print("Get() block(s): " + str(self.FileObject.RawBlocks.get_get_request()))
+    if self.FileObject.RawBlocks.cache is not None:
+      print("Cache hits: " + str(self.FileObject.RawBlocks.get_cache_hits()))
+    print("Round trips: " + str(self.FileObject.RawBlocks.get_round_trips()))
+
+  # implements stats: the client metrics as tables, as JSON (stats json), or resets them (stats reset)
+  def stats(self, mode):
+    if mode == "reset":
+      self.FileObject.RawBlocks.reset_metrics()
+      print("Metrics reset")
+    elif mode == "json":
+      print(json.dumps(self.FileObject.RawBlocks.get_metrics(), indent=1))
+    else:
+      print(FormatSnapshot(self.FileObject.RawBlocks.get_metrics()))
+    return 0
+
+  # implements trace: on/off, show [depth] (spans merged by call path, then cleared), save <file> [chrome]
+  def trace(self, args):
+    if args[0] == "on":
+      self.tracer.Clear()
+      self.tracer.Enable()
+    elif args[0] == "off":
+      self.tracer.Disable()
+    elif args[0] == "show":
+      print(FormatTree(self.tracer.Tree(), int(args[1]) if len(args) == 2 else None))
+      self.tracer.Clear()
+    elif args[0] == "save":
+      if len(args) == 3 and args[2] == "chrome":
+        self.tracer.ExportChrome(args[1])
+      else:
+        self.tracer.ExportJSON(args[1])
+      print("Saved " + str(len(self.tracer.Spans())) + " span(s) to " + args[1])
+    return 0
 
   def Interpreter(self):
     try:
@@ -160,12 +211,33 @@ class FSShell():
               print("Error: append requires two arguments")
             else:
               self.append(splitcmd[1], splitcmd[2])
+          elif splitcmd[0] == "write":
+            if len(splitcmd) != 4 or not splitcmd[2].isdigit():
+              print("Error: write requires a file name, an offset and a string")
+            else:
+              self.write(splitcmd[1], int(splitcmd[2]), splitcmd[3])
+          elif splitcmd[0] == "extents":
+            if len(splitcmd) != 2:
+              print("Error: extents requires one argument")
+            else:
+              self.extents(splitcmd[1])
           elif splitcmd[0] == "ls":
             self.ls()
           elif splitcmd[0] == "exit":
             return
           elif splitcmd[0] == "show_request":
             self.show_request()
+          elif splitcmd[0] == "stats":
+            if len(splitcmd) > 2 or (len(splitcmd) == 2 and splitcmd[1] not in ("json", "reset")):
+              print("Error: stats takes no argument, json or reset")
+            else:
+              self.stats(splitcmd[1] if len(splitcmd) == 2 else "")
+          elif splitcmd[0] == "trace":
+            arguments = {"on": (2,), "off": (2,), "show": (2, 3), "save": (3, 4)}
+            if len(splitcmd) < 2 or splitcmd[1] not in arguments or len(splitcmd) not in arguments[splitcmd[1]]:
+              print("Error: trace requires on, off, show [depth] or save <file> [chrome]")
+            else:
+              self.trace(splitcmd[1:])
           else:
             print("command " + splitcmd[0] + "not valid.\n")
         self.RELEASE()
@@ -176,32 +248,39 @@ class FSShell():
 if __name__ == "__main__":
 
   # Initialize file for logging
-  # Changer logging level to INFO to remove debugging messages
-  logging.basicConfig(filename='memoryfs.log', filemode='w', level=logging.DEBUG)
+  # Pass --log-production to drop the debugging messages: the client then builds none of them, and keeps its
+  # last 256 debug events in memory instead, written to the log only when an error is logged
+  if '--log-production' in sys.argv:
+    logging.basicConfig(filename='memoryfs.log', filemode='w', level=logging.INFO)
+    LOG.Configure('production', ring_size=256)
+  else:
+    logging.basicConfig(filename='memoryfs.log', filemode='w', level=logging.DEBUG)
+    LOG.Configure('debug')
 
   # Replace with your UUID, encoded as a byte array
   UUID = b'\x12\x34\x56\x78'
 
   # Initialize file system data
   logging.info('Initializing data structures...')
-  RawBlocks = DiskBlocks('http://localhost:8080')
+  # Pass --cache to keep a coherent block cache across commands, --pipeline to batch each command's writes
+  RawBlocks = DiskBlocks('http://localhost:8080', cache=('--cache' in sys.argv), pipeline=('--pipeline' in sys.argv))
 
-  flag = RawBlocks.server.GetFlag()
+  FileObject = FileName(RawBlocks)
+
+  flag = RawBlocks.Call('GetFlag')
   if flag == 0:
-    # Load blocks from dump file
+    # The first client formats the volume and creates the root directory; clients started later use them as
+    # they are (initializing the root inode again would drop the entries other clients created)
     unlock_flag = b'\x00'
     # RawBlocks.InitializeBlocks(False,UUID)
     RawBlocks.InitializeBlocks(True, UUID)
-    RawBlocks.server.Put(0, unlock_flag)
-    RawBlocks.server.SetFlag()
+    FileObject.InitRootInode()
+    RawBlocks.Call('Put', 0, unlock_flag)
+    RawBlocks.Call('SetFlag')
 
   # Show file system information and contents of first few blocks
   RawBlocks.PrintFSInfo()
   RawBlocks.PrintBlocks("Initialized",0,16)
 
-  # Initialize FileObject inode
-  FileObject = FileName(RawBlocks)
-  FileObject.InitRootInode()
-
   myshell = FSShell(FileObject)
   myshell.Interpreter()